@@ -0,0 +1,69 @@
+"""Threaded vs asyncio sync of projects against the mock server.
+
+    python benchmarks/bench_async.py --projects 20 --issues 50 --latency 0.05
+"""
+
+import os
+import sys
+import time
+import asyncio
+import argparse
+import concurrent.futures
+
+sys.path.insert(0, os.path.dirname(__file__))
+# gino is imported from this checkout, without installing it.
+sys.path.insert(1, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import datagen
+import mock_server
+
+
+def _reset(server, args):
+    import gino.state
+
+    server.data = datagen.generate(
+        args.projects, args.issues, args.notes, url=server.url
+    )
+    server.reset_counts()
+    gino.state.set_backend(gino.state.MemoryBackend())
+
+
+def threaded(args):
+    import gino.gitlab
+
+    projects = list(gino.gitlab.list_projects())
+    with concurrent.futures.ThreadPoolExecutor(max_workers=args.workers) as ex:
+        list(ex.map(gino.gitlab.sync_project_issues, projects))
+
+
+def asynchronous(args):
+    import gino.aio
+    import gino.gitlab
+
+    projects = list(gino.gitlab.list_projects())
+    asyncio.run(gino.aio.sync_projects(projects, [], args.workers))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--projects", type=int, default=10)
+    parser.add_argument("--issues", type=int, default=50)
+    parser.add_argument("--notes", type=int, default=3)
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--workers", type=int, default=8)
+    args = parser.parse_args()
+
+    with mock_server.serve(mock_server.MockData(), args.latency) as server:
+        os.environ.update(server.env())
+        for name, fn in (("threaded", threaded), ("async", asynchronous)):
+            _reset(server, args)
+            t0 = time.perf_counter()
+            fn(args)
+            secs = time.perf_counter() - t0
+            print(f"{name:>10}: {secs:8.2f}s {sum(server.counts.values()):6d} requests")
+            for endpoint, count in server.counts.most_common():
+                print(f"{'':>12}{count:6d} {endpoint}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+"""Per-call cost of gino.common.parse_date vs dateparser.
+
+    python benchmarks/bench_parse_date.py
+"""
+
+import random
+import timeit
+from datetime import datetime, timedelta, timezone
+
+import dateparser
+
+import gino.common
+
+
+def corpus(n: int = 1000):
+    """Timestamps in the formats returned by gitlab and notion."""
+    random.seed(0)
+    now = datetime.now(timezone.utc)
+    dates = []
+    for _ in range(n):
+        d = now - timedelta(seconds=random.randint(0, 365 * 24 * 3600))
+        dates += [
+            # gitlab: created_at, updated_at, closed_at
+            d.strftime("%Y-%m-%dT%H:%M:%S.") + f"{d.microsecond // 1000:03d}Z",
+            # gitlab: due_date
+            d.strftime("%Y-%m-%d"),
+            # notion: created_time, last_edited_time
+            d.strftime("%Y-%m-%dT%H:%M:00.000Z"),
+            # notion: date properties
+            d.strftime("%Y-%m-%dT%H:%M:%S.000+00:00"),
+        ]
+    return dates
+
+
+def _old_parse_date(date):
+    return dateparser.parse(date).replace(tzinfo=timezone.utc)
+
+
+def bench(fn, dates, repeat=3) -> float:
+    """Best per-call time in micro-seconds"""
+    best = min(
+        timeit.repeat(lambda: [fn(d) for d in dates], number=1, repeat=repeat)
+    )
+    return best / len(dates) * 1e6
+
+
+def main():
+    dates = corpus()
+    for d in dates[:4]:
+        assert gino.common.parse_date(d) == _old_parse_date(d), d
+
+    before = bench(_old_parse_date, dates)
+    after = bench(gino.common.parse_date, dates)
+    print(f"{len(dates)} timestamps")
+    print(f"dateparser.parse       : {before:10.2f} us/call")
+    print(f"gino.common.parse_date : {after:10.2f} us/call")
+    print(f"speedup                : {before / after:10.1f}x")
+
+
+if __name__ == "__main__":
+    main()
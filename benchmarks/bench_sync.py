@@ -0,0 +1,124 @@
+"""End-to-end benchmarks of the sync cycle against the mock server.
+
+For each scenario the wall time, the peak memory (tracemalloc) and the number
+of requests per endpoint are reported. Every scenario is run twice on the
+same data: `cold` (empty state) and `warm` (state of the first run, i.e. the
+incremental cost of a cycle with nothing new).
+
+    python benchmarks/bench_sync.py --projects 20 --issues 100 --notes 5
+    python benchmarks/bench_sync.py --only run_once sync_notes --json out.json
+"""
+
+import os
+import sys
+import json
+import time
+import tempfile
+import argparse
+import tracemalloc
+from datetime import datetime, timedelta, timezone
+
+sys.path.insert(0, os.path.dirname(__file__))
+# gino is imported from this checkout, without installing it.
+sys.path.insert(1, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import datagen
+import mock_server
+
+
+def run_once(args):
+    import gino.__main__
+
+    gino.__main__.run_once(workers=args.workers)
+
+
+def sync_notes(args):
+    import gino.gitlab
+
+    for project in gino.gitlab.list_projects():
+        gino.gitlab.sync_notes(project)
+
+
+def sync_blocks(args):
+    import gino.notion
+    import gino.state
+
+    # blocks created before the ledger started are never forwarded.
+    state = gino.state.backend()
+    if state.get(gino.state.DEFAULT, "block-ledger-started-at") is None:
+        long_ago = datetime.now(timezone.utc) - timedelta(days=365)
+        state.put(gino.state.DEFAULT, "block-ledger-started-at", long_ago)
+    gino.notion.sync_recently_added_blocks(args.workers)
+
+
+def task_maturity(args):
+    import gino.gitlab
+
+    gino.gitlab.compute_task_maturity_metric(workers=args.workers)
+
+
+SCENARIOS = dict(
+    run_once=run_once,
+    sync_notes=sync_notes,
+    sync_blocks=sync_blocks,
+    task_maturity=task_maturity,
+)
+
+
+def _measure(server, fn, args) -> dict:
+    server.reset_counts()
+    tracemalloc.start()
+    t0 = time.perf_counter()
+    fn(args)
+    secs = time.perf_counter() - t0
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return dict(secs=secs, peak_mb=peak / 2**20, requests=dict(server.counts))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--projects", type=int, default=10)
+    parser.add_argument("--issues", type=int, default=50)
+    parser.add_argument("--notes", type=int, default=3)
+    parser.add_argument("--latency", type=float, default=0.01)
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--only", nargs="*", choices=list(SCENARIOS))
+    parser.add_argument("--json", help="Write the results to this file")
+    args = parser.parse_args()
+
+    import gino.state
+
+    results = {}
+    with mock_server.serve(mock_server.MockData(), args.latency) as server:
+        os.environ.update(server.env())
+        for name in args.only or SCENARIOS:
+            server.data = datagen.generate(
+                args.projects, args.issues, args.notes, url=server.url
+            )
+            gino.state.set_backend(gino.state.MemoryBackend())
+            cwd = os.getcwd()
+            with tempfile.TemporaryDirectory() as tmp:
+                # task-maturity writes its output to the current directory.
+                os.chdir(tmp)
+                for run in ("cold", "warm"):
+                    result = _measure(server, SCENARIOS[name], args)
+                    results[f"{name}:{run}"] = result
+                    total = sum(result["requests"].values())
+                    print(
+                        f"{name:>14} {run}: {result['secs']:8.2f}s"
+                        f" {result['peak_mb']:8.1f} MB {total:6d} requests"
+                    )
+                    for endpoint, count in sorted(
+                        result["requests"].items(), key=lambda x: -x[1]
+                    ):
+                        print(f"{'':>22}{count:6d} {endpoint}")
+                os.chdir(cwd)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,161 @@
+"""Synthetic GitLab and Notion data for the mock server.
+
+N projects with M issues each and K notes per issue. Issues are a mix of
+new, recently closed, stale and inactive ones. Half of them are linked with
+a notion task whose page has blocks added by users (to be forwarded to
+gitlab by sync-blocks).
+
+    python benchmarks/datagen.py 10 50 5
+"""
+
+import sys
+import uuid
+import random
+import argparse
+from datetime import datetime, timedelta, timezone
+
+from mock_server import BOT_USER_ID, MockData, timestamp
+
+LINKED_WITH_NOTION = "notion:opened"
+
+
+def _page(data: MockData, issue: dict, rnd: random.Random, nblocks: int) -> dict:
+    page_id = str(uuid.UUID(int=rnd.getrandbits(128)))
+    now = datetime.now(timezone.utc)
+    page = dict(
+        object="page",
+        id=page_id,
+        created_time=issue["created_at"],
+        last_edited_time=timestamp(now - timedelta(minutes=rnd.randint(0, 600))),
+        url=f"https://www.notion.so/{page_id.replace('-', '')}",
+        properties=dict(URL=dict(url=issue["web_url"])),
+    )
+    data.pages[page_id] = page
+    data.blocks[page_id] = [
+        dict(
+            object="block",
+            id=str(uuid.UUID(int=rnd.getrandbits(128))),
+            type="paragraph",
+            created_time=page["last_edited_time"],
+            created_by=dict(
+                object="user",
+                id=BOT_USER_ID if k == 0 else rnd.choice(data.users)["id"],
+            ),
+            paragraph=dict(
+                rich_text=[
+                    dict(
+                        type="text",
+                        text=dict(content=f"Update {k} on the task"),
+                        plain_text=f"Update {k} on the task",
+                    )
+                ]
+            ),
+        )
+        for k in range(nblocks)
+    ]
+    return page
+
+
+def generate(
+    nprojects: int,
+    nissues: int,
+    nnotes: int,
+    seed: int = 0,
+    url: str = "",
+    nblocks: int = 3,
+) -> MockData:
+    rnd = random.Random(seed)
+    now = datetime.now(timezone.utc)
+    data = MockData()
+    usernames = [f"user{i}" for i in range(10)]
+    data.users = [
+        dict(
+            object="user",
+            id=str(uuid.UUID(int=i + 1)),
+            type="person",
+            name=name,
+            person=dict(email=f"{name}@example.com"),
+        )
+        for i, name in enumerate(usernames)
+    ]
+    for pid in range(1, nprojects + 1):
+        path = f"group/project{pid}"
+        data.projects[pid] = dict(
+            id=pid,
+            name=f"project{pid}",
+            path_with_namespace=path,
+            name_with_namespace=f"group / project{pid}",
+            archived=False,
+            last_activity_at=timestamp(now - timedelta(minutes=rnd.randint(0, 60))),
+            web_url=f"{url}/{path}",
+        )
+        data.issues[pid] = {}
+        for iid in range(1, nissues + 1):
+            age = rnd.choice([0.1, 1, 3, 20, 40, 120])
+            updated = now - timedelta(days=age)
+            created = updated - timedelta(days=rnd.randint(0, 30))
+            closed = rnd.random() < 0.3
+            issue = dict(
+                id=data.new_id(),
+                iid=iid,
+                project_id=pid,
+                title=f"Issue {iid} of project {pid}",
+                description="Lorem ipsum dolor sit amet. " * rnd.randint(1, 20),
+                state="closed" if closed else "opened",
+                labels=[],
+                created_at=timestamp(created),
+                updated_at=timestamp(updated),
+                closed_at=timestamp(updated) if closed else None,
+                due_date=(created + timedelta(days=14)).strftime("%Y-%m-%d"),
+                web_url=f"{url}/{path}/-/issues/{iid}",
+                author=dict(username=rnd.choice(usernames)),
+                assignees=[dict(username=rnd.choice(usernames))],
+            )
+            notes = [
+                dict(
+                    id=data.new_id(),
+                    body=f"Comment {k} on issue {iid}",
+                    author=dict(username=rnd.choice(usernames)),
+                    created_at=timestamp(updated - timedelta(minutes=k)),
+                    updated_at=timestamp(updated - timedelta(minutes=k)),
+                )
+                for k in range(nnotes)
+            ]
+            if rnd.random() < 0.5:
+                page = _page(data, issue, rnd, nblocks)
+                issue["labels"].append(LINKED_WITH_NOTION)
+                notes.insert(
+                    0,
+                    dict(
+                        id=data.new_id(),
+                        body=f"More information may be found at {page['url']}",
+                        author=dict(username="gino.bot"),
+                        created_at=issue["created_at"],
+                        updated_at=issue["created_at"],
+                    ),
+                )
+            data.issues[pid][iid] = issue
+            data.notes[(pid, iid)] = notes
+    return data
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("projects", type=int)
+    parser.add_argument("issues", type=int)
+    parser.add_argument("notes", type=int)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    data = generate(args.projects, args.issues, args.notes, args.seed)
+    nissues = sum(len(issues) for issues in data.issues.values())
+    nnotes = sum(len(notes) for notes in data.notes.values())
+    nblocks = sum(len(blocks) for blocks in data.blocks.values())
+    print(
+        f"{len(data.projects)} projects, {nissues} issues, {nnotes} notes,"
+        f" {len(data.pages)} pages, {nblocks} blocks",
+        file=sys.stderr,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,423 @@
+"""Local stand-in for the GitLab and Notion APIs used by GiNo.
+
+Only the endpoints (and the parameters) GiNo uses are implemented. Every
+request is counted per endpoint and can be delayed by `latency` seconds to
+simulate the network.
+
+    with serve(datagen.generate(10, 50, 5)) as server:
+        os.environ.update(server.env())
+        ...
+        print(server.counts)
+
+The data is generated by `datagen.py`.
+"""
+
+import re
+import json
+import time
+import uuid
+import threading
+import contextlib
+import typing as T
+import urllib.parse
+from collections import Counter
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+BOT = "gino.bot"
+
+# /api/v4/projects/12/issues/3 -> /api/v4/projects/:id/issues/:id
+ID_SEGMENT = r"/(\d+|[0-9a-f-]{32,36}|group%2F[^/]+)(?=/|$)"
+
+
+def timestamp(d: datetime) -> str:
+    return d.strftime("%Y-%m-%dT%H:%M:%S.") + f"{d.microsecond // 1000:03d}Z"
+
+
+def _now() -> str:
+    return timestamp(datetime.now(timezone.utc))
+
+
+class MockData:
+    """State of the mock GitLab and Notion."""
+
+    def __init__(self):
+        self.projects: T.Dict[int, dict] = {}
+        self.issues: T.Dict[int, T.Dict[int, dict]] = {}
+        self.notes: T.Dict[T.Tuple[int, int], T.List[dict]] = {}
+        self.users: T.List[dict] = []
+        self.pages: T.Dict[str, dict] = {}
+        self.blocks: T.Dict[str, T.List[dict]] = {}
+        self.next_id = 1
+        self.lock = threading.RLock()
+
+    def new_id(self) -> int:
+        with self.lock:
+            self.next_id += 1
+            return self.next_id
+
+
+def _paginate_gitlab(items: list, query: dict):
+    page = int(query.get("page", 1))
+    per_page = int(query.get("per_page", 20))
+    start = (page - 1) * per_page
+    headers = {"X-Page": str(page), "X-Per-Page": str(per_page)}
+    if start + per_page < len(items):
+        headers["X-Next-Page"] = str(page + 1)
+    return items[start : start + per_page], headers
+
+
+def _paginate_notion(items: list, query: dict) -> dict:
+    start = int(query.get("start_cursor") or 0)
+    size = int(query.get("page_size") or 100)
+    more = start + size < len(items)
+    return dict(
+        object="list",
+        results=items[start : start + size],
+        has_more=more,
+        next_cursor=str(start + size) if more else None,
+    )
+
+
+def _matches(issue: dict, query: dict) -> bool:
+    state = query.get("state", "all")
+    if state != "all" and issue["state"] != state:
+        return False
+    for key, field, after in (
+        ("updated_after", "updated_at", True),
+        ("updated_before", "updated_at", False),
+        ("created_after", "created_at", True),
+    ):
+        if key in query:
+            when = datetime.fromisoformat(query[key].replace("Z", "+00:00"))
+            value = datetime.fromisoformat(issue[field].replace("Z", "+00:00"))
+            if (value < when) if after else (value > when):
+                return False
+    if labels := query.get("labels"):
+        if not set(labels.split(",")) <= set(issue["labels"]):
+            return False
+    return True
+
+
+def _labels(value) -> T.List[str]:
+    if isinstance(value, str):
+        return [v for v in value.split(",") if v]
+    return list(value or [])
+
+
+class Handler(BaseHTTPRequestHandler):
+    server: "MockServer"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _reply(self, payload, status=200, headers=None):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        if "X-Next-Page" in (headers or {}):
+            # python-gitlab follows the Link header
+            url = urllib.parse.urlsplit(self.path)
+            query = dict(urllib.parse.parse_qsl(url.query), page=headers["X-Next-Page"])
+            next_url = f"{self.server.url}{url.path}?{urllib.parse.urlencode(query)}"
+            self.send_header("Link", f'<{next_url}>; rel="next"')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _body(self) -> dict:
+        length = int(self.headers.get("Content-Length") or 0)
+        if not length:
+            return {}
+        raw = self.rfile.read(length)
+        try:
+            return json.loads(raw)
+        except ValueError:
+            return dict(urllib.parse.parse_qsl(raw.decode()))
+
+    def _handle(self, method: str):
+        url = urllib.parse.urlsplit(self.path)
+        query = dict(urllib.parse.parse_qsl(url.query))
+        path = url.path
+        self.server.count(method, path)
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        body = self._body() if method in ("POST", "PUT", "PATCH") else {}
+        with self.server.data.lock:
+            for pattern, route_method, handler in ROUTES:
+                if route_method == method and (m := re.fullmatch(pattern, path)):
+                    result = handler(self.server, query, body, *m.groups())
+                    if result is None:
+                        return self._reply(dict(message="404 Not found"), 404)
+                    payload, headers = result if isinstance(result, tuple) else (
+                        result,
+                        {},
+                    )
+                    return self._reply(payload, headers=headers)
+        self._reply(dict(message=f"{method} {path} is not mocked"), 404)
+
+    def do_GET(self):
+        self._handle("GET")
+
+    def do_POST(self):
+        self._handle("POST")
+
+    def do_PUT(self):
+        self._handle("PUT")
+
+    def do_PATCH(self):
+        self._handle("PATCH")
+
+
+def _project(server, pid_or_path: str) -> T.Optional[dict]:
+    projects = server.data.projects
+    pid_or_path = urllib.parse.unquote(pid_or_path)
+    if pid_or_path.isdigit():
+        return projects.get(int(pid_or_path))
+    for project in projects.values():
+        if project["path_with_namespace"] == pid_or_path:
+            return project
+    return None
+
+
+def _issue(server, pid_or_path, iid) -> T.Optional[dict]:
+    if (project := _project(server, pid_or_path)) is None:
+        return None
+    return server.data.issues[project["id"]].get(int(iid))
+
+
+# GitLab
+
+
+def gl_user(server, query, body):
+    return dict(id=1, username=BOT)
+
+
+def gl_projects(server, query, body):
+    projects = list(server.data.projects.values())
+    if after := query.get("last_activity_after"):
+        when = datetime.fromisoformat(after.replace("Z", "+00:00"))
+        projects = [
+            p
+            for p in projects
+            if datetime.fromisoformat(p["last_activity_at"].replace("Z", "+00:00"))
+            >= when
+        ]
+    return _paginate_gitlab(projects, query)
+
+
+def gl_project(server, query, body, pid):
+    return _project(server, pid)
+
+
+def gl_issues(server, query, body, pid):
+    if (project := _project(server, pid)) is None:
+        return None
+    issues = [
+        i for i in server.data.issues[project["id"]].values() if _matches(i, query)
+    ]
+    return _paginate_gitlab(issues, query)
+
+
+def gl_issue(server, query, body, pid, iid):
+    return _issue(server, pid, iid)
+
+
+def gl_update_issue(server, query, body, pid, iid):
+    if (issue := _issue(server, pid, iid)) is None:
+        return None
+    if "labels" in body:
+        issue["labels"] = _labels(body["labels"])
+    for label in _labels(body.get("add_labels")):
+        if label not in issue["labels"]:
+            issue["labels"].append(label)
+    if body.get("state_event") == "close":
+        issue["state"], issue["closed_at"] = "closed", _now()
+    issue["updated_at"] = _now()
+    return issue
+
+
+def gl_notes(server, query, body, pid, iid):
+    if (issue := _issue(server, pid, iid)) is None:
+        return None
+    notes = server.data.notes[(issue["project_id"], issue["iid"])]
+    if query.get("sort") == "desc":
+        notes = notes[::-1]
+    return _paginate_gitlab(notes, query)
+
+
+def gl_create_note(server, query, body, pid, iid):
+    if (issue := _issue(server, pid, iid)) is None:
+        return None
+    note = dict(
+        id=server.data.new_id(),
+        body=body.get("body", ""),
+        author=dict(username=BOT),
+        created_at=_now(),
+        updated_at=_now(),
+    )
+    server.data.notes[(issue["project_id"], issue["iid"])].append(note)
+    issue["updated_at"] = _now()
+    return note
+
+
+def gl_update_note(server, query, body, pid, iid, note_id):
+    if (issue := _issue(server, pid, iid)) is None:
+        return None
+    for note in server.data.notes[(issue["project_id"], issue["iid"])]:
+        if note["id"] == int(note_id):
+            note["body"], note["updated_at"] = body.get("body", ""), _now()
+            return note
+    return None
+
+
+# Notion
+
+
+def _page_id(value: str) -> str:
+    return str(uuid.UUID(value))
+
+
+def _blocks(children: T.List[dict]) -> T.List[dict]:
+    blocks = []
+    for child in children:
+        block = dict(child, id=str(uuid.uuid4()), created_time=_now())
+        block.setdefault("object", "block")
+        block["created_by"] = dict(object="user", id=BOT_USER_ID)
+        for rich_text in block.get(block.get("type", ""), {}).get("rich_text", []):
+            rich_text.setdefault("plain_text", rich_text["text"]["content"])
+        blocks.append(block)
+    return blocks
+
+
+BOT_USER_ID = str(uuid.UUID(int=0))
+
+
+def n_users(server, query, body):
+    return _paginate_notion(server.data.users, query)
+
+
+def n_me(server, query, body):
+    return dict(object="user", id=BOT_USER_ID, type="bot", name="GiNo")
+
+
+def n_create_page(server, query, body):
+    page_id = str(uuid.uuid4())
+    page = dict(
+        object="page",
+        id=page_id,
+        created_time=_now(),
+        last_edited_time=_now(),
+        url=f"https://www.notion.so/{page_id.replace('-', '')}",
+        parent=body.get("parent"),
+        properties=body.get("properties", {}),
+    )
+    server.data.pages[page_id] = page
+    server.data.blocks[page_id] = _blocks(body.get("children", []))
+    return page
+
+
+def n_page(server, query, body, page_id):
+    return server.data.pages.get(_page_id(page_id))
+
+
+def n_update_page(server, query, body, page_id):
+    if (page := server.data.pages.get(_page_id(page_id))) is None:
+        return None
+    page["properties"].update(body.get("properties", {}))
+    page["last_edited_time"] = _now()
+    return page
+
+
+def n_query_database(server, query, body, db_id):
+    pages = list(server.data.pages.values())
+    date = body.get("filter", {}).get("date", {})
+    if after := date.get("after"):
+        pages = [p for p in pages if p["last_edited_time"] > after]
+    return _paginate_notion(pages, body)
+
+
+def n_children(server, query, body, block_id):
+    return _paginate_notion(server.data.blocks.get(_page_id(block_id), []), query)
+
+
+def n_append_children(server, query, body, block_id):
+    page_id = _page_id(block_id)
+    blocks = _blocks(body.get("children", []))
+    server.data.blocks.setdefault(page_id, []).extend(blocks)
+    if page := server.data.pages.get(page_id):
+        page["last_edited_time"] = _now()
+    return dict(object="list", results=blocks, has_more=False, next_cursor=None)
+
+
+ROUTES = [
+    (r"/api/v4/user", "GET", gl_user),
+    (r"/api/v4/projects", "GET", gl_projects),
+    (r"/api/v4/projects/([^/]+)/issues/(\d+)/notes/(\d+)", "PUT", gl_update_note),
+    (r"/api/v4/projects/([^/]+)/issues/(\d+)/notes", "GET", gl_notes),
+    (r"/api/v4/projects/([^/]+)/issues/(\d+)/notes", "POST", gl_create_note),
+    (r"/api/v4/projects/([^/]+)/issues/(\d+)", "GET", gl_issue),
+    (r"/api/v4/projects/([^/]+)/issues/(\d+)", "PUT", gl_update_issue),
+    (r"/api/v4/projects/([^/]+)/issues", "GET", gl_issues),
+    (r"/api/v4/projects/([^/]+)", "GET", gl_project),
+    (r"/v1/users", "GET", n_users),
+    (r"/v1/users/me", "GET", n_me),
+    (r"/v1/pages", "POST", n_create_page),
+    (r"/v1/pages/([0-9a-f-]+)", "GET", n_page),
+    (r"/v1/pages/([0-9a-f-]+)", "PATCH", n_update_page),
+    (r"/v1/databases/([0-9a-f-]+)/query", "POST", n_query_database),
+    (r"/v1/blocks/([0-9a-f-]+)/children", "GET", n_children),
+    (r"/v1/blocks/([0-9a-f-]+)/children", "PATCH", n_append_children),
+]
+
+
+class MockServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, data: MockData, latency: float = 0.0):
+        super().__init__(("127.0.0.1", 0), Handler)
+        self.data = data
+        self.latency = latency
+        self.counts: T.Counter[str] = Counter()
+        self._counts_lock = threading.Lock()
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def count(self, method: str, path: str):
+        endpoint = re.sub(ID_SEGMENT, "/:id", path)
+        with self._counts_lock:
+            self.counts[f"{method} {endpoint}"] += 1
+
+    def reset_counts(self):
+        with self._counts_lock:
+            self.counts.clear()
+
+    def env(self) -> T.Dict[str, str]:
+        """Env variables that point GiNo to this server."""
+        return dict(
+            GITLAB_URL=self.url,
+            GL_GROUP_TOKEN="mock-token",
+            NOTION_BASE_URL=self.url,
+            NOTION_ACCESS_TOKEN="mock-token",
+            TASK_DATABASE_ID=str(uuid.UUID(int=42)).replace("-", ""),
+            GINO_STATE_BACKEND="memory",
+            GITLAB_MAX_REQUESTS_PER_SEC="100000",
+            NOTION_MAX_REQUESTS_PER_SEC="100000",
+        )
+
+
+@contextlib.contextmanager
+def serve(data: MockData, latency: float = 0.0):
+    server = MockServer(data, latency)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield server
+    finally:
+        server.shutdown()
+        server.server_close()
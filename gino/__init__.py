@@ -1,8 +1 @@
-import logging
-import typing as T
-import gino.common
-from rich.logging import RichHandler
-
-# writing to stdout
-FORMAT: T.Final[str] = "%(message)s"
-logging.basicConfig(level="INFO", format=FORMAT, handlers=[RichHandler(markup=True)])
+"""GiNo (Gitlab <-> Notion). Logging is set up by the cli (`gino.__main__`)."""
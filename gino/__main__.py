@@ -1,11 +1,20 @@
 """GiNo cli interface"""
 
 import time
-import sentry_sdk
+import asyncio
 import datetime
+import typing as T
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 import gino.gitlab
+import gino.metrics
 import gino.notion
+import gino.ratelimit
+import gino.reconcile
+import gino.scheduler
+import gino.sharding
+import gino.state
+import gino.webhook
 
 from gino.common import logger
 
@@ -14,16 +23,82 @@ import typer
 app = typer.Typer()
 app.add_typer(gino.gitlab.app, name="gitlab")
 app.add_typer(gino.notion.app, name="notion")
+app.add_typer(gino.state.app, name="state")
+
+
+@app.callback()
+def main():
+    """GiNo (Gitlab <-> Notion)"""
+    gino.common.setup_logging()
+
+
+# Stale and inactive issues of dormant projects are looked for once a day.
+DORMANT_SWEEP_INTERVAL_MINS = 24 * 60
+
+# The catalogue of all projects is refreshed once a week.
+CATALOGUE_REFRESH_INTERVAL_MINS = 7 * 24 * 60
 
 
 def read_projects():
-    # Loading the environment variables
-    gl = gino.gitlab.get_gitlab_client()
-    return gl.projects.list(
-        iterator=True, archived=False, order_by="last_activity_at", sort="desc"
+    return gino.gitlab.update_project_catalogue(
+        gino.gitlab.list_projects(), complete=True
     )
 
 
+def _is_due(operation: str, interval_mins: int, scope: str = "projects") -> bool:
+    last = gino.common.load_watermark(scope, operation)
+    return last is None or gino.common.from_now_mins(last) >= interval_mins
+
+
+def _scope(shard: T.Optional[gino.sharding.Shard]) -> str:
+    """Id of the watermarks of the projects of `shard`: each shard has its own
+    so that they do not advance each other's."""
+    return "projects" if shard is None else f"projects@{shard.name}"
+
+
+def plan_projects(
+    shard: T.Optional[gino.sharding.Shard] = None, sweep: bool = True
+) -> T.Tuple[list, list]:
+    """Projects to sync in this cycle: (active, dormant).
+
+    Only projects with activity since the last cycle are active. Dormant
+    projects (from the catalogue) are returned once every
+    DORMANT_SWEEP_INTERVAL_MINS (and never without `sweep`), otherwise the list
+    is empty. With a `shard`,
+    only the projects it owns are returned, and all of them (as after a long
+    pause) when the projects were rebalanced between workers.
+    """
+    now = gino.common.now_utc()
+    if _is_due("catalogue", CATALOGUE_REFRESH_INTERVAL_MINS):
+        logger.info("Refreshing the catalogue of projects")
+        read_projects()
+        if not gino.common.DRY_RUN:
+            gino.common.store_watermark("projects", "catalogue", now)
+
+    scope = _scope(shard)
+    rebalanced = shard is not None and shard.rebalanced()
+    since = gino.common.sync_since(scope, "active", DORMANT_SWEEP_INTERVAL_MINS)
+    if rebalanced:
+        since = now - datetime.timedelta(minutes=DORMANT_SWEEP_INTERVAL_MINS)
+    grace = datetime.timedelta(minutes=gino.gitlab.PROJECT_ACTIVITY_GRACE_MINS)
+    active_after = since - grace
+    active = gino.gitlab.update_project_catalogue(
+        gino.gitlab.list_projects(active_after)
+    )
+    dormant = []
+    if sweep and (
+        rebalanced or _is_due("dormant-sweep", DORMANT_SWEEP_INTERVAL_MINS, scope)
+    ):
+        active_ids = {p.id for p in active}
+        dormant = [
+            p for p in gino.gitlab.catalogued_projects() if p.id not in active_ids
+        ]
+    if shard is not None:
+        active = [p for p in active if shard.owns(p.id)]
+        dormant = [p for p in dormant if shard.owns(p.id)]
+    return active, dormant
+
+
 @app.command("sync-new")
 def sync_newly_created_issues_with_notion(project):
     if isinstance(project, str):
@@ -64,49 +139,300 @@ def close_issues(project):
 
 def office_hours():
     d = datetime.datetime.now()
-    return (d.hour > 8) and (d.hour < 18)
+    return d.weekday() < 5 and (d.hour > 8) and (d.hour < 18)
 
 
-@app.command()
-def run_once():
-    try:
-        gino.notion.sync_recently_added_blocks()
-    except Exception as e:
-        logger.warning(e)
-    for project in read_projects():
-        logger.info(f"Analysing project {project.name_with_namespace}")
-        try:
-            sync_newly_created_issues_with_notion(project)
-        except Exception as e:
-            logger.warning(e)
-        try:
-            sync_recently_closed_issues(project)
-        except Exception as e:
-            logger.warning(e)
-        try:
-            mark_stale(project)
-        except Exception as e:
-            logger.warning(e)
+def sync_project(project, dormant: bool = False, sweep: bool = True) -> dict:
+    """Sync all issues of a single project. Only stale and inactive issues are
+    looked for in dormant projects, and they are not looked for without
+    `sweep`. Returns the stats of the run including the time taken (in
+    seconds) and the number of API pages read.
+    """
+    t0 = time.time()
+    logger.info(f"Analysing project {project.name_with_namespace}")
+    with gino.metrics.timed("sync-project"):
+        stats = gino.gitlab.sync_project_issues(
+            project, recent=not dormant, sweep=sweep
+        )
+    stats["secs"] = time.time() - t0
+    gino.metrics.observe(
+        "gino_project_sync_seconds", stats["secs"], project=project.name_with_namespace
+    )
+    return stats
+
+
+def _report_timings(stats: T.Dict[str, dict], total: float):
+    for name, s in sorted(stats.items(), key=lambda x: x[1]["secs"], reverse=True):
+        logger.info(f"  {s['secs']:8.2f}s {s['pages']:4d} pages  {name}")
+    npages = sum(s["pages"] for s in stats.values())
+    logger.info(f"Synced {len(stats)} projects in {total:.2f}s ({npages} API pages)")
+
+
+def _sync_projects(
+    active: list, dormant: list, workers: int, sweep: bool = True
+) -> T.Dict[str, dict]:
+    stats = {}
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        futures = {
+            pool.submit(
+                sync_project, project, is_dormant, sweep
+            ): project.name_with_namespace
+            for projects, is_dormant in ((active, False), (dormant, True))
+            for project in projects
+        }
+        for future in as_completed(futures):
+            name = futures[future]
+            try:
+                stats[name] = future.result()
+            except Exception as e:
+                logger.warning(f"Failed to sync {name}: {e}")
+    return stats
+
+
+def _sync_blocks(workers: int, shard: T.Optional[gino.sharding.Shard] = None):
+    # notion blocks are not per project: one of the shards syncs them.
+    if shard is None or shard.owns("notion-blocks"):
         try:
-            close_issues(project)
+            gino.notion.sync_recently_added_blocks(workers)
         except Exception as e:
             logger.warning(e)
 
 
+def _sync_active(
+    workers: int,
+    use_async: bool = False,
+    shard: T.Optional[gino.sharding.Shard] = None,
+    sweep: bool = True,
+) -> bool:
+    """Sync the projects planned by `plan_projects`. Returns True when some
+    projects are left for the next cycle."""
+    t0 = time.time()
+    started_at = gino.common.now_utc()
+    active, dormant = plan_projects(shard, sweep)
+    logger.info(f"{len(active)} active and {len(dormant)} dormant projects to sync")
+
+    if use_async:
+        # httpx is only imported when asyncio is used.
+        from gino import aio
+
+        stats = asyncio.run(aio.sync_projects(active, dormant, workers, sweep))
+    else:
+        stats = _sync_projects(active, dormant, workers, sweep)
+    # A project that failed (or is still held by another shard) is still
+    # active in the next cycle.
+    scope = _scope(shard)
+    backlog = len(stats) < len(active) + len(dormant) or bool(
+        shard is not None and shard.contended
+    )
+    if not backlog and not gino.common.DRY_RUN:
+        gino.common.store_watermark(scope, "active", started_at)
+        if dormant:
+            gino.common.store_watermark(scope, "dormant-sweep", started_at)
+    _report_timings(stats, time.time() - t0)
+    return backlog
+
+
+def _sweep(
+    budget: T.Optional[int],
+    workers: int,
+    shard: T.Optional[gino.sharding.Shard] = None,
+) -> bool:
+    """Look for stale and inactive issues in the catalogued projects, from
+    where the previous sweep stopped, until `budget` API calls (pages read and
+    requests sent to update issues) are used. Returns True when projects are
+    left."""
+    key = f"sweep-cursor@{_scope(shard)}"
+    state = gino.state.backend()
+    cursor = state.get(gino.state.DEFAULT, key, -1)
+    projects = sorted(
+        (p for p in gino.gitlab.catalogued_projects() if p.id > cursor),
+        key=lambda p: p.id,
+    )
+    if shard is not None:
+        projects = [p for p in projects if shard.owns(p.id)]
+
+    def _sweep_project(project) -> int:
+        stats = gino.gitlab.sync_project_issues(project, recent=False)
+        return stats["pages"] + stats.get("writes", 0)
+
+    used = 0
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        for i in range(0, len(projects), max(1, workers)):
+            if budget is not None and used >= budget:
+                logger.info(f"Sweep budget of {budget} API calls used")
+                return True
+            chunk = projects[i : i + max(1, workers)]
+            futures = [(p, pool.submit(_sweep_project, p)) for p in chunk]
+            for project, future in futures:
+                try:
+                    used += future.result()
+                except Exception as e:
+                    name = project.name_with_namespace
+                    logger.warning(f"Failed to sweep {name}: {e}")
+            if not gino.common.DRY_RUN:
+                state.put(gino.state.DEFAULT, key, chunk[-1].id)
+    if not gino.common.DRY_RUN:
+        state.delete(gino.state.DEFAULT, key)
+    logger.info(f"Swept {len(projects)} projects with {used} API calls")
+    return False
+
+
+def _run_once(
+    workers: int,
+    use_async: bool = False,
+    shard: T.Optional[gino.sharding.Shard] = None,
+):
+    metrics_before = gino.metrics.snapshot()
+    _sync_blocks(workers, shard)
+    _sync_active(workers, use_async, shard)
+    gino.metrics.log_summary(since=metrics_before)
+    gino.ratelimit.log_metrics()
+
+
 @app.command()
-def run():
+def run_once(
+    workers: int = gino.common.NUM_WORKERS,
+    dry_run: bool = False,
+    use_async: T.Annotated[bool, typer.Option("--async")] = False,
+    shard: T.Annotated[
+        T.Optional[str], typer.Option(help="'i/N' (0-based) or 'auto'")
+    ] = None,
+):
+    """Sync once. With --async, projects are synced with asyncio instead of
+    threads. With --shard, only the projects of this shard are synced (see
+    gino.sharding)."""
+    if dry_run:
+        gino.common.DRY_RUN = True
+    worker = gino.sharding.parse_shard(shard) if shard else None
+    try:
+        _run_once(workers, use_async, worker)
+    finally:
+        if worker is not None:
+            worker.stop()
+
+
+def _jobs(
+    workers: int,
+    use_async: bool,
+    shard: T.Optional[gino.sharding.Shard],
+    sweep_budget: T.Optional[int],
+) -> T.List[gino.scheduler.Job]:
+    """Jobs of `gino run`. Linking new issues, closed issues, notes and notion
+    blocks must not wait; the sweeps of stale issues and the task maturity
+    metric are heavy and run off hours."""
     interval = gino.common.INTER_RUN_INTERVAL_SEC
-    while True:
-        t0 = time.time()
+    day = DORMANT_SWEEP_INTERVAL_MINS * 60
+
+    # the summary of the metrics is logged once per cycle, after sync-active,
+    # and covers all the jobs that ran since the previous one.
+    cycle_start = [gino.metrics.snapshot()]
+
+    def _sync_cycle(budget):
         try:
-            run_once()
-            t = time.time() - t0
-            tosleep = max(60, interval - t)
-            print(f"Sleeping for {tosleep} secs")
-            time.sleep(tosleep)
-        except Exception as e:
-            logger.warning(f"Failed step: {e}")
-            time.sleep(30)
+            return _sync_active(workers, use_async, shard, sweep=False)
+        finally:
+            gino.metrics.log_summary(since=cycle_start[0])
+            cycle_start[0] = gino.metrics.snapshot()
+
+    def _task_maturity(budget):
+        # all projects are analysed: one of the shards does it.
+        if shard is None or shard.owns("task-maturity"):
+            gino.gitlab.compute_task_maturity_metric(workers=workers)
+
+    Job = gino.scheduler.Job
+    return [
+        Job("sync-blocks", lambda _: _sync_blocks(workers, shard), interval, 0),
+        Job("sync-active", _sync_cycle, interval, 0),
+        Job(
+            "sweep",
+            lambda budget: _sweep(budget, workers, shard),
+            day,
+            1,
+            budget=sweep_budget,
+            off_hours=True,
+        ),
+        Job("task-maturity", _task_maturity, day, 2, off_hours=True),
+    ]
+
+
+@app.command()
+def run(
+    workers: int = gino.common.NUM_WORKERS,
+    dry_run: bool = False,
+    use_async: T.Annotated[bool, typer.Option("--async")] = False,
+    metrics_file: T.Optional[str] = None,
+    metrics_port: T.Optional[int] = None,
+    shard: T.Annotated[
+        T.Optional[str], typer.Option(help="'i/N' (0-based) or 'auto'")
+    ] = None,
+    sweep_budget: T.Annotated[
+        T.Optional[int], typer.Option(help="API calls per run of the sweep")
+    ] = 5000,
+):
+    """Sync forever. Issues and notion blocks are synced every few minutes;
+    stale issues and the task maturity metric once a day, off hours (see
+    gino.scheduler). The metrics (Prometheus text format) are written to
+    `metrics_file` after every step and/or served on `metrics_port`. Several
+    workers can share the projects with --shard."""
+    if dry_run:
+        gino.common.DRY_RUN = True
+    if metrics_port is not None:
+        gino.metrics.serve(metrics_port)
+    worker = gino.sharding.parse_shard(shard) if shard else None
+
+    def _after_step():
+        if metrics_file is not None:
+            gino.metrics.write_textfile(metrics_file)
+
+    scheduler = gino.scheduler.Scheduler(
+        _jobs(workers, use_async, worker, sweep_budget),
+        is_off_hours=lambda: not office_hours(),
+        scope=f"scheduler@{worker.name}" if worker else "scheduler",
+    )
+    try:
+        scheduler.run_forever(_after_step)
+    finally:
+        if worker is not None:
+            worker.stop()
+
+
+@app.command()
+def reconcile(
+    workers: int = gino.common.NUM_WORKERS,
+    dry_run: bool = False,
+    window_mins: int = 7 * 24 * 60,
+):
+    """Reconcile the issues changed since the last run with the notion task
+    database in bulk: create missing tasks and mark the tasks of closed issues
+    done."""
+    if dry_run:
+        gino.common.DRY_RUN = True
+    projects = gino.gitlab.catalogued_projects() or read_projects()
+    summary = gino.reconcile.reconcile(projects, workers, window_mins)
+    logger.info(
+        f"Created {summary['created']} and updated {summary['updated']} tasks"
+        f" ({summary['failed']} failed)"
+    )
+
+
+@app.command()
+def serve(
+    host: str = "0.0.0.0",
+    port: int = 8080,
+    workers: int = gino.common.NUM_WORKERS,
+    sweep_interval_sec: int = 3600,
+):
+    """Sync issues as GitLab webhooks arrive. A full `run-once` sweep runs
+    every `sweep_interval_sec` to reconcile events that were missed.
+    """
+    gino.common.load_config()
+    gino.webhook.serve(
+        host,
+        port,
+        workers,
+        sweep=lambda: _run_once(workers),
+        sweep_interval_sec=sweep_interval_sec,
+    )
 
 
 if __name__ == "__main__":
@@ -0,0 +1,370 @@
+"""asyncio execution mode of the sync pipeline (`gino run --async`).
+
+The same link, close-sync, stale, auto-close and note operations as the
+threaded pipeline in `gino.gitlab` are run, but GitLab and Notion are talked
+to with async HTTP clients. Connections are pooled and kept alive, and the
+number of requests in flight is limited per service. Requests still go
+through the shared rate limiter of `gino.ratelimit`.
+
+The state (watermarks, index, dedupe keys) is the same as that of the
+threaded pipeline, so one can switch between the two at any time.
+"""
+
+import asyncio
+import logging
+import time
+import typing as T
+from datetime import datetime
+from types import SimpleNamespace
+
+import httpx
+from notion_client import AsyncClient
+
+import gino.common
+import gino.gitlab
+import gino.metrics
+import gino.notion
+import gino.state
+import gino.transport
+from gino.common import get_config
+from gino.gitlab import IssueMutations, STALE, ISSUES_PER_PAGE
+
+# Maximum number of requests in flight per service.
+GITLAB_CONCURRENCY = 16
+NOTION_CONCURRENCY = 4
+
+
+def _query_params(params: dict) -> dict:
+    result = {}
+    for key, value in params.items():
+        if isinstance(value, datetime):
+            value = value.isoformat()
+        elif isinstance(value, (list, tuple)):
+            value = ",".join(value)
+        result[key] = value
+    return result
+
+
+class AsyncGitLab:
+    """Minimal async client of the GitLab REST API (v4)."""
+
+    def __init__(self, url: str, token: str, concurrency: int = GITLAB_CONCURRENCY):
+        limits = httpx.Limits(
+            max_connections=concurrency, max_keepalive_connections=concurrency
+        )
+        transport = gino.transport.AsyncRateLimitedTransport("gitlab", limits=limits)
+        self.client = httpx.AsyncClient(
+            base_url=url.rstrip("/") + "/api/v4",
+            headers={"PRIVATE-TOKEN": token},
+            transport=transport,
+            timeout=60,
+        )
+        self._semaphore = asyncio.Semaphore(concurrency)
+
+    async def request(self, method: str, path: str, **kwargs):
+        async with self._semaphore:
+            response = await self.client.request(method, path, **kwargs)
+        response.raise_for_status()
+        return response.json()
+
+    async def list_issues(self, project_id: int, stats: dict, **params):
+        """Issues of a project one page at a time (as objects)."""
+        page = 1
+        while True:
+            issues = await self.request(
+                "GET",
+                f"/projects/{project_id}/issues",
+                params=_query_params(dict(params, page=page, per_page=ISSUES_PER_PAGE)),
+            )
+            stats["pages"] = stats.get("pages", 0) + 1
+            for issue in issues:
+                yield SimpleNamespace(**issue)
+            if len(issues) < ISSUES_PER_PAGE:
+                return
+            page += 1
+
+    async def iter_notes(self, issue, sort: str = "desc"):
+        """Notes of an issue, newest first (or oldest first with `sort="asc"`),
+        one page at a time."""
+        page = 1
+        while True:
+            notes = await self.request(
+                "GET",
+                f"/projects/{issue.project_id}/issues/{issue.iid}/notes",
+                params=dict(
+                    sort=sort,
+                    order_by="created_at",
+                    page=page,
+                    per_page=ISSUES_PER_PAGE,
+                ),
+            )
+            for note in notes:
+                yield note
+            if len(notes) < ISSUES_PER_PAGE:
+                return
+            page += 1
+
+    async def create_note(self, issue, body: str):
+        return await self.request(
+            "POST",
+            f"/projects/{issue.project_id}/issues/{issue.iid}/notes",
+            json=dict(body=body),
+        )
+
+    async def update_issue(self, issue, **data):
+        return await self.request(
+            "PUT", f"/projects/{issue.project_id}/issues/{issue.iid}", json=data
+        )
+
+    async def aclose(self):
+        await self.client.aclose()
+
+
+def notion_client(concurrency: int = NOTION_CONCURRENCY) -> AsyncClient:
+    gino.common.load_config()
+    limits = httpx.Limits(
+        max_connections=concurrency, max_keepalive_connections=concurrency
+    )
+    transport = gino.transport.AsyncRateLimitedTransport("notion", limits=limits)
+    return AsyncClient(
+        auth=get_config("NOTION_ACCESS_TOKEN"),
+        client=httpx.AsyncClient(transport=transport),
+        **gino.notion.client_options(),
+    )
+
+
+class Pipeline:
+    """Async versions of the issue handlers of `gino.gitlab`."""
+
+    def __init__(self, gitlab: AsyncGitLab, notion: AsyncClient):
+        self.gitlab = gitlab
+        self.notion = notion
+
+    async def flush(self, mutations: IssueMutations):
+        if not mutations:
+            return
+        issue = mutations.issue
+        if gino.common.DRY_RUN:
+            logging.info(f"[dry-run] {mutations}")
+        else:
+            if mutations.notes:
+                await self.gitlab.create_note(issue, "\n\n".join(mutations.notes))
+            if mutations.labels or mutations.state_event:
+                data = dict(add_labels=",".join(mutations.labels))
+                if mutations.state_event:
+                    data["state_event"] = mutations.state_event
+                await self.gitlab.update_issue(issue, **data)
+            issue.labels = issue.labels + mutations.labels
+            issue.state = mutations.state
+        mutations.labels, mutations.state_event, mutations.notes = [], None, []
+
+    async def find_notion_page_uuid(self, issue) -> T.Optional[str]:
+        page_uuid = gino.common.page_of_issue(issue.project_id, issue.iid)
+        if page_uuid is not None:
+            return page_uuid
+        # the note with the link is one of the first ones.
+        async for note in self.gitlab.iter_notes(issue, sort="asc"):
+            page_uuid = gino.gitlab.page_uuid_in_text(note["body"])
+            if page_uuid is not None:
+                gino.common.index_issue_page(issue.project_id, issue.iid, page_uuid)
+                return page_uuid
+        return None
+
+    async def link(self, project, issue, mutations: IssueMutations):
+        if gino.gitlab.is_linked_with_notion(issue):
+            return
+        task = gino.gitlab.notion_task_of_issue(project.name, issue)
+        if gino.notion.task_exists(task["url"], task["title"]):
+            return
+        if gino.common.DRY_RUN:
+            logging.info(f"[dry-run] Would create notion task '{task['title']}'")
+            page = dict(url="<notion page>")
+        else:
+            # user lookups are cached; they rarely hit the network.
+            properties = await asyncio.to_thread(
+                gino.notion.task_properties,
+                task["title"],
+                task["url"],
+                due_date=task["due_date"],
+                assignee=task["assignee"],
+                author=task["author"],
+                labels=issue.labels,
+            )
+            blocks = gino.notion.content_blocks(task["content"])
+            limit = gino.notion.MAX_BLOCKS_PER_REQUEST
+            page = await self.notion.pages.create(
+                parent={"database_id": gino.notion.db_id()},
+                properties=properties,
+                children=blocks[:limit],
+            )
+            for i in range(limit, len(blocks), limit):
+                await self.notion.blocks.children.append(
+                    block_id=page["id"], children=blocks[i : i + limit]
+                )
+            dedupe_key = gino.notion.task_dedupe_key(task["url"])
+            gino.common.store(dedupe_key, 1, gino.state.DEDUPE)
+            gino.common.index_issue_page(issue.project_id, issue.iid, page["id"])
+        mutations.add_label(gino.common.LINKED_WITH_NOTION)
+        mutations.add_note("More information may be found at " + page["url"])
+
+    async def change_notion_task_status(self, issue, mutations: IssueMutations):
+        if mutations.has_label(gino.common.CLOSED_IN_NOTION):
+            return
+        if not gino.gitlab.is_linked_with_notion(issue):
+            return
+        status = gino.gitlab.gl_issue_status_to_notion_task_status(
+            issue, mutations.state
+        )
+        page_uuid = await self.find_notion_page_uuid(issue)
+        if page_uuid is None:
+            logging.warning(f"> Could not find notion page of {issue.web_url}")
+            return
+        if gino.common.DRY_RUN:
+            logging.info(f"[dry-run] Would change status of {page_uuid} to {status}")
+        else:
+            await self.notion.pages.update(
+                page_uuid, properties=gino.notion.status_properties(status)
+            )
+        mutations.add_note("Changed status of linked notion page")
+        mutations.add_label(gino.common.CLOSED_IN_NOTION)
+
+    async def mark_stale(self, issue, mutations: IssueMutations):
+        mutations.add_label(STALE)
+
+    async def close_due_to_inactivity(self, issue, mutations: IssueMutations):
+        if mutations.has_label(gino.gitlab.CLOSED_DUE_TO_INACTIVITY):
+            return
+        mutations.add_label(gino.gitlab.CLOSED_DUE_TO_INACTIVITY)
+        mutations.close()
+        await self.change_notion_task_status(issue, mutations)
+
+    async def sync_notes(self, issue):
+        """Forward the notes of a linked issue added since the last run to its
+        notion page."""
+        cursor = gino.common.load_note_cursor(issue.project_id, issue.iid)
+        notes = []
+        async for note in self.gitlab.iter_notes(issue):
+            if note["id"] <= cursor:
+                break
+            notes.append(note)
+        forward, new_cursor = gino.gitlab.new_notes(notes, cursor)
+        if forward:
+            page_uuid = await self.find_notion_page_uuid(issue)
+            if page_uuid is None:
+                logging.warning(f"No notion page found for {issue.web_url}")
+                return
+            if gino.common.DRY_RUN:
+                logging.info(f"[dry-run] Would add {len(forward)} notes to {page_uuid}")
+                return
+            texts = [
+                gino.gitlab.note_text(
+                    n["body"], n["author"]["username"], n["created_at"]
+                )
+                for n in forward
+            ]
+            blocks = gino.notion.content_blocks(texts)
+            limit = gino.notion.MAX_BLOCKS_PER_REQUEST
+            for i in range(0, len(blocks), limit):
+                await self.notion.blocks.children.append(
+                    block_id=page_uuid, children=blocks[i : i + limit]
+                )
+        if new_cursor != cursor and not gino.common.DRY_RUN:
+            gino.common.store_note_cursor(issue.project_id, issue.iid, new_cursor)
+
+    async def sync_project_issues(
+        self,
+        project,
+        new_window_mins: int = 7 * 24 * 60,
+        closed_window_mins: int = 600,
+        *,
+        recent: bool = True,
+        sweep: bool = True,
+    ) -> dict:
+        """Same as `gino.gitlab.sync_project_issues`. Issues of a page are
+        processed concurrently."""
+        handlers = {
+            "link": lambda issue, m: self.link(project, issue, m),
+            "closed": self.change_notion_task_status,
+            "stale": self.mark_stale,
+            "inactive": self.close_due_to_inactivity,
+        }
+        sync = gino.gitlab.ProjectSync(
+            project,
+            handlers,
+            flush=self.flush,
+            sync_notes=self.sync_notes,
+            new_window_mins=new_window_mins,
+            closed_window_mins=closed_window_mins,
+            recent=recent,
+            sweep=sweep,
+        )
+        for params, notes in sync.queries():
+            tasks = []
+            async for issue in self.gitlab.list_issues(
+                project.id, sync.stats, **params
+            ):
+                tasks.append(asyncio.ensure_future(run_steps(sync.steps(issue, notes))))
+            await asyncio.gather(*tasks)
+        return sync.finish()
+
+
+async def run_steps(steps):
+    """Same as `gino.gitlab.run_steps` with calls that return coroutines."""
+    outcome: T.Optional[Exception] = None
+    result = None
+    while True:
+        try:
+            if outcome is not None:
+                stage, call = steps.throw(outcome)
+            else:
+                stage, call = steps.send(result)
+        except StopIteration:
+            return
+        outcome, result = None, None
+        try:
+            with gino.metrics.timed(stage):
+                result = await call()
+        except Exception as e:
+            outcome = e
+
+
+async def sync_projects(
+    active: list, dormant: list, workers: int, sweep: bool = True
+) -> dict:
+    """Sync all projects, at most `workers` at a time. Returns the stats per
+    project like the threaded `run_once`."""
+    gino.common.load_config()
+    gitlab = AsyncGitLab(get_config("GITLAB_URL"), get_config("GL_GROUP_TOKEN"))
+    notion = notion_client()
+    pipeline = Pipeline(gitlab, notion)
+    semaphore = asyncio.Semaphore(max(1, workers))
+    stats: T.Dict[str, dict] = {}
+
+    async def _sync(project, dormant: bool):
+        async with semaphore:
+            t0 = time.time()
+            logging.info(f"Analysing project {project.name_with_namespace}")
+            try:
+                with gino.metrics.timed("sync-project"):
+                    result = await pipeline.sync_project_issues(
+                        project, recent=not dormant, sweep=sweep
+                    )
+            except Exception as e:
+                logging.warning(f"Failed to sync {project.name_with_namespace}: {e}")
+                return
+            result["secs"] = time.time() - t0
+            gino.metrics.observe(
+                "gino_project_sync_seconds",
+                result["secs"],
+                project=project.name_with_namespace,
+            )
+            stats[project.name_with_namespace] = result
+
+    try:
+        await asyncio.gather(
+            *[_sync(p, False) for p in active], *[_sync(p, True) for p in dormant]
+        )
+    finally:
+        await gitlab.aclose()
+        await notion.aclose()
+    return stats
@@ -2,24 +2,52 @@ import os
 import typing as T
 import logging
 from pathlib import Path
-import shelve
-import time
+import uuid
 
-from datetime import datetime, timezone
-import dateparser
+from datetime import datetime, timezone, timedelta
 
 # pip install python-dotenv
 import dotenv
 
+import gino.state
+
 logger = logging.getLogger()
 
+# writing to stdout
+FORMAT: T.Final[str] = "%(message)s"
+
 INTER_RUN_INTERVAL_SEC = 300
 
+REQUIRED_CONFIG = (
+    "GITLAB_URL",
+    "GL_GROUP_TOKEN",
+    "TASK_DATABASE_ID",
+    "NOTION_ACCESS_TOKEN",
+)
+
+# Watermarks are moved back by this much when read to tolerate clock skew
+# between us and the server.
+WATERMARK_OVERLAP_MINS = 2
+
+# Number of projects synced concurrently by `run_once`.
+NUM_WORKERS = 8
+
+# When set, changes to gitlab and notion are logged instead of being made.
+DRY_RUN = False
+
 LINKED_WITH_NOTION = "notion:opened"
 WAITING_FOR_TRIAGE = "waiting-for-triage"
 CLOSED_IN_NOTION = "notion:closed"
 
 
+def setup_logging():
+    from rich.logging import RichHandler
+
+    logging.basicConfig(
+        level="INFO", format=FORMAT, handlers=[RichHandler(markup=True)]
+    )
+
+
 def load_config():
     """Load configuration"""
     envfiles = [
@@ -32,6 +60,9 @@ def load_config():
             dotenv.load_dotenv(envfile)
             return
 
+    # e.g. in a container or a benchmark, everything may already be in env.
+    if all(key in os.environ for key in REQUIRED_CONFIG):
+        return
     raise RuntimeError(f"At least of these these env file is required: {envfiles}")
 
 
@@ -43,55 +74,120 @@ def get_config(key: str) -> str:
     return os.environ[key]
 
 
-def parse_date(date: T.Optional[str]):
+def _parse_iso_date(date: str) -> T.Optional[datetime]:
+    """Parse ISO-8601 strings such as the ones returned by gitlab
+    (2024-05-06T10:20:30.123Z), notion (2024-05-06T10:20:00.000+00:00) and
+    due dates (2024-05-06). Returns None if the string is not ISO-8601.
+    """
+    if date[-1:] in ("Z", "z"):
+        date = date[:-1] + "+00:00"
+    try:
+        return datetime.fromisoformat(date)
+    except ValueError:
+        return None
+
+
+def parse_date(date: T.Union[None, str, datetime]) -> T.Optional[datetime]:
+    """Parse date into a datetime in UTC. Naive dates are assumed to be in UTC.
+    dateparser is used only if the date is not in ISO-8601 format.
+    """
     if not date:
         return None
-    return dateparser.parse(date).replace(tzinfo=timezone.utc)
+    if isinstance(date, str):
+        parsed = _parse_iso_date(date)
+        if parsed is None:
+            import dateparser
+
+            parsed = dateparser.parse(date)
+        if parsed is None:
+            return None
+        date = parsed
+    if date.tzinfo is None:
+        return date.replace(tzinfo=timezone.utc)
+    return date.astimezone(timezone.utc)
+
+
+def parse_datetime(date: T.Union[str, datetime]) -> datetime:
+    """`parse_date` of a date that is always set (e.g. created_at). Raises
+    ValueError if it is missing or cannot be parsed."""
+    if (parsed := parse_date(date)) is None:
+        raise ValueError(f"Invalid date {date!r}")
+    return parsed
 
 
 def now_utc():
     return datetime.now(timezone.utc)
 
 
-def from_now_mins(date_utc) -> int:
-    return (now_utc() - parse_date(date_utc)).total_seconds() / 60
+def from_now_mins(date_utc) -> float:
+    return (now_utc() - parse_datetime(date_utc)).total_seconds() / 60
+
+
+def store(key, val, namespace: str = gino.state.DEFAULT, ttl_sec=None):
+    gino.state.backend().put(namespace, key, val, ttl_sec)
+
+
+def load(key, namespace: str = gino.state.DEFAULT):
+    return gino.state.backend().get(namespace, key)
+
+
+def _watermark_key(project_id, operation: str) -> str:
+    return f"watermark:{operation}:{project_id}"
+
+
+def load_watermark(project_id, operation: str) -> T.Optional[datetime]:
+    """Time of the last successful `operation` on the given project"""
+    return load(_watermark_key(project_id, operation), gino.state.WATERMARKS)
+
+
+def store_watermark(project_id, operation: str, when: datetime):
+    store(_watermark_key(project_id, operation), when, gino.state.WATERMARKS)
+
+
+def sync_since(project_id, operation: str, window_mins: int) -> datetime:
+    """Return the time after which we need to look for changes. This is the last
+    checkpoint of `operation` on this project. If there is no checkpoint (first
+    run or the previous run crashed before the checkpoint was written), the full
+    window of `window_mins` is used.
+    """
+    if (last := load_watermark(project_id, operation)) is not None:
+        return last - timedelta(minutes=WATERMARK_OVERLAP_MINS)
+    return now_utc() - timedelta(minutes=window_mins)
+
+
+def load_note_cursor(project_id, issue_iid) -> int:
+    """id of the last note of the issue that was sent to notion (0 if none)"""
+    return load(f"{project_id}:{issue_iid}", gino.state.NOTES) or 0
 
 
-def shelve_it(file_name, expiry_mins=10):
-    now = time.time()
-    fname = Path(file_name + ".dat")
-    print(f"Selving using {file_name}")
-    if fname.exists():
-        ctime = fname.stat().st_ctime
-        if (now - ctime) > (expiry_mins * 60):
-            for p in Path().glob(file_name + "*"):
-                p.unlink()
+def store_note_cursor(project_id, issue_iid, note_id: int):
+    store(f"{project_id}:{issue_iid}", note_id, gino.state.NOTES)
 
-    d = shelve.open(file_name)
 
-    def decorator(func, *args, **kwargs):
-        def new_func(param, *args, **kwargs):
-            if param not in d:
-                d[param] = func(param, *args, **kwargs)
-            else:
-                logging.info(f"using selve for {param}")
-            return d[param]
+def _page_key(page_id: str) -> str:
+    return f"page-issue:{uuid.UUID(page_id).hex}"
 
-        return new_func
 
-    return decorator
+def _issue_key(project_id, issue_iid) -> str:
+    return f"issue-page:{project_id}:{issue_iid}"
 
 
-STORE_NAME = "gino.shelve"
+def index_issue_page(project_id, issue_iid, page_id: str):
+    """Remember that the gitlab issue is linked with the given notion page"""
+    gino.state.backend().put_many(
+        gino.state.INDEX,
+        {
+            _issue_key(project_id, issue_iid): uuid.UUID(page_id).hex,
+            _page_key(page_id): (project_id, issue_iid),
+        },
+    )
 
 
-def store(key, val):
-    with shelve.open(STORE_NAME) as db:
-        db[key] = val
+def page_of_issue(project_id, issue_iid) -> T.Optional[str]:
+    """uuid of the notion page linked with the gitlab issue (if indexed)"""
+    return load(_issue_key(project_id, issue_iid), gino.state.INDEX)
 
 
-def load(key):
-    with shelve.open(STORE_NAME) as db:
-        if key in db:
-            return db[key]
-    return None
+def issue_of_page(page_id: str) -> T.Optional[T.Tuple[int, int]]:
+    """(project id, issue iid) of the gitlab issue linked with the page"""
+    return load(_page_key(page_id), gino.state.INDEX)
@@ -1,32 +1,61 @@
-from datetime import datetime, timezone, timedelta
+from datetime import datetime, timedelta
 from pathlib import Path
 
 import typing as T
 import json
+import functools
+import contextlib
+import importlib.util
 import logging
+import threading
+import urllib.parse
+import uuid
+from concurrent.futures import ThreadPoolExecutor
 
-import gitlab
 import typer
-from urlextract import URLExtract
 
+import gino.common
+import gino.metrics
 import gino.notion
-from gino.common import parse_date, load_config, get_config, shelve_it
+import gino.state
+from gino.common import parse_date, parse_datetime, load_config, get_config
+from gino.common import now_utc, sync_since, load_watermark, store_watermark
+from gino.common import index_issue_page, page_of_issue
 from gino.common import WAITING_FOR_TRIAGE, LINKED_WITH_NOTION, CLOSED_IN_NOTION
 
 app = typer.Typer()
 
+
+@app.callback()
+def main():
+    """GitLab side of GiNo"""
+    # also when run as `python -m gino.gitlab`.
+    gino.common.setup_logging()
+
+
 GL = None
+_GL_LOCK = threading.Lock()
+
+# URLExtract loads the list of TLDs when created. Create it only once.
+_URL_EXTRACTOR = None
 
 
 def get_gitlab_client():
     global GL
-    if GL is not None:
-        return GL
-    load_config()
-    GL = gitlab.Gitlab(
-        get_config("GITLAB_URL"), private_token=get_config("GL_GROUP_TOKEN")
-    )
-    GL.auth()
+    with _GL_LOCK:
+        if GL is not None:
+            return GL
+        import gitlab
+        import gino.transport
+
+        load_config()
+        gl = gitlab.Gitlab(
+            get_config("GITLAB_URL"),
+            private_token=get_config("GL_GROUP_TOKEN"),
+            session=gino.transport.requests_session("gitlab"),
+        )
+        gl.auth()
+        GL = gl
     return GL
 
 
@@ -40,174 +69,542 @@ def is_linked_with_notion(issue):
     return False
 
 
-def sync_recently_closed_issues(project):
-    updated_after = datetime.now(timezone.utc) - timedelta(minutes=600)
+STALE = "stale"
+CLOSED_DUE_TO_INACTIVITY = "closed-due-to-inactivity"
+
+STALE_AFTER_DAYS = 28
+INACTIVE_AFTER_DAYS = 90
+
+ISSUES_PER_PAGE = 100
+
+# GitLab updates `last_activity_at` of a project at most once an hour.
+PROJECT_ACTIVITY_GRACE_MINS = 60
+
+# Notes younger than this are not sent to notion by `sync-notes`, so that their
+# authors can finish editing them.
+NOTE_EDIT_GRACE_MINS = 10
+
+# Output of `task-maturity` (one column per field). Without numpy, the metrics
+# are written to MATURITY_JSON_FILE instead (project -> issue iid -> metric).
+MATURITY_FILE = Path("punctuality.npz")
+MATURITY_JSON_FILE = Path("punctuality.json")
+
+
+class IssueMutations:
+    """Changes to a gitlab issue that are collected while the issue is being
+    processed and sent together by `flush`: all the notes in one note and all
+    the labels and the state change in one save.
+    """
+
+    def __init__(self, issue):
+        self.issue = issue
+        self.labels: T.List[str] = []
+        self.state_event: T.Optional[str] = None
+        self.notes: T.List[str] = []
+
+    def __bool__(self):
+        return bool(self.labels or self.state_event or self.notes)
+
+    @property
+    def requests(self) -> int:
+        """Number of requests that the flush sends to gitlab"""
+        if gino.common.DRY_RUN:
+            return 0
+        return bool(self.notes) + bool(self.labels or self.state_event)
+
+    def has_label(self, label: str) -> bool:
+        return label in self.issue.labels or label in self.labels
+
+    def add_label(self, label: str):
+        if not self.has_label(label):
+            self.labels.append(label)
+
+    def close(self):
+        self.state_event = "close"
+
+    @property
+    def state(self) -> str:
+        """State of the issue after the flush"""
+        return "closed" if self.state_event == "close" else self.issue.state
+
+    def add_note(self, body: str):
+        self.notes.append(body)
+
+    def __str__(self):
+        return (
+            f"{self.issue.web_url}: labels={self.labels}"
+            f" state_event={self.state_event} notes={self.notes}"
+        )
+
+    def flush(self):
+        if not self:
+            return
+        if gino.common.DRY_RUN:
+            logging.info(f"[dry-run] {self}")
+        else:
+            if self.notes:
+                self.issue.notes.create(dict(body="\n\n".join(self.notes)))
+            if self.labels or self.state_event:
+                self.issue.labels = self.issue.labels + self.labels
+                if self.state_event:
+                    self.issue.state_event = self.state_event
+                self.issue.save()
+        self.labels, self.state_event, self.notes = [], None, []
+
+
+@contextlib.contextmanager
+def _mutations(issue, mutations: T.Optional[IssueMutations]):
+    """Use the given mutations or create new ones that are flushed at exit."""
+    if mutations is not None:
+        yield mutations
+        return
+    mutations = IssueMutations(issue)
+    yield mutations
+    mutations.flush()
+
+
+def _list_issues(project, stats: T.Optional[dict] = None, **kwargs):
+    """Iterate over the issues of a project one page at a time. The number of
+    pages fetched is added to `stats["pages"]`.
+    """
+    page = 1
+    while True:
+        issues = project.issues.list(page=page, per_page=ISSUES_PER_PAGE, **kwargs)
+        if stats is not None:
+            stats["pages"] = stats.get("pages", 0) + 1
+        yield from issues
+        if len(issues) < ISSUES_PER_PAGE:
+            return
+        page += 1
+
+
+def sync_recently_closed_issues(project, window_mins: int = 600):
+    started_at = now_utc()
+    updated_after = sync_since(project.id, "sync-closed", window_mins)
     nissues = 0
-    for issue in project.issues.list(
-        state="closed",
-        updated_after=updated_after,
-        iterator=True,
-    ):
+    for issue in _list_issues(project, state="closed", updated_after=updated_after):
         nissues += 1
         logging.info(f" Issue '{issue.title}' was closed recently. Updating notion..")
         change_notion_task_status(issue)
     if nissues > 0:
         logging.info(f"Total {nissues} recently closed issues were synced.")
+    if not gino.common.DRY_RUN:
+        store_watermark(project.id, "sync-closed", started_at)
+
+
+def notion_task_of_issue(project_name: str, issue) -> dict:
+    """Arguments of `gino.notion.create_task` for the issue"""
+    return dict(
+        title=_issue_to_notion_title(project_name, issue),
+        url=issue.web_url,
+        due_date=str(issue.due_date) if issue.due_date else None,
+        assignee=issue.assignees[0]["username"] if issue.assignees else None,
+        author=issue.author["username"],
+        content=[f"""{issue.description}. By {issue.author}."""],
+    )
+
+
+def link_issue_with_notion(
+    project, issue, mutations: T.Optional[IssueMutations] = None
+) -> bool:
+    """Create a notion task for the issue. Returns True if a page was created."""
+    if is_linked_with_notion(issue):
+        logging.info("> This issue is already linked with notion")
+        return False
+
+    logging.info(f"  Linking issue {issue.title} with notion")
+    task = notion_task_of_issue(project.name, issue)
+    if gino.common.DRY_RUN:
+        logging.info(f"[dry-run] Would create notion task '{task['title']}'")
+        page = dict(url="<notion page>")
+    else:
+        page = gino.notion.create_task(**task, gitlab_data=issue)
+        if not page:
+            return False
+        index_issue_page(issue.project_id, issue.iid, page["id"])
+
+    # adds tag to issue that I have created the issue on the notion
+    with _mutations(issue, mutations) as m:
+        m.add_label(LINKED_WITH_NOTION)
+        m.add_note("More information may be found at " + page["url"])
+    return True
 
 
 def link_newly_created_issues_with_notion(project, created_before_mins: int = 720):
-    created_after = datetime.now(timezone.utc) - timedelta(minutes=created_before_mins)
+    """Link issues created since the last successful run with notion. If there
+    was no successful run, look back `created_before_mins`.
+    """
+    started_at = now_utc()
+    created_after = sync_since(project.id, "sync-new", created_before_mins)
     nissues = 0
-    for issue in project.issues.list(
-        state="opened",
-        created_after=created_after,
-        iterator=True,
-    ):
+    for issue in _list_issues(project, state="opened", created_after=created_after):
         nissues += 1
         logging.info(f" Issue '{issue.title}' was created recently...")
-        url = issue.web_url
-        label = LINKED_WITH_NOTION
-        page_title = _issue_to_notion_title(project.name, issue)
-        if is_linked_with_notion(issue):
-            logging.info("> This issue is already linked with notion")
-            continue
-
-        logging.info(f"  Linking issue {issue.title} with notion")
-        author = issue.author["username"]
-        page_date = str(issue.due_date) if issue.due_date else None
-        assignee = issue.assignees[0]["username"] if issue.assignees else None
-        if page := gino.notion.create_task(
-            page_title,
-            url,
-            due_date=page_date,
-            assignee=assignee,
-            author=author,
-            gitlab_data=issue,
-        ):
-            # adds tag to issue that I have created the issue on the notion
-            text = f"""{issue.description}. By {issue.author}."""
-            gino.notion.append_to_page(page["id"], text)
-            issue.labels = issue.labels + [label]
-            issue.notes.create(
-                dict(body="More information may be found at " + page["url"])
-            )
-            issue.save()
+        link_issue_with_notion(project, issue)
 
     logging.info(f"Total {nissues} processed.")
+    if not gino.common.DRY_RUN:
+        store_watermark(project.id, "sync-new", started_at)
+
+
+def _parse_issue_url(url: str) -> T.Tuple[str, int]:
+    """Path of the project and iid of the issue from the web url of an issue e.g.
+    https://gitlab.example.com/group/subgroup/project/-/issues/12
+    """
+    path = urllib.parse.urlparse(url).path.strip("/")
+    sep = "/-/issues/" if "/-/issues/" in path else "/issues/"
+    project_path, _, issue_iid = path.rpartition(sep)
+    if not project_path:
+        raise ValueError(f"{url} is not a url of an issue")
+    return project_path, int(issue_iid)
 
 
 def get_issue_by_url(url):
     """Return an issue for a given URL. Throw exceptions if anything goes wrong.
     Use with care.
+
+    The project is not fetched (lazy), so only one API call is made.
     """
     client = get_gitlab_client()
-    fs = url.split("/")
-    issue_iid = int(fs[-1])
-    pname = "/".join(fs[-5:-3])
-    project = client.projects.get(pname)
+    project_path, issue_iid = _parse_issue_url(url)
+    project = client.projects.get(project_path, lazy=True)
     return project.issues.get(issue_iid)
 
 
-def sync_notes(project):
-    updated_before = datetime.now(timezone.utc) - timedelta(minutes=10)
+def should_forward_note(author_username: str, body: str) -> bool:
+    """Should a note be sent to notion? Notes by gino and notes that were
+    already sent are not."""
+    if author_username == "gino.bot":
+        return False
+    return not body.endswith(LINKED_WITH_NOTION)
+
+
+def note_text(body: str, author_username: str, created_at: str) -> str:
+    """Text of the notion paragraph for a gitlab note"""
+    return f"{body}. By {author_username}. On {created_at}."
+
+
+def new_notes(
+    notes: T.Iterable[dict], cursor: int, created_before: T.Optional[datetime] = None
+) -> T.Tuple[T.List[dict], int]:
+    """Notes to send to notion, oldest first, and the new cursor.
+
+    `notes` are sorted newest first and are consumed only up to the `cursor`
+    (id of the last note that was sent), so that only the pages with new notes
+    are fetched. Notes created after `created_before` are left for the next
+    run.
+    """
+    forward, new_cursor = [], cursor
+    for note in notes:
+        if note["id"] <= cursor:
+            break
+        if created_before and parse_datetime(note["created_at"]) > created_before:
+            continue
+        new_cursor = max(new_cursor, note["id"])
+        if note.get("system"):
+            continue
+        if should_forward_note(note["author"]["username"], note["body"]):
+            forward.append(note)
+    return forward[::-1], new_cursor
+
+
+def sync_issue_notes(issue, created_before: T.Optional[datetime] = None):
+    """Forward the notes of a linked issue added since the last run to its
+    notion page. All new notes are appended to the page in one request."""
+    cursor = gino.common.load_note_cursor(issue.project_id, issue.iid)
+    notes = issue.notes.list(
+        sort="desc", order_by="created_at", per_page=ISSUES_PER_PAGE, iterator=True
+    )
+    forward, new_cursor = new_notes(
+        (note.attributes for note in notes), cursor, created_before
+    )
+    if forward:
+        notion_page_uuid = find_notion_page_uuid(issue)
+        if notion_page_uuid is None:
+            logging.warning(f"No notion page found for {issue.web_url}")
+            return
+        logging.info(f"Adding {len(forward)} notes from {issue.title}")
+        texts = [
+            note_text(n["body"], n["author"]["username"], n["created_at"])
+            for n in forward
+        ]
+        gino.notion.append_to_page(notion_page_uuid, texts)
+    if new_cursor != cursor and not gino.common.DRY_RUN:
+        gino.common.store_note_cursor(issue.project_id, issue.iid, new_cursor)
+
+
+def should_sync_notes(issue) -> bool:
+    """Notes are sent to notion for open, linked issues that are not stale"""
+    if issue.state != "opened" or STALE in issue.labels:
+        return False
+    return is_linked_with_notion(issue)
+
+
+@gino.metrics.timed("notes")
+def sync_notes(project, window_mins: int = 28 * 24 * 60):
+    # Leave notes alone for a while so that authors can finish editing them.
+    updated_before = now_utc() - timedelta(minutes=NOTE_EDIT_GRACE_MINS)
+    updated_after = sync_since(project.id, "sync-notes", window_mins)
     for issue in project.issues.list(
         state="opened",
+        updated_after=updated_after,
         updated_before=updated_before,
         iterator=True,
     ):
-        if "stale" in issue.labels:
+        if not should_sync_notes(issue):
             continue
+        try:
+            sync_issue_notes(issue, created_before=updated_before)
+        except Exception as e:
+            logging.warning(f"Failed to sync notes of {issue.web_url}: {e}")
 
-        if not is_linked_with_notion(issue):
-            continue
+    if not gino.common.DRY_RUN:
+        store_watermark(project.id, "sync-notes", updated_before)
 
-        notion_page_uuid = find_notion_page_uuid(issue)
-        logging.info(f"Adding notes from {issue.title}")
-        for note in issue.notes.list(updated_before=updated_before):
-            if note.author["username"] == "gino.bot":
-                continue
-            body = note.body
-            if body.endswith(LINKED_WITH_NOTION):
-                print("This issue is already linked with notion")
-                continue
 
-            try:
-                text = f"{body}. By {note.author['username']}. On {note.created_at}."
-                gino.notion.append_to_page(notion_page_uuid, text)
-                note.body += f"\n\n{LINKED_WITH_NOTION}"
-                note.save()
-            except Exception as e:
-                logging.warning(f"Failed: {e}")
+def mark_issue_stale(issue, mutations: T.Optional[IssueMutations] = None):
+    logging.info(f" Open issue {issue.title}")
+    with _mutations(issue, mutations) as m:
+        if m.has_label(STALE):
+            logging.info("   already marked stale.")
+            return
+        m.add_label(STALE)
+    logging.info(f"Marked issue {issue.id} 'stale'")
 
 
 def mark_issues_stale(project):
     """Mark an issue stale if no activity on it for 4 weeks."""
-    updated_before = datetime.now(timezone.utc) - timedelta(days=28)
-    stale = "stale"
-    for issue in project.issues.list(
+    updated_before = now_utc() - timedelta(days=STALE_AFTER_DAYS)
+    for issue in _list_issues(
+        project,
         state="opened",
         order_by="created_at",
         updated_before=updated_before,
         sort="desc",
-        iterator=True,
     ):
-        logging.info(f" Open issue {issue.title}")
-        if stale in issue.labels:
-            logging.info("   already marked stale.")
-            continue
         try:
-            issue.labels += [stale]
-            issue.save()
-            logging.info(f"Successfully marked issue {issue.id} 'stale'")
+            mark_issue_stale(issue)
         except Exception as e:
             logging.error(f"Failed to mark issue {issue.id} as stale. Error {e}")
 
 
-def change_notion_task_status(issue):
-    if CLOSED_IN_NOTION in issue.labels:
-        logging.info("> This issue is already closed in notion.")
-        return
-    if not is_linked_with_notion(issue):
-        logging.warning("> This issue was not found in notion")
-        return 
-
-    notion_status = gl_issue_status_to_notion_task_status(issue)
-    notion_page_uuid = find_notion_page_uuid(issue)
-    if notion_page_uuid:
-        logging.info(f">Updating {notion_page_uuid} status to {notion_status}")
-        gino.notion.change_page_status(notion_page_uuid, notion_status)
-        issue.notes.create(dict(body="Changed status of linked notion page"))
-        issue.labels += [CLOSED_IN_NOTION]
-        issue.save()
-    else:
-        logging.warn("> Could not found notion page!") 
+def change_notion_task_status(issue, mutations: T.Optional[IssueMutations] = None):
+    with _mutations(issue, mutations) as m:
+        if m.has_label(CLOSED_IN_NOTION):
+            logging.info("> This issue is already closed in notion.")
+            return
+        if not is_linked_with_notion(issue):
+            logging.warning("> This issue was not found in notion")
+            return
+
+        notion_status = gl_issue_status_to_notion_task_status(issue, m.state)
+        notion_page_uuid = find_notion_page_uuid(issue)
+        if notion_page_uuid:
+            logging.info(f">Updating {notion_page_uuid} status to {notion_status}")
+            gino.notion.change_page_status(notion_page_uuid, notion_status)
+            m.add_note("Changed status of linked notion page")
+            m.add_label(CLOSED_IN_NOTION)
+        else:
+            logging.warn("> Could not found notion page!")
+
+
+def close_issue_due_to_inactivity(issue, mutations: T.Optional[IssueMutations] = None):
+    with _mutations(issue, mutations) as m:
+        if m.has_label(CLOSED_DUE_TO_INACTIVITY):
+            logging.info("Already closed")
+            return
+        m.add_label(CLOSED_DUE_TO_INACTIVITY)
+        m.close()
+        change_notion_task_status(issue, m)
+    logging.info(f"Closing issue {issue.id}/{issue.title}")
 
 
 def close_issues_due_to_inactivity(project):
     """Close issue if there is no activity on it for 3 months"""
-    updated_before = datetime.now(timezone.utc) - timedelta(days=90)
-    label = "closed-due-to-inactivity"
-    for issue in project.issues.list(
+    updated_before = now_utc() - timedelta(days=INACTIVE_AFTER_DAYS)
+    for issue in _list_issues(
+        project,
         state="opened",
         order_by="created_at",
         updated_before=updated_before,
         sort="desc",
-        iterator=True,
     ):
-        if label in issue.labels:
-            logging.info("Already closed")
-            continue
-
         try:
-            issue.labels += [label]
-            issue.state_event = "close"
-            issue.save()
-            logging.info(f"Successfully closed issue {issue.id}/{issue.title}")
-            change_notion_task_status(issue)
+            close_issue_due_to_inactivity(issue)
         except Exception as e:
             logging.error(f"Failed to close {issue.title}. Error {e}")
 
 
+def classify_issue(issue, *, created_after, closed_after, now) -> T.List[str]:
+    """Return the names of the handlers (in the order they should run) that
+    are interested in this issue.
+    """
+    kinds = []
+    updated_at = parse_datetime(issue.updated_at)
+    if issue.state == "opened":
+        if parse_datetime(issue.created_at) >= created_after:
+            kinds.append("link")
+        if updated_at < now - timedelta(days=STALE_AFTER_DAYS):
+            kinds.append("stale")
+        if updated_at < now - timedelta(days=INACTIVE_AFTER_DAYS):
+            kinds.append("inactive")
+    elif issue.state == "closed" and updated_at >= closed_after:
+        kinds.append("closed")
+    return kinds
+
+
+class ProjectSync:
+    """Sync of the issues of a project in a single pass, shared by the threaded
+    pipeline (`sync_project_issues`) and the asyncio one (`gino.aio`).
+
+    `queries` are the (filters, sync notes?) of the issue listings to make.
+    Every issue listed is passed to `steps`, which classifies it and yields
+    the calls to make, as (stage, function): the handler of each kind, the
+    flush of the mutations and the sync of the notes. A driver (`run_steps`
+    or `gino.aio.run_steps`) makes the calls and sends the outcome back, so
+    that failures are recorded the same way in both pipelines. `finish`
+    stores the watermarks.
+    """
+
+    def __init__(
+        self,
+        project,
+        handlers: T.Dict[str, T.Callable],
+        flush: T.Callable,
+        sync_notes: T.Callable,
+        new_window_mins: int = 7 * 24 * 60,
+        closed_window_mins: int = 600,
+        *,
+        recent: bool = True,
+        sweep: bool = True,
+    ):
+        self.project = project
+        self.handlers = handlers
+        self.flush = flush
+        self.sync_notes = sync_notes
+        self.recent, self.sweep = recent, sweep
+        self.now = now_utc()
+        self.created_after = sync_since(project.id, "sync-new", new_window_mins)
+        self.closed_after = sync_since(project.id, "sync-closed", closed_window_mins)
+        self.stats = dict(pages=0, issues=0)
+        self.failed: T.Set[str] = set()
+
+    def queries(self) -> T.List[T.Tuple[dict, bool]]:
+        queries: T.List[T.Tuple[dict, bool]] = []
+        if self.recent:
+            since = min(self.created_after, self.closed_after)
+            queries.append((dict(updated_after=since), True))
+        if self.sweep:
+            idle = self.now - timedelta(days=STALE_AFTER_DAYS)
+            queries.append((dict(state="opened", updated_before=idle), False))
+        return queries
+
+    def steps(self, issue, notes: bool = False):
+        self.stats["issues"] += 1
+        kinds = classify_issue(
+            issue,
+            created_after=self.created_after,
+            closed_after=self.closed_after,
+            now=self.now,
+        )
+        mutations = IssueMutations(issue)
+        done = []
+        for kind in kinds:
+            try:
+                yield kind, functools.partial(self.handlers[kind], issue, mutations)
+                done.append(kind)
+            except Exception as e:
+                self.failed.add(kind)
+                logging.warning(f"{kind} failed on {issue.web_url}: {e}")
+        writes = mutations.requests
+        try:
+            yield "flush", functools.partial(self.flush, mutations)
+        except Exception as e:
+            self.failed.update(done)
+            logging.warning(f"Failed to update {issue.web_url}: {e}")
+            return
+        self.stats["writes"] = self.stats.get("writes", 0) + writes
+        for kind in done:
+            self.stats[kind] = self.stats.get(kind, 0) + 1
+        if notes and should_sync_notes(issue):
+            try:
+                yield "notes", functools.partial(self.sync_notes, issue)
+            except Exception as e:
+                self.failed.add("notes")
+                logging.warning(f"Failed to sync notes of {issue.web_url}: {e}")
+
+    def finish(self) -> dict:
+        # issues whose notes failed are listed again in the next run, and all
+        # of them after a dry run.
+        if self.recent and not gino.common.DRY_RUN:
+            if not self.failed & {"link", "notes"}:
+                store_watermark(self.project.id, "sync-new", self.now)
+            if "closed" not in self.failed:
+                store_watermark(self.project.id, "sync-closed", self.now)
+        return self.stats
+
+
+def run_steps(steps):
+    """Make the calls of `ProjectSync.steps`, timing each stage."""
+    outcome: T.Optional[Exception] = None
+    result = None
+    while True:
+        try:
+            if outcome is not None:
+                stage, call = steps.throw(outcome)
+            else:
+                stage, call = steps.send(result)
+        except StopIteration:
+            return
+        outcome, result = None, None
+        try:
+            with gino.metrics.timed(stage):
+                result = call()
+        except Exception as e:
+            outcome = e
+
+
+def sync_project_issues(
+    project,
+    new_window_mins: int = 7 * 24 * 60,
+    closed_window_mins: int = 600,
+    *,
+    recent: bool = True,
+    sweep: bool = True,
+) -> dict:
+    """Sync all issues of a project in a single pass.
+
+    Two paginated queries are made: one for issues that changed since the
+    oldest watermark (new and recently closed issues) and one for open issues
+    that have seen no activity for `STALE_AFTER_DAYS` (stale and inactive
+    issues). Each issue is then dispatched to the interested handlers, and the
+    new notes of changed issues are sent to notion. Set `recent` or `sweep` to
+    False to skip the first or the second query.
+
+    Returns stats of the run including the number of API pages fetched.
+    """
+    handlers = {
+        "link": lambda issue, m: link_issue_with_notion(project, issue, m),
+        "closed": change_notion_task_status,
+        "stale": mark_issue_stale,
+        "inactive": close_issue_due_to_inactivity,
+    }
+    sync = ProjectSync(
+        project,
+        handlers,
+        flush=lambda mutations: mutations.flush(),
+        sync_notes=sync_issue_notes,
+        new_window_mins=new_window_mins,
+        closed_window_mins=closed_window_mins,
+        recent=recent,
+        sweep=sweep,
+    )
+    for params, notes in sync.queries():
+        for issue in _list_issues(project, sync.stats, **params):
+            run_steps(sync.steps(issue, notes))
+    return sync.finish()
+
+
 # FIXME: Email are returned only if admin queries the endpoint.
 # See https://docs.gitlab.com/ee/api/users.html
 def _find_gitlab_user_email(user: str):
@@ -226,33 +623,146 @@ def get_project(name_or_id):
 
 
 def compute_issue_task_maturity_metric(issue) -> dict:
-    created_at = parse_date(issue.created_at)
+    created_at = parse_datetime(issue.created_at)
     due_date = parse_date(issue.due_date)
-    closed_at = parse_date(issue.closed_at)
+    closed_at = parse_datetime(issue.closed_at)
     metric = dict()
     metric["created_at"] = issue.created_at
+    metric["created_ts"] = created_at.timestamp()
     metric["days_punctuality"] = (due_date - closed_at).days if due_date else None
     metric["days_spent"] = (closed_at - created_at).days
     return metric
 
 
-@shelve_it("project_maturity.shelve")
-def compute_project_task_maturity_metric(project_id, project):
+@gino.metrics.timed("task-maturity")
+def compute_project_task_maturity_metric(project) -> int:
+    """Add the metric of the issues of the project closed since the last run to
+    the metric store. Returns the number of issues added."""
+    t_start = now_utc()
+    kwargs = {}
+    if (last := load_watermark(project.id, "task-maturity")) is not None:
+        last_activity = parse_datetime(project.last_activity_at)
+        if last_activity < last - timedelta(minutes=PROJECT_ACTIVITY_GRACE_MINS):
+            # nothing has happened in the project since the last run.
+            return 0
+        # closing an issue updates it, and there is no closed_after filter.
+        overlap = timedelta(minutes=gino.common.WATERMARK_OVERLAP_MINS)
+        kwargs["updated_after"] = last - overlap
     result = {}
-    for issue in project.issues.list(state="closed", iterator=True):
-        issue_id = issue.iid
+    for issue in project.issues.list(
+        state="closed", iterator=True, per_page=ISSUES_PER_PAGE, **kwargs
+    ):
+        key = f"{project.id}:{issue.iid}"
         try:
             metric = compute_issue_task_maturity_metric(issue)
-            result[issue_id] = metric
         except Exception as e:
-            print(f"Failed to get metric: {e}")
-            result[issue_id] = None
+            logging.warning(f"Failed to get metric of {issue.web_url}: {e}")
+            metric = None
+        result[key] = dict(project=project.name, iid=issue.iid, metric=metric)
+    gino.state.backend().put_many(gino.state.MATURITY, result)
+    store_watermark(project.id, "task-maturity", t_start)
+    return len(result)
+
+
+def has_numpy() -> bool:
+    return importlib.util.find_spec("numpy") is not None
+
+
+def task_maturity_metrics() -> T.Dict[str, T.Dict[str, T.Optional[dict]]]:
+    """All the metrics in the store as project name -> issue iid -> metric"""
+    result: T.Dict[str, T.Dict[str, T.Optional[dict]]] = {}
+    for _, entry in gino.state.backend().items(gino.state.MATURITY):
+        result.setdefault(entry["project"], {})[str(entry["iid"])] = entry["metric"]
     return result
 
 
-def plot_punctuality(result):
-    for project, data in result.items():
-        print(project, data)
+def task_maturity_columns() -> T.Dict[str, T.Any]:
+    """All the metrics in the store as columns (numpy arrays). Issues without
+    metric are left out, and a missing due date is NaN."""
+    import numpy as np
+
+    project, iid, created_ts, punctuality, days_spent = [], [], [], [], []
+    for _, entry in gino.state.backend().items(gino.state.MATURITY):
+        if (metric := entry["metric"]) is None:
+            continue
+        project.append(entry["project"])
+        iid.append(entry["iid"])
+        created_ts.append(metric["created_ts"])
+        punctuality.append(metric["days_punctuality"])
+        days_spent.append(metric["days_spent"])
+    return dict(
+        project=np.array(project, dtype=str),
+        iid=np.array(iid, dtype=np.int64),
+        created_ts=np.array(created_ts, dtype=np.float64),
+        days_punctuality=np.array(punctuality, dtype=np.float64),
+        days_spent=np.array(days_spent, dtype=np.float64),
+    )
+
+
+def save_task_maturity(columns: T.Dict[str, T.Any], path: Path = MATURITY_FILE):
+    import numpy as np
+
+    np.savez_compressed(path, **columns)
+
+
+def load_task_maturity(path: Path = MATURITY_FILE) -> T.Dict[str, T.Any]:
+    import numpy as np
+
+    with np.load(path) as data:
+        return {name: data[name] for name in data.files}
+
+
+def list_projects(active_after: T.Optional[datetime] = None):
+    """Non-archived projects, most recently active first. If `active_after` is
+    given, only projects with activity after it are listed."""
+    kwargs = {}
+    if active_after is not None:
+        kwargs["last_activity_after"] = active_after
+    return get_gitlab_client().projects.list(
+        iterator=True,
+        archived=False,
+        order_by="last_activity_at",
+        sort="desc",
+        **kwargs,
+    )
+
+
+def update_project_catalogue(projects, complete: bool = False) -> T.List:
+    """Remember the projects (and their last activity) in the catalogue. If the
+    list is `complete`, projects not in it (deleted or archived) are removed
+    from the catalogue."""
+    projects = list(projects)
+    state = gino.state.backend()
+    if complete:
+        ids = {str(p.id) for p in projects}
+        for key, _ in list(state.items(gino.state.PROJECTS)):
+            if key not in ids:
+                state.delete(gino.state.PROJECTS, key)
+    state.put_many(
+        gino.state.PROJECTS,
+        {
+            str(p.id): dict(
+                id=p.id,
+                name=p.name,
+                name_with_namespace=p.name_with_namespace,
+                last_activity_at=p.last_activity_at,
+            )
+            for p in projects
+        },
+    )
+    return projects
+
+
+def catalogued_projects() -> T.List:
+    """Projects in the catalogue. These are lazy objects i.e. no API call is
+    made to create them."""
+    import gitlab.v4.objects
+
+    manager = get_gitlab_client().projects
+    return [
+        gitlab.v4.objects.Project(manager, attrs, lazy=True)
+        for _, attrs in gino.state.backend().items(gino.state.PROJECTS)
+    ]
 
 
 def _get_projects(project_name_or_id: T.Optional[str] = None):
@@ -264,57 +774,63 @@ def _get_projects(project_name_or_id: T.Optional[str] = None):
 
 
 @app.command("task-maturity")
-def compute_task_maturity_metric(project_name_or_id: T.Optional[str] = None):
-    result = {}
-    for project in _get_projects(project_name_or_id):
+def compute_task_maturity_metric(
+    project_name_or_id: T.Optional[str] = None,
+    workers: int = gino.common.NUM_WORKERS,
+):
+    """Update the task maturity metric of the closed issues, and write all the
+    metrics to punctuality.npz (punctuality.json without numpy). Only issues
+    closed since the last run are fetched."""
+
+    def _compute(project) -> int:
         logging.info(f"=> Analysing '{project.name}'...")
-        metric = compute_project_task_maturity_metric(project.name, project)
-        result[project.name] = metric
-
-    # save the data for ploting.
-    outfile = Path() / "punctuality.json"
-    with outfile.open("w") as f:
-        json.dump(result, f)
+        try:
+            return compute_project_task_maturity_metric(project)
+        except Exception as e:
+            logging.warning(f"Failed to analyse '{project.name}': {e}")
+            return 0
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        n_new = sum(pool.map(_compute, _get_projects(project_name_or_id)))
+    logging.info(f"{n_new} newly closed issues analysed")
+    if not has_numpy():
+        with MATURITY_JSON_FILE.open("w") as f:
+            json.dump(task_maturity_metrics(), f)
+        logging.info(
+            f"Wrote metrics to {MATURITY_JSON_FILE}; install gino[plot] for"
+            f" {MATURITY_FILE}"
+        )
+        return
+    columns = task_maturity_columns()
+    save_task_maturity(columns)
+    logging.info(f"Wrote metrics of {len(columns['iid'])} issues to {MATURITY_FILE}")
 
 
 @app.command("plot-task-maturity")
 def plot_task_maturity(days_in_past: T.Optional[int] = None):
     import matplotlib.pyplot as plt
+    import numpy as np
 
     plt.style.use("ggplot")
     plt.figure(figsize=(8, 5))
 
-    datafile = Path() / "punctuality.json"
-    data = json.loads(datafile.read_text())
+    data = load_task_maturity()
 
     title = "All data"
+    selected = np.ones(len(data["iid"]), dtype=bool)
     if days_in_past is not None:
         title = f"Data (last {days_in_past} days)"
-
-    maturity_box, days_to_close = [], []
-    n_issues_without_due_date = 0
-    now = datetime.now()
-    for project, project_data in data.items():
-        for issue, issue_data in project_data.items():
-            if issue_data is None:
-                logging.warning("Empty issue data")
-                continue
-            if days_in_past is not None:
-                print(issue_data)
-                if (now - parse_date(issue_data["created_at"])).days > days_in_past:
-                    continue
-            if not issue_data:
-                logging.warning("Empty issue_data")
-                continue
-            assert issue_data["days_spent"] is not None, issue_data
-            days_to_close.append(issue_data["days_spent"])
-            if (m := issue_data["days_punctuality"]) is not None:
-                maturity_box.append(m)
-            else:
-                n_issues_without_due_date += 1
+        selected = data["created_ts"] >= now_utc().timestamp() - days_in_past * 86400
+
+    days_to_close = data["days_spent"][selected]
+    punctuality = data["days_punctuality"][selected]
+    maturity_box = punctuality[~np.isnan(punctuality)]
+    logging.info(
+        f"{len(days_to_close)} issues, {len(days_to_close) - len(maturity_box)}"
+        " without due date"
+    )
 
     ax1 = plt.subplot(221)
-    print(f"Plotting {maturity_box}")
     ax1.hist(maturity_box, bins=10)
     ax1.set_title("Punctuality")
     ax1.set_xlabel("#days")
@@ -332,7 +848,7 @@ def plot_task_maturity(days_in_past: T.Optional[int] = None):
 
     plt.suptitle(title)
     plt.tight_layout()
-    plt.savefig(datafile.with_suffix(".png"))
+    plt.savefig(MATURITY_FILE.with_suffix(".png"))
     plt.close()
 
 
@@ -346,22 +862,73 @@ def no_due_date(project_name_or_id: str, state: str = "opened"):
         print(author, author_email, issue)
 
 
-def find_notion_page_uuid(issue) -> T.Optional[str]:
+def page_uuid_in_text(text: str) -> T.Optional[str]:
+    """uuid of the notion page in the first url of the text"""
+    global _URL_EXTRACTOR
+    if _URL_EXTRACTOR is None:
+        from urlextract import URLExtract
+
+        _URL_EXTRACTOR = URLExtract()
+    urls = _URL_EXTRACTOR.find_urls(text)
+    if len(urls) > 0:
+        try:
+            return uuid.UUID(urls[0][-32:]).hex
+        except ValueError:
+            pass
+    return None
+
+
+def _find_notion_page_uuid_in_notes(issue) -> T.Optional[str]:
     # find the note that says more information can be found.
-    extractor = URLExtract()
     for note in issue.notes.list(iterator=True):
-        urls = extractor.find_urls(note.body)
-        if len(urls) > 0:
-            page_uuid = urls[0][-32:]
+        if (page_uuid := page_uuid_in_text(note.body)) is not None:
             return page_uuid
     return None
 
 
-def gl_issue_status_to_notion_task_status(issue: str) -> str:
+def find_notion_page_uuid(issue) -> T.Optional[str]:
+    """Return the uuid of the notion page linked with the issue. The local index
+    is used if possible, else the notes of the issue are searched (and the
+    index is updated).
+    """
+    if (page_uuid := page_of_issue(issue.project_id, issue.iid)) is not None:
+        return page_uuid
+    if (page_uuid := _find_notion_page_uuid_in_notes(issue)) is not None:
+        index_issue_page(issue.project_id, issue.iid, page_uuid)
+    return page_uuid
+
+
+@app.command("backfill-index")
+def backfill_issue_page_index(project_name_or_id: T.Optional[str] = None):
+    """Index the notion pages of the issues that were linked before the index
+    existed. Only needs to be run once.
+    """
+    nindexed = 0
+    for project in _get_projects(project_name_or_id):
+        logging.info(f"=> Indexing '{project.name}'...")
+        for label in (LINKED_WITH_NOTION, "linked-with-notion"):
+            for issue in _list_issues(project, state="all", labels=[label]):
+                if page_of_issue(issue.project_id, issue.iid) is not None:
+                    continue
+                try:
+                    page_uuid = _find_notion_page_uuid_in_notes(issue)
+                except Exception as e:
+                    logging.warning(f"Failed to read notes of {issue.web_url}: {e}")
+                    continue
+                if page_uuid is None:
+                    logging.warning(f"No notion page found for {issue.web_url}")
+                    continue
+                index_issue_page(issue.project_id, issue.iid, page_uuid)
+                nindexed += 1
+    logging.info(f"Indexed {nindexed} issues.")
+
+
+def gl_issue_status_to_notion_task_status(issue, state: T.Optional[str] = None) -> str:
     notion_status = "Todo"
-    if issue.state == "closed":
+    state = state or issue.state
+    if state == "closed":
         notion_status = "Done"
-    elif issue.state == "opened":
+    elif state == "opened":
         notion_status = "Not Started"
     else:
         pass
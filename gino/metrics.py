@@ -0,0 +1,218 @@
+"""Counters and latency histograms of GiNo.
+
+Every GitLab and Notion request is counted and timed by `gino.ratelimit`.
+Sync stages are timed with `timed`, which can be used as a context manager or
+a decorator. API requests sent within a stage are attributed to it, so one
+can see which stage uses the API quota.
+
+    with gino.metrics.timed("link"):
+        ...
+
+The metrics can be rendered in the Prometheus text format (`render`), written
+to a file for the textfile collector of node_exporter (`write_textfile`) or
+served over HTTP (`serve`).
+"""
+
+import os
+import time
+import logging
+import threading
+import contextlib
+import contextvars
+import typing as T
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Upper bounds (seconds) of the buckets of latency histograms.
+BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300, float("inf"))
+
+Labels = T.Tuple[T.Tuple[str, str], ...]
+
+HELP = dict(
+    gino_api_requests_total="HTTP requests sent to GitLab and Notion",
+    gino_api_request_seconds="Latency of HTTP requests to GitLab and Notion",
+    gino_api_throttled_total="Requests throttled by the service (HTTP 429)",
+    gino_api_retried_total="Requests retried",
+    gino_stage_seconds="Time spent in a sync stage",
+    gino_project_sync_seconds="Time taken to sync a project",
+    gino_job_seconds="Time taken by a job of the scheduler",
+    gino_job_delay_seconds="Time between a job being due and its start",
+)
+
+_STAGE: contextvars.ContextVar[str] = contextvars.ContextVar("stage", default="")
+_LOCK = threading.Lock()
+_COUNTERS: T.Dict[str, T.Dict[Labels, float]] = {}
+_HISTOGRAMS: T.Dict[str, T.Dict[Labels, "Histogram"]] = {}
+
+
+class Histogram:
+    def __init__(self):
+        self.counts = [0] * len(BUCKETS)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        for i, bound in enumerate(BUCKETS):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        self.sum += value
+        self.count += 1
+
+    def copy(self) -> "Histogram":
+        h = Histogram()
+        h.counts, h.sum, h.count = list(self.counts), self.sum, self.count
+        return h
+
+
+def _labels(labels: T.Dict[str, T.Any]) -> Labels:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def inc(name: str, value: float = 1, **labels):
+    key = _labels(labels)
+    with _LOCK:
+        counter = _COUNTERS.setdefault(name, {})
+        counter[key] = counter.get(key, 0) + value
+
+
+def observe(name: str, value: float, **labels):
+    key = _labels(labels)
+    with _LOCK:
+        _HISTOGRAMS.setdefault(name, {}).setdefault(key, Histogram()).observe(value)
+
+
+def stage() -> str:
+    """Name of the stage being run (by this thread or task)."""
+    return _STAGE.get()
+
+
+@contextlib.contextmanager
+def timed(stage: str):
+    """Record the time spent in `stage` in the gino_stage_seconds histogram.
+    Can also be used as a decorator."""
+    token = _STAGE.set(stage)
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        _STAGE.reset(token)
+        observe("gino_stage_seconds", time.perf_counter() - t0, stage=stage)
+
+
+def snapshot() -> T.Tuple[dict, dict]:
+    """A copy of all the metrics e.g. to report the changes during a cycle."""
+    with _LOCK:
+        counters = {name: dict(c) for name, c in _COUNTERS.items()}
+        histograms = {
+            name: {key: h.copy() for key, h in hs.items()}
+            for name, hs in _HISTOGRAMS.items()
+        }
+    return counters, histograms
+
+
+def _format_labels(labels: Labels, extra: T.Optional[T.Tuple[str, str]] = None) -> str:
+    items = list(labels) + ([extra] if extra else [])
+    if not items:
+        return ""
+    escaped = (v.replace("\\", "\\\\").replace('"', '\\"') for _, v in items)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(items, escaped)) + "}"
+
+
+def render() -> str:
+    """All the metrics in the Prometheus text format."""
+    counters, histograms = snapshot()
+    lines = []
+    for name, values in sorted(counters.items()):
+        lines += [f"# HELP {name} {HELP.get(name, name)}", f"# TYPE {name} counter"]
+        lines += [f"{name}{_format_labels(k)} {v:g}" for k, v in sorted(values.items())]
+    for name, values in sorted(histograms.items()):
+        lines += [f"# HELP {name} {HELP.get(name, name)}", f"# TYPE {name} histogram"]
+        for key, h in sorted(values.items()):
+            cumulative = 0
+            for bound, count in zip(BUCKETS, h.counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else f"{bound:g}"
+                lines.append(
+                    f"{name}_bucket{_format_labels(key, ('le', le))} {cumulative}"
+                )
+            lines.append(f"{name}_sum{_format_labels(key)} {h.sum:.6f}")
+            lines.append(f"{name}_count{_format_labels(key)} {h.count}")
+    return "\n".join(lines) + "\n"
+
+
+def write_textfile(path: str):
+    """Write the metrics to `path` atomically (textfile collector)."""
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w") as f:
+        f.write(render())
+    os.replace(tmp, path)
+
+
+def serve(port: int, host: str = "0.0.0.0") -> ThreadingHTTPServer:
+    """Serve the metrics at http://host:port/metrics in a background thread."""
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path != "/metrics":
+                self.send_error(404)
+                return
+            body = render().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    logging.info(f"Serving metrics on http://{host}:{port}/metrics")
+    return server
+
+
+def _delta(now: dict, before: dict, name: str) -> T.Dict[Labels, T.Any]:
+    result = {}
+    for key, value in now.get(name, {}).items():
+        old = before.get(name, {}).get(key)
+        if isinstance(value, Histogram):
+            h = value.copy()
+            if old is not None:
+                h.sum, h.count = h.sum - old.sum, h.count - old.count
+            if h.count:
+                result[key] = h
+        elif value - (old or 0):
+            result[key] = value - (old or 0)
+    return result
+
+
+def summary(since: T.Optional[T.Tuple[dict, dict]] = None) -> str:
+    """Table of the time spent per stage and of the API requests per service and
+    stage since the given `snapshot` (or since the start)."""
+    counters, histograms = snapshot()
+    old_counters, old_histograms = since or ({}, {})
+    lines = [f"{'stage':<24}{'calls':>8}{'total(s)':>10}{'mean(s)':>10}"]
+    stages = _delta(histograms, old_histograms, "gino_stage_seconds")
+    for key, h in sorted(stages.items(), key=lambda x: x[1].sum, reverse=True):
+        name, mean = dict(key)["stage"], h.sum / h.count
+        lines.append(f"{name:<24}{h.count:>8}{h.sum:>10.2f}{mean:>10.3f}")
+
+    requests: T.Dict[T.Tuple[str, str], float] = {}
+    errors: T.Dict[T.Tuple[str, str], float] = {}
+    for key, n in _delta(counters, old_counters, "gino_api_requests_total").items():
+        labels = dict(key)
+        row = (labels["service"], labels.get("stage") or "-")
+        requests[row] = requests.get(row, 0) + n
+        if labels.get("status", "").startswith(("4", "5")):
+            errors[row] = errors.get(row, 0) + n
+    lines.append(f"{'service':<10}{'stage':<24}{'requests':>10}{'errors':>8}")
+    for (service, stage_), n in sorted(requests.items(), key=lambda x: -x[1]):
+        errs = errors.get((service, stage_), 0)
+        lines.append(f"{service:<10}{stage_:<24}{n:>10.0f}{errs:>8.0f}")
+    return "\n".join(lines)
+
+
+def log_summary(since: T.Optional[T.Tuple[dict, dict]] = None):
+    for line in summary(since).splitlines():
+        logging.info(line)
@@ -1,30 +1,49 @@
 import os
 import difflib
+import hashlib
 import uuid
 import typing as T
 import pprint
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import logging
-
-from datetime import timedelta
-
-import dateparser
-from validators import email
-from validators.uuid import uuid as is_uuid
-
-from notion_client import Client
+import re
+import threading
+import time
+from datetime import datetime
 
 import gino.common
+import gino.metrics
+import gino.state
 
 import typer
 
 app = typer.Typer()
 
+
+@app.callback()
+def main():
+    """Notion side of GiNo"""
+    # also when run as `python -m gino.notion`.
+    gino.common.setup_logging()
+
+
 # Notion client.
 # https://github.com/ramnes/notion-sdk-py
 NOTION = None
+_NOTION_LOCK = threading.Lock()
+_BOT_USER_ID: T.Optional[str] = None
+_BOT_USER_ID_LOCK = threading.Lock()
 
 NOTION_SECURITY_METRICS_DB: T.Final[str] = "fc79dbd028694a32a1f162eae3bcdb01"
 
+# Directory of notion users. Refreshed from notion every USER_DIRECTORY_TTL_SEC.
+USER_DIRECTORY_TTL_SEC = 10 * 60
+_USERS: T.Dict[str, T.Any] = dict(fetched_at=0.0, by_id={}, by_email={}, by_name={})
+_USERS_LOCK = threading.Lock()
+# A fuzzy match of a gitlab user is remembered this long, so that a wrong match
+# does not stick once the names in notion are fixed.
+USER_MATCH_TTL_SEC = 24 * 60 * 60
+
 
 def _pp(x):
     pprint.pprint(x)
@@ -32,27 +51,76 @@ def _pp(x):
 
 def client():
     global NOTION
-    if NOTION is not None:
-        return NOTION
-    gino.common.load_config()
-    api_key = os.environ["NOTION_ACCESS_TOKEN"]
-    NOTION = Client(auth=api_key)
+    with _NOTION_LOCK:
+        if NOTION is not None:
+            return NOTION
+        from notion_client import Client
+        import gino.transport
+
+        gino.common.load_config()
+        api_key = os.environ["NOTION_ACCESS_TOKEN"]
+        NOTION = Client(
+            auth=api_key,
+            client=gino.transport.httpx_client("notion"),
+            **client_options(),
+        )
     return NOTION
 
 
+def paginate(function, **kwargs):
+    """All the results of a paginated notion API"""
+    from notion_client.helpers import iterate_paginated_api
+
+    return iterate_paginated_api(function, **kwargs)
+
+
+def _is_uuid(value: str) -> bool:
+    import validators
+
+    return validators.uuid(value) is True
+
+
+def _is_email(value: str) -> bool:
+    import validators
+
+    return validators.email(value) is True
+
+
+def client_options() -> dict:
+    """Extra options of the notion client. NOTION_BASE_URL points the client to
+    another server, e.g. a mock server in benchmarks."""
+    if base_url := os.environ.get("NOTION_BASE_URL"):
+        return dict(base_url=base_url)
+    return {}
+
+
 def db_id():
     return os.environ["TASK_DATABASE_ID"]
 
 
-def _create_block(text, color="red"):
-    return dict(
-        object="block",
-        type="paragraph",
-        paragraph=dict(
-            rich_text=dict(type="text", text=dict(content=text)),
-            annotation=dict(color=color),
-        ),
-    )
+# Limits of the notion API.
+# See https://developers.notion.com/reference/request-limits
+MAX_TEXT_LENGTH = 2000
+MAX_RICH_TEXTS = 100
+MAX_BLOCKS_PER_REQUEST = 100
+
+
+def _create_blocks(text: str) -> T.List[dict]:
+    """Paragraph block(s) with the given text. Text is split into rich_text
+    chunks of at most MAX_TEXT_LENGTH characters.
+    """
+    chunks = [
+        text[i : i + MAX_TEXT_LENGTH] for i in range(0, len(text), MAX_TEXT_LENGTH)
+    ] or [""]
+    rich_texts = [dict(type="text", text=dict(content=chunk)) for chunk in chunks]
+    return [
+        dict(
+            object="block",
+            type="paragraph",
+            paragraph=dict(rich_text=rich_texts[i : i + MAX_RICH_TEXTS]),
+        )
+        for i in range(0, len(rich_texts), MAX_RICH_TEXTS)
+    ]
 
 
 def get_page(_uuid):
@@ -62,7 +130,7 @@ def get_page(_uuid):
         logging.warning(f"Failed to convert uuid {_uuid} to UUID. Error {e}.")
         return None
 
-    if not is_uuid(uid):
+    if not _is_uuid(uid):
         logging.warning(f"Not a valid uuid: {uid}.")
         return None
     notion = client()
@@ -70,42 +138,72 @@ def get_page(_uuid):
     return notion.pages.retrieve(uid)
 
 
+def status_properties(status: str) -> dict:
+    return dict(Status=dict(status=dict(name=status)))
+
+
 def change_page_status(page_uuid, status: str):
     """Change the status of the page"""
-    notion = client()
     _uuid = str(uuid.UUID(page_uuid))
-    assert is_uuid(_uuid), f"{_uuid} is not UUID."
-    notion.pages.update(_uuid, properties=dict(Status=dict(status=dict(name=status))))
+    assert _is_uuid(_uuid), f"{_uuid} is not UUID."
+    if gino.common.DRY_RUN:
+        logging.info(f"[dry-run] Would change status of `{_uuid}` to {status}")
+        return
+    notion = client()
+    notion.pages.update(_uuid, properties=status_properties(status))
     logging.info(f"Successfully updated status of `{_uuid}` to {status}")
 
 
-def append_to_page(page_uuid, text):
+def _append_blocks(page_uuid: str, blocks: T.List[dict]):
     notion = client()
+    for i in range(0, len(blocks), MAX_BLOCKS_PER_REQUEST):
+        children = blocks[i : i + MAX_BLOCKS_PER_REQUEST]
+        notion.blocks.children.append(block_id=page_uuid, children=children)
+
+
+def append_to_page(page_uuid, text: T.Union[str, T.List[str]]):
+    """Append paragraph(s) to the page. All paragraphs are sent in a single
+    request (or as few as the API allows)."""
     _uuid = str(uuid.UUID(page_uuid))
-    assert is_uuid(_uuid), f"{_uuid} is not UUID."
-    children = [dict(paragraph=dict(rich_text=[dict(text=dict(content=text))]))]
-    notion.blocks.children.append(block_id=_uuid, children=children)
-    logging.info(f"Successfully appended to page `{_uuid}`")
+    assert _is_uuid(_uuid), f"{_uuid} is not UUID."
+    texts = [text] if isinstance(text, str) else text
+    blocks = [block for t in texts for block in _create_blocks(t)]
+    if not blocks:
+        return
+    if gino.common.DRY_RUN:
+        logging.info(f"[dry-run] Would append {len(blocks)} blocks to `{_uuid}`")
+        return
+    _append_blocks(_uuid, blocks)
+    logging.info(f"Successfully appended {len(blocks)} blocks to page `{_uuid}`")
 
 
-@app.command()
-def create_task(
+def task_dedupe_key(url: str) -> str:
+    """Key of the task of a gitlab issue in the dedupe namespace. It depends
+    only on the url of the issue so that renaming an issue does not create a
+    second task."""
+    return f"task:{url}"
+
+
+def task_exists(url: str, title: str) -> bool:
+    """Was a task created for the issue? Older versions keyed tasks by url and
+    title."""
+    keys = [task_dedupe_key(url), f"{url}-{title}"]
+    return bool(gino.state.backend().get_many(gino.state.DEDUPE, keys))
+
+
+def task_properties(
     title: str,
     url: str,
     *,
     due_date: T.Optional[str] = None,
     assignee: T.Optional[str] = None,
     author: T.Optional[str] = None,
-    gitlab_data=None,
-):
-    shelve_key = f"{url}-{title}"
-    if gino.common.load(shelve_key) is not None:
-        logging.debug("Page already exists in notion. Doing nothing")
-        return
-
+    labels: T.Optional[T.List[str]] = None,
+) -> dict:
+    """Properties of a page in the task database"""
     tags = [{"name": "FromGITLAB"}]
-    if gitlab_data.labels:
-        tags += [{"name": value} for value in gitlab_data.labels]
+    if labels:
+        tags += [{"name": value} for value in labels]
 
     params = {
         "Task name": {"type": "title", "title": [{"text": {"content": title}}]},
@@ -113,7 +211,8 @@ def create_task(
         "URL": {"url": url},
     }
     if due_date:
-        dd = dateparser.parse(due_date).strftime("%Y-%m-%dT%H:%M:%S") + ".000Z"
+        due = gino.common.parse_datetime(due_date)
+        dd = due.strftime("%Y-%m-%dT%H:%M:%S") + ".000Z"
         logging.info(f"> due date {dd}")
         params["Due"] = {"date": {"start": dd}}
 
@@ -122,30 +221,58 @@ def create_task(
 
     if author:
         params["Stakeholders"] = {"people": [{"id": _find_notion_uuid(author)}]}
+    return params
+
+
+def content_blocks(content: T.Optional[T.List[str]]) -> T.List[dict]:
+    return [block for text in content or [] for block in _create_blocks(text)]
+
 
-    ## FIXME: appending blocks doesn't work
-    ## page = []
-    ## page.append(
-    ##     _create_block(
-    ##         f"""This page is automatically created by CMO.\
-    ##         It is best if you upadte the issues at {url}.\n\n"""
-    ##     ),
-    ## )
-    ## page.append(_create_block(gitlab_data.description))
-    ## params["children"] = [page]
-    ## pprint.pprint(params)
-    page = client().pages.create(parent={"database_id": db_id()}, properties=params)
+@app.command()
+def create_task(
+    title: str,
+    url: str,
+    *,
+    due_date: T.Optional[str] = None,
+    assignee: T.Optional[str] = None,
+    author: T.Optional[str] = None,
+    gitlab_data=None,
+    content: T.Optional[T.List[str]] = None,
+):
+    """Create a task in the task database. Paragraphs in `content` are added to
+    the page in the same request.
+    """
+    if task_exists(url, title):
+        logging.debug("Page already exists in notion. Doing nothing")
+        return
+
+    params = task_properties(
+        title,
+        url,
+        due_date=due_date,
+        assignee=assignee,
+        author=author,
+        labels=gitlab_data.labels if gitlab_data else None,
+    )
+    blocks = content_blocks(content)
+    page = client().pages.create(
+        parent={"database_id": db_id()},
+        properties=params,
+        children=blocks[:MAX_BLOCKS_PER_REQUEST],
+    )
+    if len(blocks) > MAX_BLOCKS_PER_REQUEST:
+        _append_blocks(page["id"], blocks[MAX_BLOCKS_PER_REQUEST:])
 
     # if page is created successful, write to the global keyval store.
-    gino.common.store(shelve_key, 1)
+    gino.common.store(task_dedupe_key(url), 1, gino.state.DEDUPE)
 
     return page
 
 
 def _find_notion_uuid(gitlab_user_or_email_or_uuid: str):
-    if is_uuid(gitlab_user_or_email_or_uuid):
+    if _is_uuid(gitlab_user_or_email_or_uuid):
         return gitlab_user_or_email_or_uuid
-    if email(gitlab_user_or_email_or_uuid):
+    if _is_email(gitlab_user_or_email_or_uuid):
         user = _find_user_by_email(gitlab_user_or_email_or_uuid)
         if user:
             return user["id"]
@@ -155,29 +282,64 @@ def _find_notion_uuid(gitlab_user_or_email_or_uuid: str):
     assert False, f"Failed to find uuid for {gitlab_user_or_email_or_uuid}"
 
 
-# cache but only for 10 minutes.
-def _find_user_by_email(email: str) -> T.Optional[dict]:
-    """Find user in notion with given email"""
-    assert email(email), "Expected an email"
-    notion = client()
-    users = notion.users.list()
+def _normalize_name(name: str) -> str:
+    """'Dilawar Singh' and 'dilawar.singh' both become 'dilawarsingh'"""
+    return re.sub(r"[^a-z0-9]", "", name.lower())
 
-    result = None
-    for user in users["results"]:
-        if user["person"]["email"] == email:
-            result = user
-            break
-    return result
+
+def _user_directory() -> dict:
+    """All notion users indexed by id, email and normalized name. The directory
+    is fetched again (all pages) when it is older than USER_DIRECTORY_TTL_SEC.
+    """
+    with _USERS_LOCK:
+        if time.time() - _USERS["fetched_at"] < USER_DIRECTORY_TTL_SEC:
+            return _USERS
+        by_id: T.Dict[str, dict] = {}
+        by_email: T.Dict[str, dict] = {}
+        by_name: T.Dict[str, dict] = {}
+        for user in paginate(client().users.list):
+            by_id[user["id"]] = user
+            if user_email := user.get("person", {}).get("email"):
+                by_email[user_email.lower()] = user
+            if name := user.get("name"):
+                by_name.setdefault(_normalize_name(name), user)
+        _USERS.update(by_id=by_id, by_email=by_email, by_name=by_name)
+        _USERS["fetched_at"] = time.time()
+        logging.info(f"Loaded {len(by_id)} notion users")
+    return _USERS
+
+
+def _find_user_by_email(user_email: str) -> T.Optional[dict]:
+    """Find user in notion with given email"""
+    assert _is_email(user_email), "Expected an email"
+    return _user_directory()["by_email"].get(user_email.lower())
 
 
-# cache but only for 10 minutes.
 def _find_user_by_gitlab_user(gitlab_username: str) -> T.Optional[dict]:
-    """Find user in notion with given email"""
+    """Find user in notion with given gitlab username. Exact match on the
+    normalized name is tried first, then a fuzzy match. A fuzzy match is
+    remembered across runs for USER_MATCH_TTL_SEC.
+    """
     gitlab_username = gitlab_username.lower()
+    users = _user_directory()
+    user = users["by_name"].get(_normalize_name(gitlab_username))
+    if user is not None:
+        return user
+
+    memo_key = f"notion-user:{gitlab_username}"
+    user_id = gino.common.load(memo_key, gino.state.CACHE)
+    if user_id in users["by_id"]:
+        return users["by_id"][user_id]
+    user = _fuzzy_find_user(gitlab_username, users["by_id"].values())
+    if user is not None:
+        gino.common.store(
+            memo_key, user["id"], gino.state.CACHE, ttl_sec=USER_MATCH_TTL_SEC
+        )
+    return user
 
-    notion = client()
-    users = notion.users.list()
-    for user in users["results"]:
+
+def _fuzzy_find_user(gitlab_username: str, users) -> T.Optional[dict]:
+    for user in users:
         if "name" not in user:
             continue
         name = user["name"].lower()
@@ -185,12 +347,13 @@ def _find_user_by_gitlab_user(gitlab_username: str) -> T.Optional[dict]:
             return user
         if gitlab_username in name:
             return user
+    return None
 
 
 @app.command()
 def find_user(email_or_gitlab_username: str) -> T.Optional[dict]:
     """Find user in notion with given email"""
-    if email(email_or_gitlab_username):
+    if _is_email(email_or_gitlab_username):
         user = _find_user_by_email(email_or_gitlab_username)
     else:
         user = _find_user_by_gitlab_user(email_or_gitlab_username)
@@ -215,92 +378,239 @@ def blocks_to_markdown(blocks) -> str:
 
 
 @app.command("sync-blocks")
-def sync_recently_added_blocks():
-    """find pages that were modified in last INTER_RUN_INTERVAL_SEC"""
-    mmin = gino.common.INTER_RUN_INTERVAL_SEC
+def sync_recently_added_blocks(workers: int = gino.common.NUM_WORKERS):
+    """Forward blocks added to the pages edited since the last run to gitlab"""
+    started_at = gino.common.now_utc()
+    edited_after = gino.common.sync_since("notion", "sync-blocks", 24 * 60)
     notion = client()
-    edited_after = gino.common.now_utc() - timedelta(minutes=mmin)
     data = dict(
         filter=dict(
             property="Last edited time", date=dict(after=edited_after.isoformat())
         )
     )
-    for item in notion.databases.query(db_id(), **data).get("results"):
-        sync_recently_added_blocks_page(item["id"], item)
+    pages = paginate(notion.databases.query, database_id=db_id(), **data)
+    # resolved once here rather than by every page thread.
+    _bot_user_id()
+    nfailed = 0
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        futures = {
+            pool.submit(sync_recently_added_blocks_page, item["id"], item): item["id"]
+            for item in pages
+        }
+        for future in as_completed(futures):
+            try:
+                future.result()
+            except Exception as e:
+                nfailed += 1
+                logging.warning(f"Failed to sync blocks of {futures[future]}: {e}")
+    if nfailed == 0 and not gino.common.DRY_RUN:
+        gino.common.store_watermark("notion", "sync-blocks", started_at)
+
+
+def _bot_user_id() -> str:
+    """id of the notion user of GiNo itself"""
+    global _BOT_USER_ID
+    with _BOT_USER_ID_LOCK:
+        if _BOT_USER_ID is None:
+            _BOT_USER_ID = client().users.me()["id"]
+        return _BOT_USER_ID
+
+
+def _block_text(block) -> str:
+    rich_texts = block.get(block["type"], {}).get("rich_text", [])
+    return "".join(t.get("plain_text", "") for t in rich_texts)
+
+
+def _block_digest(block) -> int:
+    """64 bit hash of the content of a block"""
+    data = f"{block['type']}:{_block_text(block)}".encode()
+    return int.from_bytes(hashlib.blake2b(data, digest_size=8).digest(), "big")
+
+
+def _block_ledger_started_at() -> datetime:
+    """Blocks created before the ledger existed are recorded, not forwarded."""
+    state = gino.state.backend()
+    started_at = state.get(gino.state.DEFAULT, "block-ledger-started-at")
+    if started_at is None:
+        started_at = gino.common.now_utc()
+        state.put(gino.state.DEFAULT, "block-ledger-started-at", started_at)
+    return started_at
+
+
+def select_blocks(
+    blocks: T.Dict[str, dict],
+    ledger: T.Dict[str, int],
+    ledger_started_at: datetime,
+    bot_id: str,
+) -> T.Tuple[T.List[dict], T.Dict[str, int]]:
+    """Blocks (by key) of a page to forward to gitlab, and the digests of the
+    new or changed blocks to record in the `ledger`.
+
+    Blocks whose digest is in the ledger are skipped. New blocks created before
+    the ledger started, blocks written by GiNo (`bot_id`) and notes that came
+    from gitlab are recorded but not forwarded. Edited blocks are sent again.
+    """
+    forward, digests = [], {}
+    for key, block in blocks.items():
+        digest = _block_digest(block)
+        if ledger.get(key) == digest:
+            continue
+        digests[key] = digest
+        if key not in ledger:
+            created_at = gino.common.parse_datetime(block["created_time"])
+            if created_at < ledger_started_at:
+                continue
+        if block.get("created_by", {}).get("id") == bot_id:
+            continue
+        if ":from-gitlab:" in _block_text(block):
+            continue
+        forward.append(block)
+    return forward, digests
 
 
+@gino.metrics.timed("sync-blocks")
 def sync_recently_added_blocks_page(page_uuid, page=None):
-    """Sync recently added blocks with gitlab. There is no state keeping here.
-    I.e., we can't figure out which blocks were added to gitlab. We make sure
-    that we only process the blocks that were added within the
-    INTER_RUN_INTERVAL_SEC.
+    """Forward blocks of a page to the linked gitlab issue.
+
+    A ledger of forwarded blocks (block id -> hash of its content) is kept in
+    the state store. Blocks that are not in the ledger, or whose content
+    changed since they were forwarded, are sent. Blocks written by GiNo itself
+    are never sent back.
     """
-    mmin = gino.common.INTER_RUN_INTERVAL_SEC / 60
     _uuid = str(uuid.UUID(page_uuid))
     notion = client()
-    blocks = []
-    markdown = ""
-    for block in notion.blocks.children.list(_uuid).get("results"):
-        mins_from_now = gino.common.from_now_mins(block["created_time"])
-        if mins_from_now < mmin:
-            if ":from-gitlab:" in str(block):
-                continue
-            blocks.append(block)
+    state = gino.state.backend()
+    all_blocks = list(paginate(notion.blocks.children.list, block_id=_uuid))
+    keys = [uuid.UUID(block["id"]).hex for block in all_blocks]
+    ledger = state.get_many(gino.state.BLOCKS, keys)
+    blocks, digests = select_blocks(
+        dict(zip(keys, all_blocks)), ledger, _block_ledger_started_at(), _bot_user_id()
+    )
 
-    page = get_page(_uuid) if page is None else page
-    page_url = page["url"]
-    issue_url = page["properties"].get("URL", {}).get("url")
-    markdown = blocks_to_markdown(blocks)
+    markdown = blocks_to_markdown(blocks) if blocks else ""
     if len(markdown.strip()) > 3:
-        try:
+        page = get_page(_uuid) if page is None else page
+        page_url = page["url"]
+        issue_url = page["properties"].get("URL", {}).get("url")
+        if gino.common.DRY_RUN:
+            logging.info(f"[dry-run] Would add note to {issue_url}: {markdown}")
+            return
+        if issue_url:
             issue = gino.gitlab.get_issue_by_url(issue_url)
             issue.notes.create(dict(body=f"_from:notion_: <{page_url}>" + markdown))
-        except Exception as e:
-            logging.debug(e)
+        else:
+            logging.debug(f"Page {page_url} is not linked with any issue")
 
+    if digests and not gino.common.DRY_RUN:
+        state.put_many(gino.state.BLOCKS, digests)
+
+
+def metrics_db_id() -> str:
+    """id of the database of security metrics (NOTION_SECURITY_METRICS_DB)"""
+    return os.environ.get("NOTION_SECURITY_METRICS_DB", NOTION_SECURITY_METRICS_DB)
 
-def sync_metrics(metrics):
-    print(f"Syncing metrics {metrics}")
-    notion = client()
-    # create a code -> human_readable dict
-    metrics_dict = dict(metrics)
 
-    db_id = os.environ["NOTION_SECURITY_METRICS_DB"]
-    for item in notion.databases.query(db_id).get("results"):
-        _uuid = str(uuid.UUID(item["id"]))
-        prop = item["properties"]
+def _metric_of_row(item) -> T.Tuple[str, str]:
+    """(unique id, long name) of a row of the metrics database"""
+    prop = item["properties"]
+    long_name = "".join(t["plain_text"] for t in prop["LongName"]["title"])
+    unique_id = "".join(t["plain_text"] for t in prop["UniqueId"]["rich_text"])
+    if not unique_id:
+        raise ValueError("UniqueId is empty")
+    return unique_id, long_name
+
+
+def load_metrics_index(db: str) -> T.Dict[str, T.List[T.Tuple[str, str]]]:
+    """All the rows of the metrics database as unique id -> [(page id, long
+    name)]. A unique id has more than one page if it was created twice."""
+    index: T.Dict[str, T.List[T.Tuple[str, str]]] = {}
+    for item in paginate(client().databases.query, database_id=db):
         try:
-            long_name = prop["LongName"]["title"][0]["text"]["content"]
-            unique_id = prop["UniqueId"]["rich_text"][0]["plain_text"]
-            # check if unique_id is in metric server
-            if (long_name_1 := metrics_dict.get(unique_id)) is not None:
-                logging.debug(_uuid, unique_id, long_name, long_name_1)
-                if long_name_1 != long_name:
-                    # update the value in notion.
-                    logging.info(f"Changing long name {long_name} to {long_name_1}")
-                    notion.pages.update(
-                        _uuid,
-                        properties=dict(
-                            LongName=dict(title=[dict(text=dict(content=long_name_1))])
-                        ),
-                    )
-                del metrics_dict[unique_id]
-        except Exception:
-            pass
-
-    # check if there are some metrics in metrics_dict that are not yet in
-    # notion.
-    logging.info(f"These metrics are not in notion yet: {metrics_dict}")
-    for code, long_name in metrics_dict.items():
-        _create_metric(notion, code, long_name)
-
-
-def _create_metric(notion, unique_id, long_name):
-    logging.info("Adding a new metrics to notion database")
+            unique_id, long_name = _metric_of_row(item)
+        except (KeyError, IndexError, ValueError) as e:
+            logging.warning(f"Ignoring malformed metric row {item['id']}: {e!r}")
+            continue
+        index.setdefault(unique_id, []).append((item["id"], long_name))
+    return index
+
+
+def metrics_changeset(
+    index: T.Dict[str, T.List[T.Tuple[str, str]]], metrics: T.Dict[str, str]
+) -> T.Dict[str, list]:
+    """What to change in notion so that it has the given `metrics` (unique id ->
+    long name).
+
+    - inserts: (unique id, long name) of metrics missing in notion.
+    - renames: (page id, unique id, old name, new name) of rows to update.
+    - orphans: (page id, unique id) of rows of unknown metrics.
+    - duplicates: (page id, unique id) of the extra rows of a metric.
+    """
+    changes: T.Dict[str, list] = dict(inserts=[], renames=[], orphans=[], duplicates=[])
+    for unique_id, long_name in metrics.items():
+        if unique_id not in index:
+            changes["inserts"].append((unique_id, long_name))
+    for unique_id, rows in index.items():
+        (page_id, old_name), extra = rows[0], rows[1:]
+        changes["duplicates"] += [(p, unique_id) for p, _ in extra]
+        if unique_id not in metrics:
+            changes["orphans"].append((page_id, unique_id))
+        elif metrics[unique_id] != old_name:
+            new_name = metrics[unique_id]
+            changes["renames"].append((page_id, unique_id, old_name, new_name))
+    return changes
+
+
+def _title(text: str) -> dict:
+    return dict(title=[dict(text=dict(content=text))])
+
+
+def sync_metrics(metrics, workers: int = gino.common.NUM_WORKERS) -> T.Dict[str, int]:
+    """Sync (unique id, long name) pairs of metrics with the notion database.
+    Missing metrics are created and renamed ones are updated. Orphan and
+    duplicate rows are reported, not deleted. Returns the number of changes of
+    each kind."""
+    notion = client()
+    db = metrics_db_id()
+    changes = metrics_changeset(load_metrics_index(db), dict(metrics))
+    summary = {kind: len(items) for kind, items in changes.items()}
+    for page_id, unique_id in changes["orphans"]:
+        logging.info(f"Metric {unique_id} ({page_id}) is not known anymore")
+    for page_id, unique_id in changes["duplicates"]:
+        logging.warning(f"Metric {unique_id} is in notion more than once ({page_id})")
+
+    writes = []
+    for page_id, unique_id, old_name, new_name in changes["renames"]:
+        logging.info(f"Changing long name of {unique_id}: {old_name} -> {new_name}")
+        writes.append(
+            lambda p=page_id, n=new_name: notion.pages.update(
+                p, properties=dict(LongName=_title(n))
+            )
+        )
+    for unique_id, long_name in changes["inserts"]:
+        logging.info(f"Adding metric {unique_id} to notion")
+        writes.append(lambda u=unique_id, n=long_name: _create_metric(notion, db, u, n))
+
+    if writes and gino.common.DRY_RUN:
+        logging.info(f"[dry-run] Would make {len(writes)} changes to notion")
+        writes = []
+    nfailed = 0
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        for future in as_completed([pool.submit(write) for write in writes]):
+            try:
+                future.result()
+            except Exception as e:
+                nfailed += 1
+                logging.warning(f"Failed to update the metrics database: {e}")
+    summary["failed"] = nfailed
+    logging.info("Metrics: " + ", ".join(f"{n} {kind}" for kind, n in summary.items()))
+    return summary
+
+
+def _create_metric(notion, db: str, unique_id: str, long_name: str):
     notion.pages.create(
-        parent=dict(type="database_id", database_id=NOTION_SECURITY_METRICS_DB),
+        parent=dict(type="database_id", database_id=db),
         properties=dict(
-            LongName=dict(title=[dict(text=dict(content=long_name))]),
+            LongName=_title(long_name),
             UniqueId=dict(rich_text=[dict(text=dict(content=unique_id))]),
         ),
     )
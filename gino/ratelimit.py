@@ -0,0 +1,210 @@
+"""Rate limiting shared by all requests to a service (GitLab or Notion).
+
+Every HTTP request goes through a per-service token bucket. Responses with
+status 429 (and 502/503/504 for idempotent requests) are retried after the
+delay asked for in `Retry-After`, or after a jittered exponential backoff.
+When a service throttles us, the bucket halves its rate and then slowly
+recovers to the configured rate.
+
+The requests adapter and httpx transports that plug this into python-gitlab
+and notion-client are in `gino.transport`.
+"""
+
+import os
+import time
+import asyncio
+import random
+import logging
+import threading
+import typing as T
+from email.utils import parsedate_to_datetime
+
+import gino.metrics
+
+# Default request rates (per second). Override with <SERVICE>_MAX_REQUESTS_PER_SEC
+# in env e.g. NOTION_MAX_REQUESTS_PER_SEC=2.5
+DEFAULT_RATES: T.Dict[str, float] = dict(gitlab=10.0, notion=3.0)
+
+MAX_RETRIES = 5
+BACKOFF_BASE_SEC = 0.5
+BACKOFF_MAX_SEC = 60.0
+
+_RETRY_STATUS = {429, 502, 503, 504}
+_IDEMPOTENT_METHODS = {"GET", "HEAD", "OPTIONS", "PUT", "DELETE"}
+
+
+class TokenBucket:
+    """Allow `rate` requests per second on average with bursts of `burst`."""
+
+    def __init__(self, rate: float, burst: T.Optional[float] = None):
+        self.max_rate = rate
+        self.rate = rate
+        self.burst = burst or max(1.0, rate)
+        self._tokens = self.burst
+        self._updated_at = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float):
+        self._tokens = min(
+            self.burst, self._tokens + (now - self._updated_at) * self.rate
+        )
+        self._updated_at = now
+
+    def acquire(self):
+        """Block until a request may be sent."""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                wait = self._paused_until - now
+                if wait <= 0:
+                    if self._tokens >= 1:
+                        self._tokens -= 1
+                        return
+                    wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+    def throttled(self, delay: float):
+        """The server asked us to slow down. Nobody sends anything for `delay`
+        seconds and the rate is halved."""
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + delay)
+            self.rate = max(self.max_rate / 16, self.rate / 2)
+
+    def succeeded(self):
+        """Recover the rate additively after a successful request."""
+        if self.rate < self.max_rate:
+            with self._lock:
+                self.rate = min(self.max_rate, self.rate + self.max_rate / 20)
+
+
+_BUCKETS: T.Dict[str, TokenBucket] = {}
+_METRICS: T.Dict[str, T.Dict[str, int]] = {}
+_LOCK = threading.Lock()
+
+
+def bucket(service: str) -> TokenBucket:
+    with _LOCK:
+        if service not in _BUCKETS:
+            rate = float(
+                os.environ.get(
+                    f"{service.upper()}_MAX_REQUESTS_PER_SEC",
+                    DEFAULT_RATES.get(service, 5.0),
+                )
+            )
+            _BUCKETS[service] = TokenBucket(rate)
+        return _BUCKETS[service]
+
+
+def _count(service: str, what: str):
+    with _LOCK:
+        counters = _METRICS.setdefault(service, dict(sent=0, throttled=0, retried=0))
+        counters[what] += 1
+    if what != "sent":
+        gino.metrics.inc(f"gino_api_{what}_total", service=service)
+
+
+def _record(service: str, method: str, response, secs: float):
+    gino.metrics.observe("gino_api_request_seconds", secs, service=service)
+    gino.metrics.inc(
+        "gino_api_requests_total",
+        service=service,
+        method=method,
+        status=getattr(response, "status_code", ""),
+        stage=gino.metrics.stage(),
+    )
+
+
+def metrics() -> T.Dict[str, T.Dict[str, int]]:
+    """Number of requests sent, throttled and retried per service."""
+    with _LOCK:
+        return {service: dict(c) for service, c in _METRICS.items()}
+
+
+def log_metrics():
+    for service, c in metrics().items():
+        logging.info(
+            f"{service}: {c['sent']} requests, {c['throttled']} throttled,"
+            f" {c['retried']} retried"
+        )
+
+
+def retry_after(headers) -> T.Optional[float]:
+    """Seconds to wait as per the Retry-After header (seconds or HTTP date)."""
+    value = headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def backoff_delay(attempt: int) -> float:
+    """Exponential backoff with full jitter."""
+    return random.uniform(0, min(BACKOFF_MAX_SEC, BACKOFF_BASE_SEC * 2**attempt))
+
+
+def _retry_delay(
+    service: str, limiter: TokenBucket, method: str, response, attempt: int
+) -> T.Optional[float]:
+    """Seconds to wait before retrying or None if the response is final."""
+    retryable = _RETRY_STATUS if method.upper() in _IDEMPOTENT_METHODS else {429}
+    if response.status_code not in retryable or attempt >= MAX_RETRIES:
+        if response.status_code < 400:
+            limiter.succeeded()
+        return None
+
+    delay = retry_after(response.headers)
+    if delay is None:
+        delay = backoff_delay(attempt)
+    if response.status_code == 429:
+        _count(service, "throttled")
+        limiter.throttled(delay)
+    logging.info(f"{service} replied {response.status_code}. Retrying in {delay:.1f}s")
+    _count(service, "retried")
+    return delay
+
+
+def send(service: str, method: str, do_send: T.Callable[[], T.Any]):
+    """Send a request with `do_send()` within the rate budget of `service`,
+    retrying when the service throttles us. The last response is returned.
+    """
+    limiter = bucket(service)
+    attempt = 0
+    while True:
+        limiter.acquire()
+        _count(service, "sent")
+        t0 = time.perf_counter()
+        response = do_send()
+        _record(service, method, response, time.perf_counter() - t0)
+        delay = _retry_delay(service, limiter, method, response, attempt)
+        if delay is None:
+            return response
+        response.close()
+        time.sleep(delay)
+        attempt += 1
+
+
+async def async_send(service: str, method: str, do_send):
+    """Same as `send` for coroutines. The (shared) bucket is waited on in a
+    thread so that the event loop is not blocked."""
+    limiter = bucket(service)
+    attempt = 0
+    while True:
+        await asyncio.to_thread(limiter.acquire)
+        _count(service, "sent")
+        t0 = time.perf_counter()
+        response = await do_send()
+        _record(service, method, response, time.perf_counter() - t0)
+        delay = _retry_delay(service, limiter, method, response, attempt)
+        if delay is None:
+            return response
+        await response.aclose()
+        await asyncio.sleep(delay)
+        attempt += 1
@@ -0,0 +1,167 @@
+"""Bulk reconciliation of gitlab issues with the notion task database.
+
+The task database is read once per run (only pages tagged FromGITLAB, and only
+the properties we need) into an index by the URL of the issue. The issues
+that changed since the last run are diffed against it with set operations,
+and only the changes that are needed are made:
+
+- a task is created for new open issues that have none,
+- the task of a closed issue gets the status that the sync would give it
+  (see `gino.gitlab.change_notion_task_status`), unless it already has it or
+  the issue is labelled CLOSED_IN_NOTION (e.g. the task was reopened in
+  notion after that).
+"""
+
+import logging
+import typing as T
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timedelta
+
+import gino.common
+import gino.gitlab
+import gino.metrics
+import gino.notion
+from gino.common import now_utc, sync_since, store_watermark
+
+# Properties of task pages that are read.
+TASK_PROPERTIES = ["URL", "Status"]
+
+
+def _task_of_page(page) -> T.Tuple[T.Optional[str], T.Optional[str]]:
+    """(url, status) of a page of the task database"""
+    prop = page["properties"]
+    url = (prop.get("URL") or {}).get("url")
+    status = ((prop.get("Status") or {}).get("status") or {}).get("name")
+    return url, status
+
+
+def load_task_snapshot() -> T.Dict[str, dict]:
+    """Tasks created from gitlab as url of the issue -> dict(id, status). If
+    an issue has more than one task, the first one is used."""
+    notion = gino.notion.client()
+    pages = gino.notion.paginate(
+        notion.databases.query,
+        database_id=gino.notion.db_id(),
+        filter=dict(property="Tags", multi_select=dict(contains="FromGITLAB")),
+        filter_properties=TASK_PROPERTIES,
+    )
+    snapshot: T.Dict[str, dict] = {}
+    for page in pages:
+        url, status = _task_of_page(page)
+        if not url:
+            continue
+        if url in snapshot:
+            logging.warning(f"{url} has more than one task: {page['url']}")
+            continue
+        snapshot[url] = dict(id=page["id"], status=status)
+    return snapshot
+
+
+def diff(
+    issues: T.Dict[str, T.Any], snapshot: T.Dict[str, dict], created_after: datetime
+) -> T.Dict[str, T.Set[str]]:
+    """urls of the issues whose task must be created or closed."""
+    closed = {url for url, issue in issues.items() if issue.state == "closed"}
+    opened = issues.keys() - closed
+    new = {
+        url
+        for url in opened - snapshot.keys()
+        if not gino.gitlab.is_linked_with_notion(issues[url])
+        and gino.common.parse_datetime(issues[url].created_at) >= created_after
+    }
+    updates = {
+        url
+        for url in closed & snapshot.keys()
+        if gino.common.CLOSED_IN_NOTION not in issues[url].labels
+        and snapshot[url]["status"]
+        != gino.gitlab.gl_issue_status_to_notion_task_status(issues[url])
+    }
+    return dict(creates=new, updates=updates)
+
+
+def _changed_issues(
+    projects, since: datetime, workers: int
+) -> T.Tuple[T.Dict[str, tuple], int]:
+    """url -> (project, issue) of the issues updated after `since`, and the
+    number of projects whose issues could not be listed."""
+
+    def _list(project):
+        return [
+            (project, issue)
+            for issue in project.issues.list(
+                updated_after=since,
+                per_page=gino.gitlab.ISSUES_PER_PAGE,
+                iterator=True,
+            )
+        ]
+
+    issues, nfailed = {}, 0
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        futures = {pool.submit(_list, p): p.name_with_namespace for p in projects}
+        for future in as_completed(futures):
+            try:
+                issues.update({i.web_url: (p, i) for p, i in future.result()})
+            except Exception as e:
+                nfailed += 1
+                logging.warning(f"Failed to list issues of {futures[future]}: {e}")
+    return issues, nfailed
+
+
+def _close_task(issue):
+    mutations = gino.gitlab.IssueMutations(issue)
+    gino.gitlab.change_notion_task_status(issue, mutations)
+    mutations.flush()
+
+
+@gino.metrics.timed("reconcile")
+def reconcile(
+    projects,
+    workers: int = gino.common.NUM_WORKERS,
+    window_mins: int = 7 * 24 * 60,
+) -> T.Dict[str, int]:
+    """Reconcile the issues of the projects updated since the last run (or
+    in the last `window_mins`) with the task database. Returns the number of
+    tasks created and updated."""
+    started_at = now_utc()
+    since = sync_since("projects", "reconcile", window_mins)
+    issues, nfailed = _changed_issues(projects, since, workers)
+    snapshot = load_task_snapshot()
+    changes = diff(
+        {url: issue for url, (_, issue) in issues.items()},
+        snapshot,
+        created_after=started_at - timedelta(minutes=window_mins),
+    )
+    logging.info(
+        f"{len(issues)} changed issues, {len(snapshot)} tasks in notion:"
+        f" {len(changes['creates'])} to create, {len(changes['updates'])} to update"
+    )
+
+    # matching tasks are remembered so that they need not be looked up later
+    # (e.g. by `_close_task`).
+    for url in issues.keys() & snapshot.keys():
+        issue = issues[url][1]
+        if gino.common.page_of_issue(issue.project_id, issue.iid) is None:
+            page_id = snapshot[url]["id"]
+            gino.common.index_issue_page(issue.project_id, issue.iid, page_id)
+
+    jobs = [
+        (url, lambda url=url: gino.gitlab.link_issue_with_notion(*issues[url]))
+        for url in changes["creates"]
+    ] + [
+        (url, lambda url=url: _close_task(issues[url][1])) for url in changes["updates"]
+    ]
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        futures = {pool.submit(job): url for url, job in jobs}
+        for future in as_completed(futures):
+            try:
+                future.result()
+            except Exception as e:
+                nfailed += 1
+                logging.warning(f"Failed to reconcile {futures[future]}: {e}")
+    if nfailed == 0 and not gino.common.DRY_RUN:
+        store_watermark("projects", "reconcile", started_at)
+    return dict(
+        created=len(changes["creates"]),
+        updated=len(changes["updates"]),
+        failed=nfailed,
+    )
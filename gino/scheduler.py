@@ -0,0 +1,162 @@
+"""Scheduler of the jobs of `gino run`.
+
+Each job has its own interval, priority and API-call budget:
+
+- latency-sensitive jobs (e.g. linking new issues) run in the loop of the
+  scheduler, by priority, as soon as they are due. Heavy jobs never run
+  there, so they cannot delay them.
+- heavy jobs (`off_hours=True`, e.g. the stale issue sweep) run one at a time
+  in a background thread, and only off hours.
+- a job is called with its budget and returns True when it has a backlog
+  (e.g. it ran out of budget, or some projects failed). It is then run again
+  after `backlog_interval_sec` instead of waiting for its next interval.
+
+The time of the last run of every job is kept as a watermark, so a restart
+does not rerun the daily sweeps.
+"""
+
+import time
+import logging
+import threading
+import typing as T
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+import gino.common
+import gino.metrics
+
+# A job with a backlog is run again after this long.
+BACKLOG_INTERVAL_SEC = 60
+
+# The scheduler wakes up at least this often (e.g. to see that off hours began).
+MAX_SLEEP_SEC = 60
+
+
+class Job:
+    def __init__(
+        self,
+        name: str,
+        fn: T.Callable[[T.Optional[int]], T.Optional[bool]],
+        interval_sec: float,
+        priority: int = 0,
+        budget: T.Optional[int] = None,
+        off_hours: bool = False,
+        backlog_interval_sec: float = BACKLOG_INTERVAL_SEC,
+    ):
+        self.name = name
+        self.fn = fn
+        self.interval_sec = interval_sec
+        self.priority = priority
+        self.budget = budget
+        self.off_hours = off_hours
+        self.backlog_interval_sec = backlog_interval_sec
+        self.next_at = 0.0
+        self.running = False
+
+    def __repr__(self):
+        return f"Job({self.name!r}, every {self.interval_sec}s)"
+
+
+class Scheduler:
+    """Run `jobs` forever. `is_off_hours` tells whether heavy jobs may run;
+    `scope` is the id of the watermarks of the jobs."""
+
+    def __init__(
+        self,
+        jobs: T.List[Job],
+        is_off_hours: T.Callable[[], bool],
+        scope: str = "scheduler",
+        clock: T.Callable[[], float] = time.time,
+    ):
+        self.jobs = sorted(jobs, key=lambda job: job.priority)
+        self.is_off_hours = is_off_hours
+        self.scope = scope
+        self.clock = clock
+        self._heavy = ThreadPoolExecutor(max_workers=1, thread_name_prefix="heavy")
+        self._lock = threading.Lock()
+        for job in self.jobs:
+            last = gino.common.load_watermark(scope, job.name)
+            if last is not None:
+                job.next_at = last.timestamp() + job.interval_sec
+
+    def due(self) -> T.List[Job]:
+        """Jobs that can start now, by priority."""
+        now = self.clock()
+        off_hours = None
+        jobs = []
+        with self._lock:
+            for job in self.jobs:
+                if job.running or job.next_at > now:
+                    continue
+                if job.off_hours:
+                    if off_hours is None:
+                        off_hours = self.is_off_hours()
+                    if not off_hours:
+                        continue
+                jobs.append(job)
+        return jobs
+
+    def run_job(self, job: Job):
+        started_at = self.clock()
+        gino.metrics.observe(
+            "gino_job_delay_seconds", max(0.0, started_at - job.next_at), job=job.name
+        )
+        try:
+            backlog = bool(job.fn(job.budget))
+        except ImportError as e:
+            # a missing optional dependency is not fixed by running it again.
+            logging.warning(f"Job {job.name} cannot run: {e}")
+            backlog = False
+        except Exception as e:
+            logging.warning(f"Job {job.name} failed: {e}")
+            backlog = True
+        secs = self.clock() - started_at
+        gino.metrics.observe("gino_job_seconds", secs, job=job.name)
+        interval = job.backlog_interval_sec if backlog else job.interval_sec
+        with self._lock:
+            job.next_at = started_at + interval
+            job.running = False
+        # a job with a backlog is run again right after a restart.
+        if not backlog and not gino.common.DRY_RUN:
+            gino.common.store_watermark(
+                self.scope, job.name, datetime.fromtimestamp(started_at, timezone.utc)
+            )
+        logging.info(
+            f"Job {job.name} took {secs:.2f}s"
+            + (", has a backlog" if backlog else "")
+            + f", next run in {max(0, job.next_at - self.clock()):.0f}s"
+        )
+
+    def step(self):
+        """Start the heavy jobs that are due and run the others."""
+        for job in self.due():
+            with self._lock:
+                job.running = True
+            if job.off_hours:
+                self._heavy.submit(self.run_job, job)
+            else:
+                self.run_job(job)
+
+    def sleep_time(self) -> float:
+        """Time until the next job is due. Heavy jobs waiting for off hours
+        are looked at again after MAX_SLEEP_SEC."""
+        now = self.clock()
+        with self._lock:
+            waiting = [
+                job.next_at
+                for job in self.jobs
+                if not job.running and not (job.off_hours and job.next_at <= now)
+            ]
+        next_at = min(waiting, default=now + MAX_SLEEP_SEC)
+        return min(MAX_SLEEP_SEC, max(1.0, next_at - now))
+
+    def run_forever(self, after_step: T.Optional[T.Callable[[], None]] = None):
+        logging.info(f"Scheduling {self.jobs}")
+        try:
+            while True:
+                self.step()
+                if after_step is not None:
+                    after_step()
+                time.sleep(self.sleep_time())
+        finally:
+            self._heavy.shutdown(wait=False)
@@ -0,0 +1,167 @@
+"""Sharding of projects across several `gino run` workers.
+
+Every project is owned by exactly one worker, chosen by rendezvous (highest
+random weight) hashing of the project id: when a worker joins or leaves, only
+the projects it owns (or will own) move.
+
+- `--shard i/N` runs worker `i` (0-based) of a fixed set of `N` workers.
+- `--shard auto` lets the workers find each other through leases in the state
+  backend: each worker renews a heartbeat lease every LEASE_TTL_SEC / 3 and the
+  members are the workers with a live lease. When a worker dies its lease
+  expires and its projects are rebalanced over the remaining ones. A project
+  is also claimed with a lease before it is synced, so that two workers with
+  a different view of the members never sync it at the same time.
+
+All the workers of `--shard auto` must share the state, e.g. a SQLite file on
+a shared volume (GINO_STATE_PATH).
+"""
+
+import os
+import socket
+import hashlib
+import logging
+import threading
+import typing as T
+
+import gino.state
+
+# Time after which the lease of a worker that stopped renewing it expires.
+LEASE_TTL_SEC = 120
+
+
+def _weight(member: str, key: str) -> int:
+    digest = hashlib.blake2b(f"{member}:{key}".encode(), digest_size=8).digest()
+    return int.from_bytes(digest, "big")
+
+
+def owner(key: T.Any, members: T.Iterable[str]) -> T.Optional[str]:
+    """The member that owns `key` (e.g. a project id), or None without members."""
+    return max(members, key=lambda m: _weight(m, str(key)), default=None)
+
+
+class StaticShard:
+    """Worker `index` of `count` workers."""
+
+    def __init__(self, index: int, count: int):
+        self.index, self.count = index, count
+        self.name = f"{index}/{count}"
+        self.contended: T.Set[str] = set()
+        self._members = [str(i) for i in range(count)]
+
+    def owns(self, key: T.Any) -> bool:
+        return owner(key, self._members) == str(self.index)
+
+    def rebalanced(self) -> bool:
+        return False
+
+    def stop(self):
+        pass
+
+
+class LeaseShard:
+    """Worker whose peers are the workers with a live lease in the state."""
+
+    def __init__(self, ttl_sec: float = LEASE_TTL_SEC):
+        self.worker_id = f"{socket.gethostname()}-{os.getpid()}"
+        # a new worker starts with a full sweep anyway (see `rebalanced`).
+        self.name = self.worker_id
+        self.ttl_sec = ttl_sec
+        self._claims: T.Set[str] = set()
+        # keys owned by this worker but still claimed by another one. Guarded
+        # by `_lock` like `_claims`: `owns` is called from several threads.
+        self.contended: T.Set[str] = set()
+        self._members: T.FrozenSet[str] = frozenset()
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self.heartbeat()
+        self._thread = threading.Thread(target=self._heartbeat_loop, daemon=True)
+        self._thread.start()
+
+    def heartbeat(self):
+        """Renew the lease of this worker and its claims on projects."""
+        state = gino.state.backend()
+        state.put(
+            gino.state.LEASES, f"worker:{self.worker_id}", self.worker_id, self.ttl_sec
+        )
+        with self._lock:
+            claims = list(self._claims)
+        for key in claims:
+            if not state.claim(gino.state.LEASES, key, self.worker_id, self.ttl_sec):
+                with self._lock:
+                    self._claims.discard(key)
+
+    def _heartbeat_loop(self):
+        while not self._stopped.wait(self.ttl_sec / 3):
+            try:
+                self.heartbeat()
+            except Exception as e:
+                logging.warning(f"Failed to renew the lease of {self.worker_id}: {e}")
+
+    def members(self) -> T.FrozenSet[str]:
+        """Workers with a live lease."""
+        return frozenset(
+            value
+            for key, value in gino.state.backend().items(gino.state.LEASES)
+            if key.startswith("worker:")
+        ) | {self.worker_id}
+
+    def rebalanced(self) -> bool:
+        """Whether workers joined or left since the last call. The projects of
+        this worker change then, and the claims on the projects it no longer
+        owns are released."""
+        members = self.members()
+        changed = members != self._members
+        self._members = members
+        with self._lock:
+            self.contended = set()
+        if changed:
+            logging.info(f"Shard {self.worker_id}: {len(members)} workers")
+            state = gino.state.backend()
+            with self._lock:
+                moved = {
+                    claim
+                    for claim in self._claims
+                    if owner(claim.split(":", 1)[1], members) != self.worker_id
+                }
+                self._claims -= moved
+            for claim in moved:
+                state.delete(gino.state.LEASES, claim)
+        return changed
+
+    def owns(self, key: T.Any) -> bool:
+        if owner(key, self._members or self.members()) != self.worker_id:
+            return False
+        claim = f"claim:{key}"
+        state = gino.state.backend()
+        if not state.claim(gino.state.LEASES, claim, self.worker_id, self.ttl_sec):
+            with self._lock:
+                self.contended.add(str(key))
+            return False
+        with self._lock:
+            self._claims.add(claim)
+        return True
+
+    def stop(self):
+        self._stopped.set()
+        state = gino.state.backend()
+        state.delete(gino.state.LEASES, f"worker:{self.worker_id}")
+        with self._lock:
+            claims, self._claims = self._claims, set()
+        for key in claims:
+            state.delete(gino.state.LEASES, key)
+
+
+Shard = T.Union[StaticShard, LeaseShard]
+
+
+def parse_shard(spec: str) -> Shard:
+    """`i/N` (worker i of N, 0-based) or `auto` (lease based)."""
+    if spec == "auto":
+        return LeaseShard()
+    try:
+        index, count = (int(x) for x in spec.split("/"))
+    except ValueError:
+        raise ValueError(f"Invalid shard {spec!r}, expected 'i/N' or 'auto'") from None
+    if not 0 <= index < count:
+        raise ValueError(f"Invalid shard {spec!r}, expected 0 <= i < N")
+    return StaticShard(index, count)
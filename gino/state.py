@@ -0,0 +1,304 @@
+"""Persistent state of GiNo: dedupe keys, watermarks, indexes and caches.
+
+State is kept in namespaces (one table each) of a key-value store. The default
+backend is SQLite in WAL mode, which is safe to share between the threads of
+a process and between processes. Set GINO_STATE_BACKEND=memory to keep the
+state in memory (e.g. for tests) and GINO_STATE_PATH to change the location
+of the SQLite database.
+"""
+
+import os
+import re
+import abc
+import time
+import pickle
+import shelve
+import sqlite3
+import logging
+import threading
+import typing as T
+from pathlib import Path
+
+import typer
+
+app = typer.Typer()
+
+# Namespaces used by GiNo.
+DEFAULT = "default"
+DEDUPE = "dedupe"
+WATERMARKS = "watermarks"
+INDEX = "index"
+CACHE = "cache"
+# project id -> name and last activity of the gitlab projects.
+PROJECTS = "projects"
+# block id (hex) -> 64 bit hash of the content of notion blocks sent to gitlab.
+BLOCKS = "blocks"
+# "<project id>:<issue iid>" -> task maturity metric of closed gitlab issues.
+MATURITY = "maturity"
+# "<project id>:<issue iid>" -> id of the last note of the issue sent to notion.
+NOTES = "notes"
+# Heartbeats of `gino run --shard auto` workers and their claims on projects.
+LEASES = "leases"
+
+DEFAULT_STATE_PATH = "gino.sqlite"
+
+
+class StateBackend(abc.ABC):
+    """Interface of a state backend. `ttl_sec` is the time after which a key
+    expires. Keys without a ttl never expire."""
+
+    @abc.abstractmethod
+    def get_many(self, namespace: str, keys: T.Iterable[str]) -> T.Dict[str, T.Any]:
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def put_many(
+        self,
+        namespace: str,
+        items: T.Dict[str, T.Any],
+        ttl_sec: T.Optional[float] = None,
+    ):
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def delete(self, namespace: str, key: str):
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def items(self, namespace: str) -> T.Iterator[T.Tuple[str, T.Any]]:
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def purge_expired(self):
+        """Delete the keys that expired."""
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def claim(self, namespace: str, key: str, owner: str, ttl_sec: float) -> bool:
+        """Set `key` to `owner` for `ttl_sec` unless another owner holds it.
+        Atomic for all the processes that share the backend."""
+        raise NotImplementedError
+
+    def get(self, namespace: str, key: str, default=None):
+        return self.get_many(namespace, [key]).get(key, default)
+
+    def put(self, namespace: str, key: str, value, ttl_sec: T.Optional[float] = None):
+        self.put_many(namespace, {key: value}, ttl_sec)
+
+
+class MemoryBackend(StateBackend):
+    def __init__(self):
+        self._data: T.Dict[str, T.Dict[str, T.Tuple[T.Any, T.Optional[float]]]] = {}
+        self._lock = threading.Lock()
+
+    def get_many(self, namespace, keys):
+        now = time.time()
+        with self._lock:
+            table = self._data.get(namespace, {})
+            result = {}
+            for key in keys:
+                if key in table:
+                    value, expires_at = table[key]
+                    if expires_at is None or expires_at > now:
+                        result[key] = value
+            return result
+
+    def put_many(self, namespace, items, ttl_sec=None):
+        expires_at = time.time() + ttl_sec if ttl_sec is not None else None
+        with self._lock:
+            table = self._data.setdefault(namespace, {})
+            for key, value in items.items():
+                table[key] = (value, expires_at)
+
+    def delete(self, namespace, key):
+        with self._lock:
+            self._data.get(namespace, {}).pop(key, None)
+
+    def purge_expired(self):
+        now = time.time()
+        with self._lock:
+            for table in self._data.values():
+                for key, (_, expires_at) in list(table.items()):
+                    if expires_at is not None and expires_at <= now:
+                        del table[key]
+
+    def claim(self, namespace, key, owner, ttl_sec):
+        now = time.time()
+        with self._lock:
+            table = self._data.setdefault(namespace, {})
+            holder, expires_at = table.get(key, (None, None))
+            if holder not in (None, owner) and (expires_at is None or expires_at > now):
+                return False
+            table[key] = (owner, now + ttl_sec)
+            return True
+
+    def items(self, namespace):
+        now = time.time()
+        with self._lock:
+            table = list(self._data.get(namespace, {}).items())
+        for key, (value, expires_at) in table:
+            if expires_at is None or expires_at > now:
+                yield key, value
+
+
+class SqliteBackend(StateBackend):
+    """One connection per process, shared by all threads."""
+
+    # SQLite limits the number of parameters of a query.
+    _BATCH = 500
+
+    def __init__(self, path: T.Union[str, Path] = DEFAULT_STATE_PATH):
+        self.path = str(path)
+        self._conn: T.Optional[sqlite3.Connection] = None
+        self._pid: T.Optional[int] = None
+        self._tables: T.Set[str] = set()
+        self._lock = threading.RLock()
+
+    def _connection(self) -> sqlite3.Connection:
+        # A connection must not be used across fork.
+        if self._conn is None or self._pid != os.getpid():
+            conn = sqlite3.connect(
+                self.path, timeout=30, check_same_thread=False, isolation_level=None
+            )
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn, self._pid, self._tables = conn, os.getpid(), set()
+        return self._conn
+
+    def _table(self, namespace: str) -> str:
+        table = "kv_" + re.sub(r"[^a-zA-Z0-9_]", "_", namespace)
+        if table not in self._tables:
+            self._connection().execute(
+                f"CREATE TABLE IF NOT EXISTS {table} ("
+                " key TEXT PRIMARY KEY, value BLOB, expires_at REAL"
+                ") WITHOUT ROWID"
+            )
+            self._tables.add(table)
+        return table
+
+    def get_many(self, namespace, keys):
+        keys = list(keys)
+        result = {}
+        with self._lock:
+            table = self._table(namespace)
+            conn = self._connection()
+            for i in range(0, len(keys), self._BATCH):
+                batch = keys[i : i + self._BATCH]
+                marks = ",".join("?" * len(batch))
+                rows = conn.execute(
+                    f"SELECT key, value FROM {table} WHERE key IN ({marks})"
+                    " AND (expires_at IS NULL OR expires_at > ?)",
+                    [*batch, time.time()],
+                )
+                result.update((key, pickle.loads(value)) for key, value in rows)
+        return result
+
+    def put_many(self, namespace, items, ttl_sec=None):
+        expires_at = time.time() + ttl_sec if ttl_sec is not None else None
+        rows = [(k, pickle.dumps(v), expires_at) for k, v in items.items()]
+        with self._lock:
+            table = self._table(namespace)
+            conn = self._connection()
+            with conn:
+                conn.execute("BEGIN")
+                conn.executemany(
+                    f"INSERT OR REPLACE INTO {table} VALUES (?, ?, ?)", rows
+                )
+
+    def claim(self, namespace, key, owner, ttl_sec):
+        now = time.time()
+        with self._lock:
+            table = self._table(namespace)
+            conn = self._connection()
+            with conn:
+                conn.execute("BEGIN IMMEDIATE")
+                row = conn.execute(
+                    f"SELECT value FROM {table} WHERE key = ?"
+                    " AND (expires_at IS NULL OR expires_at > ?)",
+                    (key, now),
+                ).fetchone()
+                if row is not None and pickle.loads(row[0]) != owner:
+                    return False
+                conn.execute(
+                    f"INSERT OR REPLACE INTO {table} VALUES (?, ?, ?)",
+                    (key, pickle.dumps(owner), now + ttl_sec),
+                )
+                return True
+
+    def delete(self, namespace, key):
+        with self._lock:
+            table = self._table(namespace)
+            self._connection().execute(f"DELETE FROM {table} WHERE key = ?", (key,))
+
+    def items(self, namespace):
+        with self._lock:
+            table = self._table(namespace)
+            cursor = self._connection().execute(
+                f"SELECT key, value FROM {table}"
+                " WHERE expires_at IS NULL OR expires_at > ?",
+                (time.time(),),
+            )
+            rows = cursor.fetchall()
+        for key, value in rows:
+            yield key, pickle.loads(value)
+
+    def purge_expired(self):
+        with self._lock:
+            conn = self._connection()
+            tables = conn.execute(
+                "SELECT name FROM sqlite_master WHERE type='table' AND name LIKE 'kv_%'"
+            ).fetchall()
+            for (table,) in tables:
+                conn.execute(
+                    f"DELETE FROM {table} WHERE expires_at <= ?", (time.time(),)
+                )
+
+
+BACKENDS: T.Dict[str, T.Callable[[], StateBackend]] = dict(
+    sqlite=lambda: SqliteBackend(os.environ.get("GINO_STATE_PATH", DEFAULT_STATE_PATH)),
+    memory=MemoryBackend,
+)
+
+_BACKEND: T.Optional[StateBackend] = None
+_BACKEND_LOCK = threading.Lock()
+
+
+def backend() -> StateBackend:
+    """The state backend of this process."""
+    global _BACKEND
+    with _BACKEND_LOCK:
+        if _BACKEND is None:
+            _BACKEND = BACKENDS[os.environ.get("GINO_STATE_BACKEND", "sqlite")]()
+            _BACKEND.purge_expired()
+        return _BACKEND
+
+
+def set_backend(state: T.Optional[StateBackend]):
+    global _BACKEND
+    with _BACKEND_LOCK:
+        _BACKEND = state
+
+
+def _namespace_of_shelve_key(key: str) -> str:
+    if key.startswith("watermark:"):
+        return WATERMARKS
+    if key.startswith(("issue-page:", "page-issue:")):
+        return INDEX
+    if key.startswith("notion-user:"):
+        return CACHE
+    # create_task() stores '<url>-<title>' keys to avoid creating duplicates.
+    return DEDUPE
+
+
+@app.command("migrate-shelve")
+def migrate_shelve(path: str = "gino.shelve"):
+    """Import the state from the shelve file used by older versions."""
+    counts: T.Dict[str, int] = {}
+    state = backend()
+    with shelve.open(path, flag="r") as db:
+        for key in db.keys():
+            namespace = _namespace_of_shelve_key(key)
+            state.put(namespace, key, db[key])
+            counts[namespace] = counts.get(namespace, 0) + 1
+    for namespace, count in counts.items():
+        logging.info(f"Imported {count} keys into '{namespace}'")
@@ -0,0 +1,56 @@
+"""HTTP plumbing that routes the requests of python-gitlab (requests) and
+notion-client (httpx) through the rate limiter of `gino.ratelimit`."""
+
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+
+from gino.ratelimit import send, async_send
+
+
+class RateLimitedAdapter(HTTPAdapter):
+    """requests adapter (used by python-gitlab) that goes through `send`."""
+
+    def __init__(self, service: str, **kwargs):
+        self.service = service
+        super().__init__(**kwargs)
+
+    def send(self, request, **kwargs):
+        parent = super().send
+        return send(self.service, request.method, lambda: parent(request, **kwargs))
+
+
+class RateLimitedTransport(httpx.HTTPTransport):
+    """httpx transport (used by notion-client) that goes through `send`."""
+
+    def __init__(self, service: str, **kwargs):
+        self.service = service
+        super().__init__(**kwargs)
+
+    def handle_request(self, request):
+        parent = super().handle_request
+        return send(self.service, request.method, lambda: parent(request))
+
+
+class AsyncRateLimitedTransport(httpx.AsyncHTTPTransport):
+    """async httpx transport that goes through `async_send`."""
+
+    def __init__(self, service: str, **kwargs):
+        self.service = service
+        super().__init__(**kwargs)
+
+    async def handle_async_request(self, request):
+        parent = super().handle_async_request
+        return await async_send(self.service, request.method, lambda: parent(request))
+
+
+def requests_session(service: str) -> requests.Session:
+    session = requests.Session()
+    adapter = RateLimitedAdapter(service)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def httpx_client(service: str) -> httpx.Client:
+    return httpx.Client(transport=RateLimitedTransport(service))
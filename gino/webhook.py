@@ -0,0 +1,153 @@
+"""Receive GitLab webhooks and sync only the issue that changed.
+
+Configure a project (or group) webhook in GitLab pointing at `gino serve` with
+'Issues events' and 'Comments' enabled. The value of GITLAB_WEBHOOK_SECRET in
+the env must be used as the webhook's secret token. It may only be left unset
+when the server listens on a loopback address.
+"""
+
+import os
+import hmac
+import json
+import logging
+import zlib
+import ipaddress
+import threading
+import typing as T
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import gino.gitlab
+
+# Events of the same issue are processed one at a time. Issues share a fixed
+# number of locks so that the locks do not grow with the number of issues.
+_ISSUE_LOCKS = [threading.Lock() for _ in range(256)]
+
+
+def _issue_lock(project_id: int, issue_iid: int) -> threading.Lock:
+    key = f"{project_id}:{issue_iid}".encode()
+    return _ISSUE_LOCKS[zlib.crc32(key) % len(_ISSUE_LOCKS)]
+
+
+def _is_authorized(token: T.Optional[str], secret: T.Optional[str]) -> bool:
+    if not secret:
+        return True
+    return hmac.compare_digest((token or "").encode(), secret.encode())
+
+
+def _is_loopback(host: str) -> bool:
+    if host == "localhost":
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+
+def _handle_issue_event(event: dict):
+    attrs = event["object_attributes"]
+    action = attrs.get("action")
+    project = gino.gitlab.get_gitlab_client().projects.get(event["project"]["id"])
+    issue = project.issues.get(attrs["iid"])
+    if action in ("open", "reopen"):
+        gino.gitlab.link_issue_with_notion(project, issue)
+    elif action == "close":
+        gino.gitlab.change_notion_task_status(issue)
+    else:
+        logging.debug(f"Ignoring issue event with action {action}")
+
+
+def _handle_note_event(event: dict):
+    if event["object_attributes"].get("noteable_type") != "Issue":
+        return
+    gl = gino.gitlab.get_gitlab_client()
+    project = gl.projects.get(event["project"]["id"], lazy=True)
+    issue = project.issues.get(event["issue"]["iid"])
+    if gino.gitlab.is_linked_with_notion(issue):
+        gino.gitlab.sync_issue_notes(issue)
+
+
+_HANDLERS: T.Dict[str, T.Callable[[dict], None]] = {
+    "issue": _handle_issue_event,
+    "note": _handle_note_event,
+}
+
+
+def handle_event(event: dict):
+    """Process a single GitLab webhook event. Never raises."""
+    kind = str(event.get("object_kind"))
+    if (handler := _HANDLERS.get(kind)) is None:
+        logging.debug(f"Ignoring event of kind {kind}")
+        return
+    try:
+        issue = event.get("issue") or event["object_attributes"]
+        with _issue_lock(event["project"]["id"], issue["iid"]):
+            handler(event)
+    except Exception as e:
+        logging.warning(f"Failed to handle {kind} event: {e}")
+
+
+def _make_handler(pool: ThreadPoolExecutor, secret: T.Optional[str]):
+    class WebhookHandler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            if not _is_authorized(self.headers.get("X-Gitlab-Token"), secret):
+                self.send_response(401)
+                self.end_headers()
+                return
+            try:
+                length = int(self.headers.get("Content-Length", 0))
+                event = json.loads(self.rfile.read(length))
+            except ValueError:
+                self.send_response(400)
+                self.end_headers()
+                return
+            # reply right away; GitLab disables hooks that respond slowly.
+            pool.submit(handle_event, event)
+            self.send_response(202)
+            self.end_headers()
+
+        def log_message(self, format, *args):
+            logging.debug(format % args)
+
+    return WebhookHandler
+
+
+def _reconcile_forever(sweep: T.Callable[[], None], interval_sec: int):
+    event = threading.Event()
+    while not event.wait(interval_sec):
+        try:
+            sweep()
+        except Exception as e:
+            logging.warning(f"Reconciliation sweep failed: {e}")
+
+
+def serve(
+    host: str,
+    port: int,
+    workers: int,
+    sweep: T.Optional[T.Callable[[], None]] = None,
+    sweep_interval_sec: int = 3600,
+):
+    """Serve webhooks until interrupted. `sweep` is called every
+    `sweep_interval_sec` to catch up on events that were missed.
+    """
+    secret = os.environ.get("GITLAB_WEBHOOK_SECRET")
+    if not secret:
+        if not _is_loopback(host):
+            raise RuntimeError(
+                f"GITLAB_WEBHOOK_SECRET must be set to accept webhooks on {host}"
+            )
+        logging.warning("GITLAB_WEBHOOK_SECRET is not set: webhooks are not checked")
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        if sweep is not None:
+            threading.Thread(
+                target=_reconcile_forever,
+                args=(sweep, sweep_interval_sec),
+                daemon=True,
+            ).start()
+        server = ThreadingHTTPServer((host, port), _make_handler(pool, secret))
+        logging.info(f"Listening for GitLab webhooks on {host}:{port}")
+        try:
+            server.serve_forever()
+        finally:
+            server.server_close()
@@ -0,0 +1,99 @@
+import asyncio
+from datetime import timedelta
+from types import SimpleNamespace
+
+import gino.aio
+import gino.common
+import gino.gitlab
+import gino.notion
+import gino.state
+
+
+def _issue(iid, created_days_ago, updated_days_ago):
+    now = gino.common.now_utc()
+    return SimpleNamespace(
+        id=100 + iid,
+        iid=iid,
+        project_id=3,
+        title=f"Issue {iid}",
+        web_url=f"https://gitlab/g/p/-/issues/{iid}",
+        description="Something is broken",
+        author=dict(username="alice"),
+        assignees=[],
+        due_date=None,
+        labels=[],
+        state="opened",
+        created_at=(now - timedelta(days=created_days_ago)).isoformat(),
+        updated_at=(now - timedelta(days=updated_days_ago)).isoformat(),
+    )
+
+
+class _GitLab:
+    def __init__(self, recent, idle):
+        self.recent, self.idle = recent, idle
+        self.queries = []
+        self.writes = []
+
+    async def list_issues(self, project_id, stats, **params):
+        self.queries.append(params)
+        stats["pages"] = stats.get("pages", 0) + 1
+        for issue in self.recent if "updated_after" in params else self.idle:
+            yield issue
+
+    async def iter_notes(self, issue, sort="desc"):
+        for note in []:
+            yield note
+
+    async def create_note(self, issue, body):
+        self.writes.append(("note", issue.iid, body))
+
+    async def update_issue(self, issue, **data):
+        self.writes.append(("update", issue.iid, data))
+
+
+class _Pages:
+    def __init__(self):
+        self.created = []
+
+    async def create(self, **kw):
+        self.created.append(kw)
+        return dict(id="1" * 32, url="https://notion/page")
+
+
+def _pipeline(monkeypatch, recent=(), idle=()):
+    gino.state.set_backend(gino.state.MemoryBackend())
+    monkeypatch.setattr(gino.notion, "task_properties", lambda *a, **kw: {})
+    monkeypatch.setattr(gino.notion, "db_id", lambda: "db")
+    notion = SimpleNamespace(pages=_Pages())
+    return gino.aio.Pipeline(_GitLab(recent, idle), notion)
+
+
+def test_issues_are_updated_once(monkeypatch):
+    pipeline = _pipeline(monkeypatch, [_issue(1, 0, 0)], [_issue(2, 200, 40)])
+    project = SimpleNamespace(id=3, name="p")
+    stats = asyncio.run(pipeline.sync_project_issues(project))
+    assert stats["link"] == 1 and stats["stale"] == 1 and stats["pages"] == 2
+    assert len(pipeline.notion.pages.created) == 1
+    assert sorted(pipeline.gitlab.writes) == [
+        ("note", 1, "More information may be found at https://notion/page"),
+        ("update", 1, dict(add_labels=gino.common.LINKED_WITH_NOTION)),
+        ("update", 2, dict(add_labels=gino.gitlab.STALE)),
+    ]
+    assert gino.common.page_of_issue(3, 1) == "1" * 32
+    assert gino.common.load_watermark(3, "sync-new") is not None
+
+
+def test_dormant_projects_are_only_swept(monkeypatch):
+    pipeline = _pipeline(monkeypatch)
+    project = SimpleNamespace(id=3, name="p")
+    asyncio.run(pipeline.sync_project_issues(project, recent=False))
+    assert [q.get("state") for q in pipeline.gitlab.queries] == ["opened"]
+    assert gino.common.load_watermark(3, "sync-new") is None
+
+
+def test_dry_run_sends_nothing(monkeypatch):
+    pipeline = _pipeline(monkeypatch, [_issue(1, 0, 0)], [_issue(2, 200, 40)])
+    monkeypatch.setattr(gino.common, "DRY_RUN", True)
+    asyncio.run(pipeline.sync_project_issues(SimpleNamespace(id=3, name="p")))
+    assert pipeline.gitlab.writes == [] and pipeline.notion.pages.created == []
+    assert gino.common.load_watermark(3, "sync-new") is None
@@ -0,0 +1,27 @@
+from datetime import datetime, timezone
+
+import pytest
+
+from gino.common import parse_date, parse_datetime
+
+
+def test_parse_date_iso():
+    utc = timezone.utc
+    expected = datetime(2024, 5, 6, 10, 20, 30, 123000, tzinfo=utc)
+    assert parse_date("2024-05-06T10:20:30.123Z") == expected
+    assert parse_date("2024-05-06T10:20:30.123+00:00") == expected
+    assert parse_date("2024-05-06T15:50:30.123+05:30") == expected
+    assert parse_date("2024-05-06") == datetime(2024, 5, 6, tzinfo=utc)
+    assert parse_date(None) is None
+    assert parse_date(expected) == expected
+
+
+def test_parse_date_free_form():
+    assert parse_date("6 May 2024") == datetime(2024, 5, 6, tzinfo=timezone.utc)
+
+
+def test_parse_datetime_requires_a_date():
+    assert parse_datetime("2024-05-06") == datetime(2024, 5, 6, tzinfo=timezone.utc)
+    for date in (None, "", "not a date"):
+        with pytest.raises(ValueError):
+            parse_datetime(date)
@@ -0,0 +1,294 @@
+import json
+from datetime import timedelta
+from types import SimpleNamespace
+
+import gino.common
+import gino.gitlab
+import gino.state
+from gino.common import now_utc
+
+
+def _issue(state, created_days_ago, updated_days_ago, now):
+    return SimpleNamespace(
+        state=state,
+        created_at=(now - timedelta(days=created_days_ago)).isoformat(),
+        updated_at=(now - timedelta(days=updated_days_ago)).isoformat(),
+    )
+
+
+def test_classify_issue():
+    now = now_utc()
+    since = dict(
+        created_after=now - timedelta(days=1),
+        closed_after=now - timedelta(days=1),
+        now=now,
+    )
+    classify = gino.gitlab.classify_issue
+    assert classify(_issue("opened", 0, 0, now), **since) == ["link"]
+    assert classify(_issue("opened", 10, 0, now), **since) == []
+    assert classify(_issue("closed", 10, 0, now), **since) == ["closed"]
+    assert classify(_issue("closed", 10, 5, now), **since) == []
+    assert classify(_issue("opened", 100, 30, now), **since) == ["stale"]
+    assert classify(_issue("opened", 200, 100, now), **since) == [
+        "stale",
+        "inactive",
+    ]
+
+
+class _FakeIssue:
+    def __init__(self, labels):
+        self.labels = labels
+        self.state = "opened"
+        self.id, self.iid, self.title = 10, 1, "An issue"
+        self.web_url = "https://gitlab/x/-/issues/1"
+        self.calls = []
+        self.notes = SimpleNamespace(create=lambda d: self.calls.append(("note", d)))
+
+    def save(self):
+        self.calls.append(
+            ("save", list(self.labels), getattr(self, "state_event", None))
+        )
+
+
+def test_issue_mutations_are_flushed_together():
+    issue = _FakeIssue(["bug"])
+    mutations = gino.gitlab.IssueMutations(issue)
+    gino.gitlab.mark_issue_stale(issue, mutations)
+    mutations.add_note("one")
+    mutations.add_note("two")
+    mutations.close()
+    assert mutations.state == "closed"
+    assert issue.calls == []
+
+    mutations.flush()
+    assert issue.calls == [
+        ("note", dict(body="one\n\ntwo")),
+        ("save", ["bug", "stale"], "close"),
+    ]
+    assert not mutations
+
+
+def test_project_sync_counts_flushed_requests(monkeypatch):
+    gino.state.set_backend(gino.state.MemoryBackend())
+    now = now_utc()
+
+    def _noop(issue, mutations):
+        pass
+
+    sync = gino.gitlab.ProjectSync(
+        SimpleNamespace(id=3),
+        dict(stale=_noop, inactive=gino.gitlab.mark_issue_stale),
+        lambda m: m.flush(),
+        sync_notes=None,
+    )
+    # a handler that returns early does not use the budget.
+    stale = _FakeIssue([])
+    stale.__dict__.update(vars(_issue("opened", 100, 30, now)))
+    gino.gitlab.run_steps(sync.steps(stale))
+    assert sync.stats["stale"] == 1 and sync.stats["writes"] == 0
+
+    inactive = _FakeIssue([])
+    inactive.__dict__.update(vars(_issue("opened", 200, 100, now)))
+    gino.gitlab.run_steps(sync.steps(inactive))
+    assert sync.stats["inactive"] == 1 and sync.stats["writes"] == 1
+
+    monkeypatch.setattr(gino.common, "DRY_RUN", True)
+    inactive.labels = []
+    gino.gitlab.run_steps(sync.steps(inactive))
+    assert sync.stats["inactive"] == 2 and sync.stats["writes"] == 1
+
+
+def test_dry_run_does_not_move_watermarks(monkeypatch):
+    gino.state.set_backend(gino.state.MemoryBackend())
+    project = SimpleNamespace(id=7, issues=SimpleNamespace(list=lambda **kw: []))
+    monkeypatch.setattr(gino.common, "DRY_RUN", True)
+    gino.gitlab.sync_project_issues(project)
+    assert gino.common.load_watermark(7, "sync-new") is None
+    assert gino.common.load_watermark(7, "sync-closed") is None
+
+    monkeypatch.setattr(gino.common, "DRY_RUN", False)
+    gino.gitlab.sync_project_issues(project)
+    assert gino.common.load_watermark(7, "sync-new") is not None
+
+
+def _linked_issue(iid, page_uuid=None):
+    notes = []
+    if page_uuid is not None:
+        body = f"More information may be found at https://notion.so/Task-{page_uuid}"
+        notes.append(SimpleNamespace(body=body))
+    calls = []
+
+    def _list(**kw):
+        calls.append(iid)
+        return notes
+
+    return SimpleNamespace(
+        project_id=3,
+        iid=iid,
+        web_url=f"https://gitlab/{iid}",
+        labels=[gino.common.LINKED_WITH_NOTION],
+        notes=SimpleNamespace(list=_list),
+        calls=calls,
+    )
+
+
+def test_page_lookup_uses_the_index():
+    gino.state.set_backend(gino.state.MemoryBackend())
+    page_uuid = "a" * 32
+    issue = _linked_issue(1, page_uuid)
+    # the first lookup scans the notes and remembers the page.
+    assert gino.gitlab.find_notion_page_uuid(issue) == page_uuid
+    assert gino.common.page_of_issue(3, 1) == page_uuid
+    assert gino.common.issue_of_page(page_uuid) == (3, 1)
+    assert gino.gitlab.find_notion_page_uuid(issue) == page_uuid
+    assert issue.calls == [1]
+
+
+def test_backfill_index(monkeypatch):
+    gino.state.set_backend(gino.state.MemoryBackend())
+    issues = [_linked_issue(1, "b" * 32), _linked_issue(2), _linked_issue(3)]
+    gino.common.index_issue_page(3, 3, "c" * 32)
+
+    def _list(labels, **kw):
+        return issues if labels == [gino.common.LINKED_WITH_NOTION] else []
+
+    project = SimpleNamespace(name="p", issues=SimpleNamespace(list=_list))
+    monkeypatch.setattr(gino.gitlab, "_get_projects", lambda name: [project])
+    gino.gitlab.backfill_issue_page_index()
+    assert gino.common.page_of_issue(3, 1) == "b" * 32
+    # issue 2 has no link to a page, issue 3 was already indexed.
+    assert gino.common.page_of_issue(3, 2) is None
+    assert [i.calls for i in issues] == [[1], [2], []]
+
+
+def test_parse_issue_url():
+    parse = gino.gitlab._parse_issue_url
+    assert parse("https://gitlab.example.com/g/sub/p/-/issues/12") == ("g/sub/p", 12)
+    assert parse("https://gitlab.example.com/g/p/issues/3") == ("g/p", 3)
+
+
+class _FakeProject:
+    def __init__(self, issues):
+        self.id, self.name = 1, "p"
+        self.last_activity_at = now_utc().isoformat()
+        self.queries = []
+
+        def _list(**kw):
+            self.queries.append(kw)
+            return issues
+
+        self.issues = SimpleNamespace(list=_list)
+
+
+def test_task_maturity_is_incremental():
+    gino.state.set_backend(gino.state.MemoryBackend())
+    now = now_utc()
+    issue = SimpleNamespace(
+        iid=7,
+        web_url="https://gitlab/p/-/issues/7",
+        created_at=(now - timedelta(days=10)).isoformat(),
+        closed_at=(now - timedelta(days=1)).isoformat(),
+        due_date=(now - timedelta(days=3)).strftime("%Y-%m-%d"),
+    )
+    project = _FakeProject([issue])
+    assert gino.gitlab.compute_project_task_maturity_metric(project) == 1
+    assert "updated_after" not in project.queries[0]
+    metrics = dict(gino.state.backend().items(gino.state.MATURITY))
+    assert metrics["1:7"]["metric"]["days_spent"] == 9
+
+    # the second run only asks for the issues updated since the first one.
+    project.issues.list = lambda **kw: project.queries.append(kw) or []
+    assert gino.gitlab.compute_project_task_maturity_metric(project) == 0
+    assert "updated_after" in project.queries[1]
+    assert dict(gino.state.backend().items(gino.state.MATURITY)) == metrics
+
+    # no activity in the project since the last run: nothing is fetched.
+    project.last_activity_at = (now - timedelta(days=1)).isoformat()
+    assert gino.gitlab.compute_project_task_maturity_metric(project) == 0
+    assert len(project.queries) == 2
+
+
+def test_task_maturity_without_numpy(tmp_path, monkeypatch):
+    gino.state.set_backend(gino.state.MemoryBackend())
+    metric = dict(days_spent=2)
+    entry = dict(project="p", iid=7, metric=metric)
+    gino.state.backend().put(gino.state.MATURITY, "1:7", entry)
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(gino.gitlab, "has_numpy", lambda: False)
+    monkeypatch.setattr(gino.gitlab, "_get_projects", lambda name: [])
+    gino.gitlab.compute_task_maturity_metric(workers=1)
+    with open(gino.gitlab.MATURITY_JSON_FILE) as f:
+        assert json.load(f) == {"p": {"7": metric}}
+    assert not gino.gitlab.MATURITY_FILE.exists()
+
+
+def _note(note_id, minutes_ago, author="alice", body="hello", now=None):
+    created = (now or now_utc()) - timedelta(minutes=minutes_ago)
+    return dict(
+        id=note_id,
+        author=dict(username=author),
+        body=body,
+        created_at=created.isoformat(),
+    )
+
+
+def test_new_notes_stop_at_cursor():
+    now = now_utc()
+    consumed = []
+
+    def newest_first():
+        for note in [
+            _note(5, 1, now=now),
+            _note(4, 20, author="gino.bot", now=now),
+            _note(3, 30, now=now),
+            _note(2, 40, now=now),
+            _note(1, 50, now=now),
+        ]:
+            consumed.append(note["id"])
+            yield note
+
+    grace = now - timedelta(minutes=10)
+    forward, cursor = gino.gitlab.new_notes(newest_first(), 2, grace)
+    # note 5 is still being edited, note 4 is by gino.
+    assert [n["id"] for n in forward] == [3]
+    assert cursor == 4
+    # notes older than the cursor are not fetched.
+    assert consumed == [5, 4, 3, 2]
+
+    forward, cursor = gino.gitlab.new_notes(newest_first(), 4)
+    assert [n["id"] for n in forward] == [5]
+    assert cursor == 5
+
+
+def test_project_sync_records_failures_for_both_drivers():
+    import asyncio
+
+    import gino.aio
+
+    now = now_utc()
+    issue = _issue("opened", 0, 0, now)
+    issue.web_url, issue.labels = "https://gitlab/x/-/issues/2", []
+
+    def _link(issue, mutations):
+        raise RuntimeError("notion is down")
+
+    async def _alink(issue, mutations):
+        _link(issue, mutations)
+
+    async def _aflush(mutations):
+        pass
+
+    for driver, link, flush in (
+        (gino.gitlab.run_steps, _link, lambda m: None),
+        (lambda steps: asyncio.run(gino.aio.run_steps(steps)), _alink, _aflush),
+    ):
+        gino.state.set_backend(gino.state.MemoryBackend())
+        sync = gino.gitlab.ProjectSync(
+            SimpleNamespace(id=3), dict(link=link), flush, sync_notes=None
+        )
+        driver(sync.steps(issue))
+        assert sync.failed == {"link"} and "link" not in sync.stats
+        sync.finish()
+        # the issue is listed again in the next run.
+        assert gino.common.load_watermark(3, "sync-new") is None
+        assert gino.common.load_watermark(3, "sync-closed") is not None
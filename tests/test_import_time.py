@@ -0,0 +1,48 @@
+import sys
+import subprocess
+
+# Time budget (ms) to import the cli i.e. the startup time of `gino --help`.
+IMPORT_BUDGET_MS = 300
+
+# These are imported by the commands that use them, never at startup.
+LAZY_MODULES = [
+    "dateparser",
+    "gitlab",
+    "httpx",
+    "matplotlib",
+    "notion_client",
+    "numpy",
+    "requests",
+    "sentry_sdk",
+    "urlextract",
+    "validators",
+]
+
+
+def _import_times(module: str):
+    """module -> cumulative import time (us) from `python -X importtime`"""
+    out = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    times = {}
+    for line in out.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line.split("|")
+        if cumulative.strip().isdigit():
+            times[name.strip()] = int(cumulative)
+    return times
+
+
+def test_heavy_modules_are_imported_lazily():
+    times = _import_times("gino.__main__")
+    assert not [m for m in LAZY_MODULES if m in times]
+
+
+def test_import_time_budget():
+    # the best of a few runs, to not fail on a busy machine.
+    best = min(_import_times("gino.__main__")["gino.__main__"] for _ in range(3))
+    assert best / 1000 < IMPORT_BUDGET_MS, f"Importing gino took {best / 1000:.0f}ms"
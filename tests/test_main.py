@@ -0,0 +1,153 @@
+from datetime import timedelta
+from types import SimpleNamespace
+
+import gitlab
+
+import gino.__main__
+import gino.aio
+import gino.common
+import gino.gitlab
+import gino.metrics
+import gino.notion
+import gino.state
+
+
+def _project(pid):
+    return SimpleNamespace(
+        id=pid,
+        name=f"p{pid}",
+        name_with_namespace=f"g/p{pid}",
+        last_activity_at=gino.common.now_utc().isoformat(),
+        issues=SimpleNamespace(list=lambda **kw: []),
+    )
+
+
+def _fake_projects(monkeypatch, projects, active):
+    """GitLab with `projects`, of which `active` had recent activity."""
+    gino.state.set_backend(gino.state.MemoryBackend())
+    queries = []
+
+    def _list_projects(active_after=None):
+        queries.append(active_after)
+        return active if active_after is not None else projects
+
+    monkeypatch.setattr(gino.gitlab, "list_projects", _list_projects)
+    # catalogued projects are lazy: the client makes no request.
+    client = gitlab.Gitlab("https://gitlab.invalid")
+    monkeypatch.setattr(gino.gitlab, "get_gitlab_client", lambda: client)
+    return queries
+
+
+def test_plan_projects(monkeypatch):
+    projects = [_project(1), _project(2), _project(3)]
+    queries = _fake_projects(monkeypatch, projects, active=projects[:1])
+    active, dormant = gino.__main__.plan_projects()
+    assert active == projects[:1]
+    assert sorted(p.id for p in dormant) == [2, 3]
+    # the catalogue is refreshed, and the activity filter is widened by an hour.
+    assert queries[0] is None
+    window = timedelta(minutes=gino.__main__.DORMANT_SWEEP_INTERVAL_MINS + 60)
+    assert abs(gino.common.now_utc() - window - queries[1]) < timedelta(minutes=1)
+    assert gino.common.load_watermark("projects", "catalogue") is not None
+
+    # dormant projects are swept once a day, the catalogue once a week.
+    gino.common.store_watermark("projects", "dormant-sweep", gino.common.now_utc())
+    active, dormant = gino.__main__.plan_projects()
+    assert active == projects[:1] and dormant == []
+    assert len(queries) == 3 and queries[2] is not None
+
+
+def test_archived_projects_leave_the_catalogue(monkeypatch):
+    projects = [_project(1), _project(2), _project(3)]
+    _fake_projects(monkeypatch, projects, active=[])
+    gino.__main__.plan_projects()
+    week_ago = gino.common.now_utc() - timedelta(days=8)
+    gino.common.store_watermark("projects", "catalogue", week_ago)
+
+    # project 3 was archived or deleted.
+    del projects[2]
+    gino.__main__.plan_projects()
+    assert sorted(p.id for p in gino.gitlab.catalogued_projects()) == [1, 2]
+    assert gino.common.load_watermark("projects", "catalogue") > week_ago
+
+
+def test_run_once_syncs_dormant_projects_once_a_day(monkeypatch):
+    projects = [_project(1), _project(2), _project(3)]
+    _fake_projects(monkeypatch, projects, active=projects[:1])
+    synced = []
+
+    def _sync_project_issues(project, recent=True, sweep=True):
+        synced.append((project.id, recent))
+        return dict(issues=0, pages=1)
+
+    monkeypatch.setattr(gino.gitlab, "sync_project_issues", _sync_project_issues)
+    monkeypatch.setattr(gino.notion, "sync_recently_added_blocks", lambda w: None)
+    gino.__main__.run_once(workers=2)
+    # only the active project gets the full sync.
+    assert sorted(synced) == [(1, True), (2, False), (3, False)]
+    assert gino.common.load_watermark("projects", "active") is not None
+    assert gino.common.load_watermark("projects", "dormant-sweep") is not None
+
+    synced.clear()
+    gino.__main__.run_once(workers=2)
+    assert synced == [(1, True)]
+
+
+def _fake_gitlab(monkeypatch):
+    gino.state.set_backend(gino.state.MemoryBackend())
+    projects = [_project(1), _project(2)]
+    dormant = _project(3)
+    monkeypatch.setattr(gino.gitlab, "list_projects", lambda *a: projects)
+    monkeypatch.setattr(
+        gino.gitlab, "catalogued_projects", lambda: [*projects, dormant]
+    )
+    monkeypatch.setattr(gino.notion, "sync_recently_added_blocks", lambda w: None)
+    return [*projects, dormant]
+
+
+def test_run_once(monkeypatch):
+    _fake_gitlab(monkeypatch)
+    gino.__main__.run_once(workers=2)
+    assert gino.common.load_watermark("projects", "active") is not None
+    assert gino.common.load_watermark("projects", "dormant-sweep") is not None
+    assert gino.common.load_watermark(1, "sync-new") is not None
+
+
+def test_sync_active_async(monkeypatch):
+    projects = _fake_gitlab(monkeypatch)
+    synced = []
+
+    async def _sync_projects(active, dormant, workers, sweep):
+        synced.extend(active + dormant)
+        return {p.name_with_namespace: dict(secs=0.0, pages=0) for p in synced}
+
+    monkeypatch.setattr(gino.aio, "sync_projects", _sync_projects)
+    assert gino.__main__._sync_active(2, use_async=True, sweep=False) is False
+    assert synced == projects[:2]
+
+
+def test_run_once_with_a_shard(monkeypatch):
+    _fake_gitlab(monkeypatch)
+    gino.__main__.run_once(workers=2, shard="0/1")
+    assert gino.common.load_watermark("projects@0/1", "active") is not None
+    assert gino.common.load_watermark("projects", "active") is None
+
+
+def test_dry_run_does_not_store_watermarks(monkeypatch):
+    _fake_gitlab(monkeypatch)
+    monkeypatch.setattr(gino.common, "DRY_RUN", True)
+    gino.__main__._run_once(workers=2)
+    for key in ("catalogue", "active", "dormant-sweep"):
+        assert gino.common.load_watermark("projects", key) is None
+
+
+def test_run_logs_a_summary_per_cycle(monkeypatch):
+    _fake_gitlab(monkeypatch)
+    summaries = []
+    monkeypatch.setattr(
+        gino.metrics, "log_summary", lambda since: summaries.append(since)
+    )
+    jobs = {job.name: job for job in gino.__main__._jobs(2, False, None, None)}
+    assert jobs["sync-active"].fn(None) is False
+    assert jobs["sync-active"].fn(None) is False
+    assert len(summaries) == 2 and summaries[0] is not summaries[1]
@@ -0,0 +1,35 @@
+import gino.metrics
+
+
+def test_timed_attributes_requests_to_stage():
+    before = gino.metrics.snapshot()
+
+    @gino.metrics.timed("test-stage")
+    def work():
+        assert gino.metrics.stage() == "test-stage"
+        gino.metrics.inc(
+            "gino_api_requests_total",
+            service="gitlab",
+            status=200,
+            stage=gino.metrics.stage(),
+        )
+
+    work()
+    work()
+    assert gino.metrics.stage() == ""
+
+    summary = gino.metrics.summary(since=before)
+    assert "test-stage" in summary
+    rows = [line.split() for line in summary.splitlines()]
+    assert ["test-stage", "2"] == rows[1][:2]
+    assert ["gitlab", "test-stage", "2", "0"] in rows
+
+
+def test_render_prometheus_text():
+    gino.metrics.observe("gino_api_request_seconds", 0.2, service="notion")
+    gino.metrics.inc("gino_api_retried_total", service="notion")
+    text = gino.metrics.render()
+    assert "# TYPE gino_api_request_seconds histogram" in text
+    assert 'gino_api_request_seconds_bucket{service="notion",le="0.25"}' in text
+    assert 'gino_api_request_seconds_bucket{service="notion",le="+Inf"}' in text
+    assert 'gino_api_retried_total{service="notion"}' in text
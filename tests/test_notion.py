@@ -0,0 +1,220 @@
+import time
+import uuid
+from datetime import datetime, timezone
+from types import SimpleNamespace
+
+import gino.common
+import gino.gitlab
+import gino.notion
+import gino.state
+
+
+def _block(text, created_time="2099-01-01T00:00:00.000Z", author="someone"):
+    return dict(
+        id=str(uuid.uuid4()),
+        type="paragraph",
+        paragraph=dict(rich_text=[dict(plain_text=text)]),
+        created_time=created_time,
+        created_by=dict(id=author),
+    )
+
+
+def _fake_notion(monkeypatch, blocks):
+    notes = []
+
+    def _list(block_id, **kw):
+        return dict(results=blocks, has_more=False, next_cursor=None)
+
+    notion = SimpleNamespace(
+        blocks=SimpleNamespace(children=SimpleNamespace(list=_list))
+    )
+    issue = SimpleNamespace(notes=SimpleNamespace(create=notes.append))
+    monkeypatch.setattr(gino.notion, "client", lambda: notion)
+    monkeypatch.setattr(gino.notion, "_bot_user_id", lambda: "bot")
+    monkeypatch.setattr(
+        gino.notion,
+        "blocks_to_markdown",
+        lambda blocks: "\n".join(gino.notion._block_text(b) for b in blocks),
+    )
+    monkeypatch.setattr(gino.gitlab, "get_issue_by_url", lambda url: issue)
+    return notes
+
+
+def test_blocks_are_forwarded_once(monkeypatch):
+    gino.state.set_backend(gino.state.MemoryBackend())
+    # blocks created before the ledger started are only recorded.
+    old = _block("old", created_time="2000-01-01T00:00:00.000Z")
+    edited = _block("hello")
+    blocks = [
+        old,
+        edited,
+        _block("by gino", author="bot"),
+        _block("a note :from-gitlab: echoed"),
+    ]
+    notes = _fake_notion(monkeypatch, blocks)
+    page = dict(url="https://notion/page", properties=dict(URL=dict(url="issue")))
+    page_uuid = uuid.uuid4().hex
+
+    gino.notion.sync_recently_added_blocks_page(page_uuid, page)
+    assert [n["body"] for n in notes] == ["_from:notion_: <https://notion/page>hello"]
+    assert len(dict(gino.state.backend().items(gino.state.BLOCKS))) == 4
+
+    # nothing is sent again, unless a block is edited.
+    gino.notion.sync_recently_added_blocks_page(page_uuid, page)
+    assert len(notes) == 1
+    edited["paragraph"]["rich_text"][0]["plain_text"] = "hello again"
+    gino.notion.sync_recently_added_blocks_page(page_uuid, page)
+    assert notes[-1]["body"].endswith("hello again")
+    assert len(notes) == 2
+
+
+def test_metrics_changeset():
+    index = {
+        "A": [("p1", "Alpha")],
+        "B": [("p2", "Beta"), ("p3", "Beta")],
+        "C": [("p4", "Gamma")],
+    }
+    metrics = {"A": "Alpha", "B": "Bravo", "D": "Delta"}
+    changes = gino.notion.metrics_changeset(index, metrics)
+    assert changes["inserts"] == [("D", "Delta")]
+    assert changes["renames"] == [("p2", "B", "Beta", "Bravo")]
+    assert changes["orphans"] == [("p4", "C")]
+    assert changes["duplicates"] == [("p3", "B")]
+
+
+def test_unchanged_metrics_need_no_writes():
+    index = {"A": [("p1", "Alpha")]}
+    changes = gino.notion.metrics_changeset(index, {"A": "Alpha"})
+    assert not changes["inserts"] and not changes["renames"]
+
+
+def _texts(block):
+    return [r["text"]["content"] for r in block["paragraph"]["rich_text"]]
+
+
+def test_create_blocks_splits_long_text():
+    n = gino.notion.MAX_TEXT_LENGTH
+    assert [_texts(b) for b in gino.notion._create_blocks("")] == [[""]]
+    assert [_texts(b) for b in gino.notion._create_blocks("a" * n)] == [["a" * n]]
+    blocks = gino.notion._create_blocks("a" * n + "b")
+    assert [_texts(b) for b in blocks] == [["a" * n, "b"]]
+
+
+def test_create_blocks_limits_rich_texts_per_block():
+    n, m = gino.notion.MAX_TEXT_LENGTH, gino.notion.MAX_RICH_TEXTS
+    assert len(gino.notion._create_blocks("x" * n * m)) == 1
+    blocks = gino.notion._create_blocks("x" * (n * m + 1))
+    assert [len(_texts(b)) for b in blocks] == [m, 1]
+    assert "".join(t for b in blocks for t in _texts(b)) == "x" * (n * m + 1)
+
+
+def test_append_blocks_in_batches(monkeypatch):
+    calls = []
+
+    class _Children:
+        def append(self, block_id, children):
+            calls.append(len(children))
+
+    class _Client:
+        class blocks:
+            children = _Children()
+
+    monkeypatch.setattr(gino.notion, "client", _Client)
+    limit = gino.notion.MAX_BLOCKS_PER_REQUEST
+    for nblocks, expected in ((limit, [limit]), (limit + 1, [limit, 1]), (0, [])):
+        calls.clear()
+        gino.notion._append_blocks("page", [{}] * nblocks)
+        assert calls == expected
+
+
+def test_select_blocks():
+    started_at = datetime(2024, 5, 1, tzinfo=timezone.utc)
+    old = _block("old", created_time="2024-04-01T10:00:00.000Z")
+    sent = _block("sent")
+    edited = _block("edited now")
+    blocks = dict(
+        new=_block("new"),
+        old=old,
+        bot=_block("by gino", author="bot"),
+        echo=_block("a note :from-gitlab: echoed"),
+        sent=sent,
+        edited=edited,
+    )
+    ledger = dict(sent=gino.notion._block_digest(sent), edited=1)
+    forward, digests = gino.notion.select_blocks(blocks, ledger, started_at, "bot")
+    assert forward == [blocks["new"], edited]
+    # everything that changed is recorded, even if it is not forwarded.
+    assert set(digests) == {"new", "old", "bot", "echo", "edited"}
+    assert digests["edited"] == gino.notion._block_digest(edited)
+
+    # once recorded, nothing is sent again.
+    forward, digests = gino.notion.select_blocks(
+        blocks, {**ledger, **digests}, started_at, "bot"
+    )
+    assert forward == [] and digests == {}
+
+
+def test_blocks_are_not_recorded_in_dry_run(monkeypatch):
+    gino.state.set_backend(gino.state.MemoryBackend())
+    block = _block("hello world", created_time="2099-01-01T00:00:00.000Z")
+    children = SimpleNamespace(list=None)
+    notion = SimpleNamespace(blocks=SimpleNamespace(children=children))
+    monkeypatch.setattr(gino.notion, "client", lambda: notion)
+    monkeypatch.setattr(gino.notion, "paginate", lambda *a, **kw: [block])
+    monkeypatch.setattr(gino.notion, "_bot_user_id", lambda: "bot")
+    monkeypatch.setattr(gino.notion, "blocks_to_markdown", lambda b: "hello world")
+    monkeypatch.setattr(gino.common, "DRY_RUN", True)
+    page = dict(url="https://notion/page", properties={})
+    gino.notion.sync_recently_added_blocks_page("1" * 32, page)
+    assert dict(gino.state.backend().items(gino.state.BLOCKS)) == {}
+
+
+def _fake_users(monkeypatch):
+    users = [
+        dict(id="1", name="Alice Smith", person=dict(email="alice@example.org")),
+        dict(id="2", name="Bobby Tables", person=dict(email="bob@example.org")),
+    ]
+    calls = []
+
+    def _paginate(function, **kw):
+        calls.append("users")
+        return users
+
+    gino.state.set_backend(gino.state.MemoryBackend())
+    notion = SimpleNamespace(users=SimpleNamespace(list=None))
+    monkeypatch.setattr(gino.notion, "client", lambda: notion)
+    monkeypatch.setattr(gino.notion, "paginate", _paginate)
+    monkeypatch.setitem(gino.notion._USERS, "fetched_at", 0.0)
+    return calls
+
+
+def test_exact_user_match_skips_fuzzy_search(monkeypatch):
+    _fake_users(monkeypatch)
+
+    def _fuzzy(*args):
+        raise AssertionError("fuzzy search")
+
+    monkeypatch.setattr(gino.notion, "_fuzzy_find_user", _fuzzy)
+    assert gino.notion._find_user_by_email("Alice@example.org")["id"] == "1"
+    assert gino.notion._find_user_by_gitlab_user("alice.smith")["id"] == "1"
+    assert gino.notion._find_user_by_gitlab_user("BobbyTables")["id"] == "2"
+
+
+def test_user_directory_and_fuzzy_matches_expire(monkeypatch):
+    calls = _fake_users(monkeypatch)
+    fuzzy = gino.notion._fuzzy_find_user
+    searches = []
+
+    def _fuzzy(*args):
+        searches.append(args[0])
+        return fuzzy(*args)
+
+    monkeypatch.setattr(gino.notion, "_fuzzy_find_user", _fuzzy)
+    assert gino.notion._find_user_by_gitlab_user("bob")["id"] == "2"
+    assert gino.notion._find_user_by_gitlab_user("bob")["id"] == "2"
+    assert calls == ["users"] and searches == ["bob"]
+
+    later = time.time() + gino.notion.USER_MATCH_TTL_SEC + 1
+    monkeypatch.setattr(time, "time", lambda: later)
+    assert gino.notion._find_user_by_gitlab_user("bob")["id"] == "2"
+    assert calls == ["users", "users"] and searches == ["bob", "bob"]
@@ -0,0 +1,30 @@
+from types import SimpleNamespace
+
+import gino.ratelimit
+
+
+def _response(status, headers=None):
+    return SimpleNamespace(status_code=status, headers=headers or {}, close=lambda: 0)
+
+
+def test_retry_after():
+    assert gino.ratelimit.retry_after({"Retry-After": "2"}) == 2.0
+    assert gino.ratelimit.retry_after({}) is None
+    date = "Wed, 21 Oct 2015 07:28:00 GMT"
+    assert gino.ratelimit.retry_after({"Retry-After": date}) == 0.0
+
+
+def test_send_retries_throttled_requests():
+    responses = [_response(429, {"Retry-After": "0"}), _response(200)]
+    before = gino.ratelimit.metrics().get("test", dict(sent=0, retried=0))
+    response = gino.ratelimit.send("test", "POST", lambda: responses.pop(0))
+    assert response.status_code == 200
+    after = gino.ratelimit.metrics()["test"]
+    assert after["sent"] - before["sent"] == 2
+    assert after["retried"] - before["retried"] == 1
+
+
+def test_post_is_not_retried_on_server_error():
+    responses = [_response(503, {"Retry-After": "0"}), _response(200)]
+    response = gino.ratelimit.send("test", "POST", lambda: responses.pop(0))
+    assert response.status_code == 503
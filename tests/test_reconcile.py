@@ -0,0 +1,69 @@
+from datetime import timedelta
+from types import SimpleNamespace
+
+import gino.common
+import gino.notion
+import gino.reconcile
+import gino.state
+from gino.common import (
+    now_utc,
+    CLOSED_IN_NOTION,
+    LINKED_WITH_NOTION,
+    WAITING_FOR_TRIAGE,
+)
+
+
+def _issue(state, labels=(), created_days_ago=1):
+    created = now_utc() - timedelta(days=created_days_ago)
+    return SimpleNamespace(
+        state=state, labels=list(labels), created_at=created.isoformat()
+    )
+
+
+def test_diff():
+    issues = {
+        "new": _issue("opened"),
+        "old": _issue("opened", created_days_ago=100),
+        "linked": _issue("opened", [LINKED_WITH_NOTION]),
+        "tracked": _issue("opened"),
+        "closed": _issue("closed", [LINKED_WITH_NOTION]),
+        "closed-done": _issue("closed", [LINKED_WITH_NOTION]),
+        "reopened": _issue("closed", [LINKED_WITH_NOTION, CLOSED_IN_NOTION]),
+        "triage": _issue("closed", [LINKED_WITH_NOTION, WAITING_FOR_TRIAGE]),
+    }
+    snapshot = {
+        "tracked": dict(id="1", status="In Progress"),
+        "closed": dict(id="2", status="In Progress"),
+        "closed-done": dict(id="3", status="Done"),
+        "untouched": dict(id="4", status="Todo"),
+        # reopened in notion after the issue was closed.
+        "reopened": dict(id="5", status="In Progress"),
+        "triage": dict(id="6", status="Todo"),
+    }
+    changes = gino.reconcile.diff(issues, snapshot, now_utc() - timedelta(days=7))
+    assert changes == dict(creates={"new"}, updates={"closed"})
+
+
+def test_unchanged_tasks_need_no_writes():
+    issues = {"a": _issue("closed"), "b": _issue("opened")}
+    snapshot = {"a": dict(id="1", status="Done"), "b": dict(id="2", status="Todo")}
+    changes = gino.reconcile.diff(issues, snapshot, now_utc() - timedelta(days=7))
+    assert changes == dict(creates=set(), updates=set())
+
+
+def test_closed_task_gets_the_status_of_the_sync(monkeypatch):
+    gino.state.set_backend(gino.state.MemoryBackend())
+    changes = []
+    monkeypatch.setattr(gino.notion, "change_page_status", lambda *a: changes.append(a))
+    issue = _issue("closed", [LINKED_WITH_NOTION, WAITING_FOR_TRIAGE])
+    issue.project_id, issue.iid, issue.web_url = 3, 4, "https://gitlab/g/p/-/issues/4"
+    issue.notes = SimpleNamespace(create=lambda note: changes.append(note["body"]))
+    issue.save = lambda: changes.append(list(issue.labels))
+    gino.common.index_issue_page(3, 4, "1" * 32)
+
+    gino.reconcile._close_task(issue)
+    assert changes == [
+        ("1" * 32, "Todo"),
+        "Changed status of linked notion page",
+        [LINKED_WITH_NOTION, WAITING_FOR_TRIAGE, CLOSED_IN_NOTION],
+    ]
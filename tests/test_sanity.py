@@ -1,12 +1,12 @@
-def tgino.st_imports():
-    import cmo
-    print(dir(gino.)
-
-    import gino.metric
-
-
-    print(dir(gino.metric))
-    assert "available_metrics" in dir(gino.metric)
+def test_imports():
+    import gino.common
+    import gino.metrics
+    import gino.ratelimit
+    import gino.state
+
+    assert callable(gino.state.backend)
+    assert callable(gino.metrics.timed)
+    assert gino.common.NUM_WORKERS > 0
 
 
 def test_foo():
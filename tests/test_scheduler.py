@@ -0,0 +1,91 @@
+import gino.common
+import gino.state
+from gino.scheduler import Job, Scheduler
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1_000_000.0
+
+    def __call__(self):
+        return self.now
+
+
+def _scheduler(jobs, off_hours=False):
+    gino.state.set_backend(gino.state.MemoryBackend())
+    clock = Clock()
+    return Scheduler(jobs, lambda: off_hours, clock=clock), clock
+
+
+def test_jobs_run_by_priority_and_interval():
+    calls = []
+    jobs = [
+        Job("slow", lambda _: calls.append("slow"), 600, priority=1),
+        Job("fast", lambda _: calls.append("fast"), 300, priority=0),
+    ]
+    scheduler, clock = _scheduler(jobs)
+    scheduler.step()
+    assert calls == ["fast", "slow"]
+    clock.now += 300
+    scheduler.step()
+    assert calls == ["fast", "slow", "fast"]
+    assert scheduler.sleep_time() == 60
+
+
+def test_heavy_jobs_wait_for_off_hours():
+    calls = []
+    heavy = Job(
+        "sweep", lambda budget: calls.append(budget), 86400, budget=10, off_hours=True
+    )
+    scheduler, _ = _scheduler([heavy])
+    scheduler.step()
+    assert calls == [] and not heavy.running
+
+    scheduler.is_off_hours = lambda: True
+    scheduler.step()
+    scheduler._heavy.shutdown(wait=True)
+    assert calls == [10] and not heavy.running
+
+
+def test_backlog_runs_the_job_early():
+    backlog = [True, False]
+    job = Job("sync", lambda _: backlog.pop(0), 3600, backlog_interval_sec=60)
+    scheduler, clock = _scheduler([job])
+    scheduler.step()
+    assert job.next_at == clock.now + 60
+    clock.now += 60
+    scheduler.step()
+    assert job.next_at == clock.now + 3600
+
+
+def test_failed_job_is_retried_and_restart_keeps_schedule():
+    def _fail(_):
+        raise RuntimeError("boom")
+
+    scheduler, clock = _scheduler([Job("bad", _fail, 3600)])
+    scheduler.step()
+    assert scheduler.jobs[0].next_at == clock.now + 60
+
+    daily = Job("daily", lambda _: None, 86400)
+    scheduler = Scheduler([daily], lambda: True, clock=clock)
+    scheduler.step()
+    # a new scheduler does not run the job again before its interval.
+    again = Job("daily", lambda _: None, 86400)
+    Scheduler([again], lambda: True, clock=clock)
+    assert again.next_at == clock.now + 86400
+
+
+def test_missing_dependency_is_not_a_backlog():
+    def _task_maturity(_):
+        raise ImportError("No module named 'numpy'")
+
+    scheduler, clock = _scheduler([Job("task-maturity", _task_maturity, 3600)])
+    scheduler.step()
+    assert scheduler.jobs[0].next_at == clock.now + 3600
+
+
+def test_dry_run_does_not_store_job_watermarks(monkeypatch):
+    monkeypatch.setattr(gino.common, "DRY_RUN", True)
+    scheduler, _ = _scheduler([Job("daily", lambda _: None, 86400)])
+    scheduler.step()
+    assert gino.common.load_watermark("scheduler", "daily") is None
@@ -0,0 +1,47 @@
+import pytest
+
+import gino.sharding
+import gino.state
+from gino.sharding import owner, parse_shard
+
+
+def test_parse_shard():
+    shard = parse_shard("1/3")
+    assert (shard.index, shard.count) == (1, 3)
+    for spec in ("3/3", "-1/2", "1", "a/b"):
+        with pytest.raises(ValueError):
+            parse_shard(spec)
+
+
+def test_static_shards_partition_projects():
+    shards = [parse_shard(f"{i}/4") for i in range(4)]
+    owners = [[s.owns(pid) for s in shards] for pid in range(2000)]
+    assert all(sum(row) == 1 for row in owners)
+    counts = [sum(row[i] for row in owners) for i in range(4)]
+    assert min(counts) > 400
+
+
+def test_only_the_projects_of_a_removed_member_move():
+    members = [f"w{i}" for i in range(5)]
+    before = {pid: owner(pid, members) for pid in range(1000)}
+    after = {pid: owner(pid, members[:-1]) for pid in range(1000)}
+    moved = {pid for pid in before if before[pid] != after[pid]}
+    assert moved == {pid for pid in before if before[pid] == "w4"}
+
+
+def test_lease_shards():
+    gino.state.set_backend(gino.state.MemoryBackend())
+    a = gino.sharding.LeaseShard()
+    b = gino.sharding.LeaseShard()
+    b.worker_id = "other"
+    b.heartbeat()
+    assert a.rebalanced() and b.rebalanced()
+    assert not a.rebalanced()
+    owned = [pid for pid in range(200) if a.owns(pid)]
+    assert owned and all(not b.owns(pid) for pid in owned)
+
+    # when b leaves, a owns all the projects.
+    b.stop()
+    assert a.rebalanced()
+    assert all(a.owns(pid) for pid in range(200))
+    a.stop()
@@ -0,0 +1,71 @@
+import time
+import threading
+
+import pytest
+
+import gino.state
+
+
+def _backends(tmp_path):
+    return [gino.state.MemoryBackend(), gino.state.SqliteBackend(tmp_path / "s.db")]
+
+
+def test_get_put(tmp_path):
+    for state in _backends(tmp_path):
+        assert state.get("dedupe", "a") is None
+        state.put("dedupe", "a", dict(x=1))
+        state.put_many("index", {"a": 1, "b": (2, 3)})
+        assert state.get("dedupe", "a") == dict(x=1)
+        assert state.get_many("index", ["a", "b", "c"]) == {"a": 1, "b": (2, 3)}
+        assert dict(state.items("index")) == {"a": 1, "b": (2, 3)}
+        state.delete("index", "a")
+        assert state.get("index", "a") is None
+
+
+def test_ttl(tmp_path):
+    for state in _backends(tmp_path):
+        state.put("cache", "k", 1, ttl_sec=0.01)
+        state.put("cache", "forever", 2)
+        time.sleep(0.02)
+        assert state.get("cache", "k") is None
+        assert state.get("cache", "forever") == 2
+        state.purge_expired()
+        assert dict(state.items("cache")) == {"forever": 2}
+
+
+def test_purge_expired_frees_memory():
+    state = gino.state.MemoryBackend()
+    state.put("cache", "k", 1, ttl_sec=-1)
+    state.put("cache", "forever", 2)
+    state.purge_expired()
+    assert list(state._data["cache"]) == ["forever"]
+
+
+def test_sqlite_is_thread_safe(tmp_path):
+    state = gino.state.SqliteBackend(tmp_path / "s.db")
+
+    def _writer(i):
+        state.put_many("watermarks", {f"{i}-{j}": j for j in range(50)})
+
+    threads = [threading.Thread(target=_writer, args=(i,)) for i in range(8)]
+    [t.start() for t in threads]
+    [t.join() for t in threads]
+    assert len(dict(state.items("watermarks"))) == 8 * 50
+
+
+def test_claim(tmp_path):
+    for state in _backends(tmp_path):
+        assert state.claim("leases", "p", "a", ttl_sec=0.05)
+        assert state.claim("leases", "p", "a", ttl_sec=0.05)
+        assert not state.claim("leases", "p", "b", ttl_sec=0.05)
+        time.sleep(0.06)
+        assert state.claim("leases", "p", "b", ttl_sec=0.05)
+
+
+def test_incomplete_backend_cannot_be_created():
+    class _Incomplete(gino.state.StateBackend):
+        def get_many(self, namespace, keys):
+            return {}
+
+    with pytest.raises(TypeError):
+        _Incomplete()
@@ -0,0 +1,95 @@
+from types import SimpleNamespace
+
+import pytest
+
+import gino.gitlab
+import gino.webhook
+
+
+def _fake_gitlab(monkeypatch, linked=True):
+    calls = []
+    issue = SimpleNamespace(iid=4)
+    project = SimpleNamespace(id=3, issues=SimpleNamespace(get=lambda iid: issue))
+    client = SimpleNamespace(projects=SimpleNamespace(get=lambda pid, **kw: project))
+    monkeypatch.setattr(gino.gitlab, "get_gitlab_client", lambda: client)
+    monkeypatch.setattr(
+        gino.gitlab,
+        "link_issue_with_notion",
+        lambda project, issue: calls.append(("link", issue.iid)),
+    )
+    monkeypatch.setattr(
+        gino.gitlab,
+        "change_notion_task_status",
+        lambda issue: calls.append(("status", issue.iid)),
+    )
+    monkeypatch.setattr(gino.gitlab, "is_linked_with_notion", lambda issue: linked)
+    monkeypatch.setattr(
+        gino.gitlab,
+        "sync_issue_notes",
+        lambda issue: calls.append(("notes", issue.iid)),
+    )
+    return calls
+
+
+def _issue_event(action):
+    return dict(
+        object_kind="issue",
+        project=dict(id=3),
+        object_attributes=dict(iid=4, action=action),
+    )
+
+
+def test_issue_events_are_dispatched(monkeypatch):
+    calls = _fake_gitlab(monkeypatch)
+    for action in ("open", "reopen", "close", "update"):
+        gino.webhook.handle_event(_issue_event(action))
+    assert calls == [("link", 4), ("link", 4), ("status", 4)]
+
+
+def test_note_events_sync_linked_issues(monkeypatch):
+    event = dict(
+        object_kind="note",
+        project=dict(id=3),
+        issue=dict(iid=4),
+        object_attributes=dict(noteable_type="Issue"),
+    )
+    calls = _fake_gitlab(monkeypatch)
+    gino.webhook.handle_event(event)
+    gino.webhook.handle_event(
+        {**event, "object_attributes": dict(noteable_type="MergeRequest")}
+    )
+    assert calls == [("notes", 4)]
+
+    calls = _fake_gitlab(monkeypatch, linked=False)
+    gino.webhook.handle_event(event)
+    assert calls == []
+
+
+def test_bad_events_are_ignored(monkeypatch):
+    calls = _fake_gitlab(monkeypatch)
+    gino.webhook.handle_event(dict(object_kind="pipeline"))
+    # a malformed event is logged, not raised.
+    gino.webhook.handle_event(dict(object_kind="issue", project=dict(id=3)))
+    assert calls == []
+
+
+def test_secret_token_is_checked():
+    assert gino.webhook._is_authorized("s3cret", "s3cret")
+    assert not gino.webhook._is_authorized("wrong", "s3cret")
+    assert not gino.webhook._is_authorized(None, "s3cret")
+    assert gino.webhook._is_authorized(None, None)
+
+
+def test_refuse_to_serve_without_secret(monkeypatch):
+    monkeypatch.delenv("GITLAB_WEBHOOK_SECRET", raising=False)
+    with pytest.raises(RuntimeError):
+        gino.webhook.serve("0.0.0.0", 0, workers=1)
+    assert gino.webhook._is_loopback("127.0.0.1")
+    assert gino.webhook._is_loopback("::1")
+    assert not gino.webhook._is_loopback("example.com")
+
+
+def test_issue_locks_are_bounded():
+    locks = {id(gino.webhook._issue_lock(1, iid)) for iid in range(10_000)}
+    assert len(locks) <= len(gino.webhook._ISSUE_LOCKS)
+    assert gino.webhook._issue_lock(3, 4) is gino.webhook._issue_lock(3, 4)